@@ -0,0 +1,213 @@
+"""Нагрузочный тест трансляции штрихов на localhost
+
+Ведущий (StrokeBroadcaster) работает в этом процессе и раз в кадр
+отдает пачку точек текущего штриха, как это делает InputBatcher окна
+рисования; каждые --stroke-points точек штрих заканчивается и уходит
+целиком. Зрители (StrokeReceiver) запускаются в нескольких процессах,
+чтобы не делить GIL с ведущим, и забирают события каждую миллисекунду.
+Последней идет очистка - по ней зрители заканчивают прием.
+
+Меряется:
+  - время вызовов раздатчика в потоке ведущего (столько он отнимает у Tk за кадр);
+  - задержка доставки готового штриха от вызова add() до его прихода зрителю;
+  - сколько штрихов и точек дошло до каждого зрителя и сколько зрителей
+    отключено как не успевающие.
+Дисплей не нужен:
+
+    python benchmarks/bench_broadcast.py --clients 64 --points-per-second 8000
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from array import array
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from rabpaint_broadcast import (  # noqa: E402
+    JOURNAL_ADD, JOURNAL_CLEAR, LIVE_POINTS, StrokeBroadcaster, StrokeReceiver
+)
+from rabpaint_engine import Stroke  # noqa: E402
+
+def client_worker(address, count, ready, results):
+    """Процесс с count зрителями; отдает {sid: время прихода} и число точек каждого"""
+    receivers = [StrokeReceiver(address, retry_interval=0.05) for _ in range(count)]
+    for receiver in receivers:
+        receiver.start()
+    while not all(receiver.connected for receiver in receivers):
+        time.sleep(0.01)
+    ready.put(count)
+    
+    arrivals = [{} for _ in receivers]
+    points = [0] * count
+    running = set(range(count))
+    while running:
+        time.sleep(0.001)
+        for i in list(running):
+            for kind, value in receivers[i].take():
+                if kind == LIVE_POINTS:
+                    points[i] += len(value) // 2
+                elif kind == JOURNAL_ADD:
+                    arrivals[i][value[0]] = time.time()
+                elif kind == JOURNAL_CLEAR:
+                    running.discard(i)
+            if not receivers[i].connected and receivers[i].frames_received:
+                running.discard(i)
+    for receiver in receivers:
+        receiver.close()
+    results.put([(arrivals[i], points[i]) for i in range(count)])
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def run(args):
+    if args.transport == 'unix':
+        address = 'unix:' + os.path.join(tempfile.mkdtemp(prefix='rabpaint_bcast_'), 'share.sock')
+    else:
+        address = f'127.0.0.1:{args.port}'
+    broadcaster = StrokeBroadcaster(address)
+    broadcaster.start()
+    
+    ready, results = multiprocessing.Queue(), multiprocessing.Queue()
+    per_process = [args.clients // args.processes + (i < args.clients % args.processes)
+                   for i in range(args.processes)]
+    workers = [multiprocessing.Process(target=client_worker, args=(address, n, ready, results))
+               for n in per_process if n]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        ready.get(timeout=60)
+    
+    frame = 1.0 / args.fps
+    batch = max(1, round(args.points_per_second / args.fps))
+    call_times = []
+    sent = {}
+    sent_points = 0
+    sid = 0
+    x, y = 100.0, 100.0
+    stroke_points = []
+    start = time.perf_counter()
+    next_frame = start
+    while time.perf_counter() - start < args.seconds:
+        xy = []
+        for i in range(batch):
+            x = 100.0 + (x + 3.0) % 1700
+            y = 100.0 + (y + 1.7) % 900
+            xy.extend((x, y))
+        
+        t = time.perf_counter()
+        if not stroke_points:
+            broadcaster.begin(xy[0], xy[1], 'red', 3, 0)
+        broadcaster.points(xy)
+        stroke_points.extend(xy)
+        if len(stroke_points) >= 2 * args.stroke_points:
+            broadcaster.end()
+            sid += 1
+            sent[sid] = time.time()
+            broadcaster.add(sid, Stroke(array('f', stroke_points), 'red', 3, z=sid))
+            stroke_points = []
+        call_times.append((time.perf_counter() - t) * 1000)
+        sent_points += batch
+        
+        next_frame += frame
+        delay = next_frame - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    elapsed = time.perf_counter() - start
+    broadcaster.clear()
+    
+    clients = []
+    for worker in workers:
+        clients.extend(results.get(timeout=120))
+    for worker in workers:
+        worker.join()
+    broadcaster.close()
+    
+    latencies = [(arrivals[s] - sent[s]) * 1000 for arrivals, points in clients
+                 for s in sent if s in arrivals]
+    complete = sum(1 for arrivals, points in clients if len(arrivals) == len(sent))
+    return {
+        'transport': args.transport,
+        'clients': args.clients,
+        'processes': len(workers),
+        'seconds': round(elapsed, 2),
+        'fps': args.fps,
+        'points_per_second': round(sent_points / elapsed),
+        'strokes_sent': len(sent),
+        'frames_sent': broadcaster.frames_sent,
+        'mb_sent': round(broadcaster.bytes_sent / 2**20, 1),
+        'dropped_clients': broadcaster.dropped_clients,
+        'clients_complete': complete,
+        'client_points_min': min(points for arrivals, points in clients),
+        'presenter_call_ms': {
+            'mean': round(statistics.mean(call_times), 4),
+            'p99': round(percentile(call_times, 99), 4),
+            'max': round(max(call_times), 3),
+        },
+        'stroke_latency_ms': {
+            'p50': round(percentile(latencies, 50), 2),
+            'p95': round(percentile(latencies, 95), 2),
+            'p99': round(percentile(latencies, 99), 2),
+            'max': round(max(latencies), 2),
+        } if latencies else None,
+    }
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест трансляции штрихов")
+    parser.add_argument('-o', '--output', default='bench_broadcast.json')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 16, 64])
+    parser.add_argument('--processes', type=int, default=max(1, min(8, (os.cpu_count() or 2) - 1)))
+    parser.add_argument('--transport', choices=('tcp', 'unix'), nargs='+', default=['tcp', 'unix'])
+    parser.add_argument('--port', type=int, default=47811)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--fps', type=float, default=60.0)
+    parser.add_argument('--points-per-second', type=float, default=8000.0,
+                        help="точек в секунду от ведущего (мышь 1000 Гц дает ~1000)")
+    parser.add_argument('--stroke-points', type=int, default=400)
+    args = parser.parse_args(argv)
+    
+    runs = []
+    for transport in args.transport:
+        for clients in args.clients:
+            run_args = argparse.Namespace(**vars(args))
+            run_args.transport, run_args.clients = transport, clients
+            run_args.processes = min(args.processes, clients)
+            result = run(run_args)
+            runs.append(result)
+            latency = result['stroke_latency_ms'] or {}
+            print(f"{transport} x{clients}: {result['points_per_second']} точек/с, "
+                  f"вызовы ведущего {result['presenter_call_ms']['mean']:.3f} мс/кадр "
+                  f"(макс {result['presenter_call_ms']['max']:.2f}), "
+                  f"задержка штриха p50 {latency.get('p50')} / p99 {latency.get('p99')} мс, "
+                  f"дошло всем {result['clients_complete']}/{clients}, "
+                  f"отключено {result['dropped_clients']}")
+    
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'runs': runs,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""Бенчмарк копирования в буфер обмена: снимок + BMP против PNG из кэша полос
+
+Раньше копирование снимало рисунок в размере холста и кодировало его в
+BMP (CF_DIB) прямо в потоке Tk. Теперь в потоке Tk только копируются
+измененные полосы (PNGTileCache.prepare), а PNG сжимается в пуле
+экспорта; Win32Clipboard получает DIB из того же PNG и переиспользует
+его, пока PNG не сменится. Для каждого размера меряется:
+  - grab_bmp: снимок + BMP, как было (все в потоке Tk);
+  - png_first: первое копирование - prepare + сжатие всех полос;
+  - png_unchanged: повторное без изменений - готовый PNG;
+  - png_small_change: после мазка - пережимается одна полоса;
+  - dib_first / dib_reused: DIB для Windows из нового и того же PNG.
+Время потока Tk (tk_ms) печатается отдельно от полного. Дисплей и
+pywin32 не нужны - DIB кладется в поддельный буфер:
+
+    python benchmarks/bench_clipboard.py --size 1920x1080 3840x2160
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import types
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from rabpaint_engine import PNGTileCache, Win32Clipboard  # noqa: E402
+
+def make_image(size, strokes, seed=16):
+    """Каракули толщиной 3-6 на белом, как рисунок поверх экрана"""
+    rnd = random.Random(seed)
+    image = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(image)
+    for _ in range(strokes):
+        x, y = rnd.uniform(0, size[0]), rnd.uniform(0, size[1])
+        points = []
+        for _ in range(60):
+            x += rnd.uniform(-12, 12)
+            y += rnd.uniform(-12, 12)
+            points.append((x, y))
+        draw.line(points, fill=rnd.choice(('red', 'blue', 'black')), width=rnd.choice((3, 6)))
+    return image
+
+def grab_bmp(image, size):
+    """Старый путь: снимок в размере холста и BMP без заголовка файла"""
+    output = io.BytesIO()
+    image.crop((0, 0) + size).convert('RGB').save(output, 'BMP')
+    return output.getvalue()[14:]
+
+def timed(func, runs):
+    """Медиана времени func() в мс; func возвращает (мс в потоке Tk, результат)"""
+    totals, tk_times = [], []
+    result = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        tk_ms, result = func()
+        totals.append((time.perf_counter() - start) * 1000)
+        tk_times.append(tk_ms)
+    return statistics.median(tk_times), statistics.median(totals), result
+
+def fake_win32clipboard():
+    data = {}
+    sys.modules['win32clipboard'] = types.SimpleNamespace(
+        CF_DIB=8, RegisterClipboardFormat=lambda name: 0xC000, OpenClipboard=lambda: None,
+        EmptyClipboard=data.clear, SetClipboardData=data.__setitem__, CloseClipboard=lambda: None,
+    )
+    return data
+
+def bench_size(size, strokes, runs):
+    image = make_image(size, strokes)
+    rnd = random.Random(5)
+    results = {}
+
+    def old():
+        start = time.perf_counter()
+        dib = grab_bmp(image, size)
+        return (time.perf_counter() - start) * 1000, len(dib)
+
+    def png(cache, dirty=None):
+        def run():
+            if dirty is not None:
+                cache.mark_dirty(dirty())
+            start = time.perf_counter()
+            job = cache.prepare(image, size)
+            tk_ms = (time.perf_counter() - start) * 1000
+            return tk_ms, len(cache.encode(job))
+        return run
+
+    def stroke():
+        x, y = rnd.uniform(0, size[0] - 60), rnd.uniform(0, size[1] - 20)
+        box = (x, y, x + 60, y + 20)
+        ImageDraw.Draw(image).line([(x, y), (x + 60, y + 20)], fill='green', width=4)
+        return box
+
+    def first():
+        return png(PNGTileCache())()
+
+    cache = PNGTileCache()
+    cache.encode(cache.prepare(image, size))
+    results['grab_bmp'] = timed(old, runs)
+    results['png_first'] = timed(first, runs)
+    results['png_unchanged'] = timed(png(cache), runs)
+    results['png_small_change'] = timed(png(cache, stroke), runs)
+
+    fake_win32clipboard()
+    pngs = []
+    for _ in range(runs + 1):
+        cache.mark_dirty(stroke())
+        pngs.append(cache.encode(cache.prepare(image, size)))
+    backend = Win32Clipboard()
+    backend.copy_png(pngs[0])
+    fresh = iter(pngs[1:])
+
+    # DIB получается в пуле экспорта - поток Tk он не занимает
+    def dib_first():
+        backend.copy_png(next(fresh))
+        return 0.0, len(backend.dib)
+
+    def dib_reused():
+        backend.copy_png(backend.png)
+        return 0.0, len(backend.dib)
+
+    results['dib_first'] = timed(dib_first, runs)
+    results['dib_reused'] = timed(dib_reused, runs)
+    return results
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк копирования в буфер обмена")
+    parser.add_argument('-o', '--output', default='bench_clipboard.json')
+    parser.add_argument('--size', nargs='+', default=['1920x1080', '3840x2160'], help="размеры WxH")
+    parser.add_argument('--strokes', type=int, default=300)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    report_sizes = []
+    for text in args.size:
+        size = tuple(int(v) for v in text.lower().split('x'))
+        results = bench_size(size, args.strokes, args.runs)
+        rows = {}
+        for name, (tk_ms, total_ms, result) in results.items():
+            rows[name] = {'tk_ms': round(tk_ms, 2), 'total_ms': round(total_ms, 2), 'bytes': result}
+            print(f"{text} {name}: поток Tk {tk_ms:.2f} мс, всего {total_ms:.2f} мс, "
+                  f"данные {result / 2**10:.0f} КБ")
+        report_sizes.append({'size': list(size), 'results': rows})
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'strokes': args.strokes,
+        'sizes': report_sizes,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
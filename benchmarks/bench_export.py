@@ -0,0 +1,129 @@
+"""Бенчмарк экспорта PNG для печати: полосы в пуле процессов
+
+Строит синтетический сеанс (случайные каракули и несколько заливок) и
+рендерит его через `rabpaint_engine.py --scale` с разным увеличением
+и числом процессов, каждый запуск - отдельным процессом. Меряется:
+  - время рендера и пропускная способность в мегапикселях в секунду;
+  - пиковая память (RSS) самого большого процесса - ведущего или
+    процесса пула; она должна зависеть от высоты полосы, а не от
+    размера картинки (для сравнения печатается размер картинки в RGB).
+Пиковая память берется из os.wait4, поэтому есть только на Linux/macOS.
+Дисплей не нужен:
+
+    python benchmarks/bench_export.py --scale 2 4 --jobs 1 2 4 8
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENGINE_PATH = os.path.join(REPO_DIR, 'rabpaint_engine.py')
+sys.path.insert(0, REPO_DIR)
+
+from rabpaint_engine import Stroke, write_journal_snapshot  # noqa: E402
+
+def make_session(path, size, strokes, points, seed=1):
+    """Каракули по всему экрану и прямоугольники-заливки, как после долгого сеанса"""
+    rnd = random.Random(seed)
+    width, height = size
+    result = []
+    for i in range(strokes):
+        x, y = rnd.uniform(0, width), rnd.uniform(0, height)
+        xy = []
+        for _ in range(points):
+            x = min(width, max(0, x + rnd.uniform(-12, 12)))
+            y = min(height, max(0, y + rnd.uniform(-12, 12)))
+            xy.extend((x, y))
+        result.append(Stroke(xy, rnd.choice(('red', 'blue', 'black', 'green')), rnd.choice((3, 6))))
+        if i % 1000 == 0:
+            x, y = rnd.uniform(0, width - 200), rnd.uniform(0, height - 200)
+            result.append(Stroke([x, y, x + 200, y + 150], 'yellow', 0, 'rect'))
+    write_journal_snapshot(result, path)
+
+def run_export(session, output_dir, size, scale, jobs):
+    """Один рендер отдельным процессом; возвращает (секунды, пиковый RSS в МБ или None)"""
+    command = [sys.executable, ENGINE_PATH, session, '-o', output_dir,
+               '--size', f'{size[0]}x{size[1]}', '--scale', str(scale), '-j', str(jobs)]
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if hasattr(os, 'wait4'):
+        pid, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        # ru_maxrss в килобайтах на Linux и в байтах на macOS
+        peak = usage.ru_maxrss / (2**20 if sys.platform == 'darwin' else 2**10)
+    else:
+        process.wait()
+        peak = None
+    elapsed = time.perf_counter() - start
+    if process.returncode:
+        raise RuntimeError(process.stderr.read().decode('utf-8', 'replace').strip())
+    return elapsed, peak
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк экспорта PNG для печати")
+    parser.add_argument('-o', '--output', default='bench_export.json')
+    parser.add_argument('--size', default='1920x1080', help="размер экрана WxH до увеличения")
+    parser.add_argument('--strokes', type=int, default=20000)
+    parser.add_argument('--points', type=int, default=40, help="точек в штрихе")
+    parser.add_argument('--scale', type=float, nargs='+', default=[2.0, 4.0])
+    parser.add_argument('--jobs', type=int, nargs='+', default=sorted({1, 2, os.cpu_count() or 1}))
+    parser.add_argument('--runs', type=int, default=2, help="запусков на вариант, берется лучший")
+    args = parser.parse_args(argv)
+
+    size = tuple(int(v) for v in args.size.lower().split('x'))
+    workdir = tempfile.mkdtemp(prefix='rabpaint_bench_export_')
+    session = os.path.join(workdir, 'bench.journal')
+    make_session(session, size, args.strokes, args.points)
+
+    runs = []
+    for scale in args.scale:
+        width, height = round(size[0] * scale), round(size[1] * scale)
+        for jobs in args.jobs:
+            results = [run_export(session, workdir, size, scale, jobs)
+                       for _ in range(args.runs)]
+            seconds = min(elapsed for elapsed, peak in results)
+            peaks = [peak for elapsed, peak in results if peak is not None]
+            result = {
+                'scale': scale,
+                'jobs': jobs,
+                'output_size': [width, height],
+                'seconds': round(seconds, 3),
+                'mpix_per_second': round(width * height / 1e6 / seconds, 1),
+                'peak_rss_mb': round(max(peaks), 1) if peaks else None,
+                'image_rgb_mb': round(width * height * 3 / 2**20, 1),
+                'png_mb': round(os.path.getsize(os.path.join(workdir, 'bench.png')) / 2**20, 2),
+            }
+            runs.append(result)
+            print(f"x{scale:g} ({width}x{height}), {jobs} проц.: {result['seconds']} с, "
+                  f"{result['mpix_per_second']} Мпикс/с, пик памяти {result['peak_rss_mb']} МБ "
+                  f"(картинка целиком - {result['image_rgb_mb']} МБ)")
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'strokes': args.strokes,
+        'points_per_stroke': args.points,
+        'runs': runs,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
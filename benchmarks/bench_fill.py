@@ -0,0 +1,124 @@
+"""Бенчмарк заливки: flood_fill_mask на картинке размером с экран
+
+Рисует три сцены размером --size (по умолчанию 4K): пустой экран,
+случайные каракули (--strokes) и страницу рукописного текста, где
+отрезков строк сотни тысяч, - и заливает фон из угла и из случайных
+точек. Для каждой сцены печатаются медиана и лучшее время в мс;
+заливка фона на весь экран должна укладываться в TARGET_MS. Дисплей
+не нужен:
+
+    python benchmarks/bench_fill.py --size 3840x2160 --strokes 200 2000
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from rabpaint_engine import flood_fill_mask  # noqa: E402
+
+# Заливка - по нажатию мыши, в Tk-потоке: дольше - заметная задержка
+TARGET_MS = 100.0
+
+def scribbles(size, strokes, seed=21):
+    """Каракули толщиной 3 по всему экрану"""
+    rnd = random.Random(seed)
+    image = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(image)
+    for _ in range(strokes):
+        x, y = rnd.uniform(0, size[0]), rnd.uniform(0, size[1])
+        points = []
+        for _ in range(rnd.randint(20, 200)):
+            x += rnd.uniform(-15, 15)
+            y += rnd.uniform(-15, 15)
+            points.append((x, y))
+        draw.line(points, fill=rnd.choice(('red', 'blue', 'black')), width=3)
+    return image
+
+def text_page(size, seed=3):
+    """Строки "букв" через 50 пикселей: много узких отрезков фона"""
+    rnd = random.Random(seed)
+    width, height = size
+    image = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(image)
+    for row in range(40, height - 40, 50):
+        for x in range(40, width - 80, 28):
+            draw.line([(x + rnd.uniform(0, 20), row + rnd.uniform(-15, 15)) for _ in range(12)],
+                      fill='black', width=3)
+    return image
+
+def time_fill(image, point, runs):
+    flood_fill_mask(image, *point)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        found = flood_fill_mask(image, *point)
+        times.append((time.perf_counter() - start) * 1000)
+    return times, found
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк заливки")
+    parser.add_argument('-o', '--output', default='bench_fill.json')
+    parser.add_argument('--size', default='3840x2160', help="размер картинки WxH")
+    parser.add_argument('--strokes', type=int, nargs='+', default=[200, 2000])
+    parser.add_argument('--points', type=int, default=3, help="случайных точек заливки в сцене")
+    parser.add_argument('--runs', type=int, default=7, help="заливок на точку")
+    args = parser.parse_args(argv)
+
+    size = tuple(int(v) for v in args.size.lower().split('x'))
+    scenes = [('empty', scribbles(size, 0))]
+    scenes += [(f'strokes_{count}', scribbles(size, count)) for count in args.strokes]
+    scenes.append(('text', text_page(size)))
+
+    rnd = random.Random(5)
+    results = []
+    for name, image in scenes:
+        points = [(5, 5)] + [(rnd.randrange(size[0]), rnd.randrange(size[1]))
+                             for _ in range(args.points)]
+        for point in points:
+            times, found = time_fill(image, point, args.runs)
+            w, h = found[2][:2]
+            result = {
+                'scene': name,
+                'point': list(point),
+                'area_box': [w, h],
+                'median_ms': round(statistics.median(times), 1),
+                'min_ms': round(min(times), 1),
+            }
+            results.append(result)
+            print(f"{name} {point}: рамка {w}x{h}, медиана {result['median_ms']} мс, "
+                  f"лучшее {result['min_ms']} мс")
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'size': list(size),
+        'target_ms': TARGET_MS,
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    slowest = max(result['median_ms'] for result in results)
+    print(f"самая медленная заливка {slowest} мс, цель {TARGET_MS:g} мс")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""Бенчмарк галереи рисунков: первый экран папки с тысячами файлов
+
+Заполняет временную папку копиями нескольких рисунков (PNG на весь
+экран и журналы сеансов) и проходит путь, который делает галерея при
+открытии, без Tk:
+  - scan_drawings - чтение папки и сортировка по времени;
+  - холодный первый экран: миниатюры --screen файлов через
+    ThumbnailLoader в пустом кэше, время до последней готовой;
+  - теплый первый экран: тот же кэш открыт заново (как после перезапуска
+    программы), миниатюры берутся из файла-кэша в памяти.
+Дисплей не нужен:
+
+    python benchmarks/bench_gallery.py --files 5000 --screen 24
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from rabpaint_engine import (  # noqa: E402
+    Stroke, ThumbnailCache, ThumbnailLoader, scan_drawings, write_journal_snapshot
+)
+
+def make_folder(folder, files, size, seed=1):
+    """Копии PNG-снимка экрана и журнала сеанса вперемешку"""
+    from PIL import Image, ImageDraw
+
+    rnd = random.Random(seed)
+    width, height = size
+    strokes = []
+    for _ in range(300):
+        x, y = rnd.uniform(0, width), rnd.uniform(0, height)
+        xy = []
+        for _ in range(30):
+            x = min(width, max(0, x + rnd.uniform(-20, 20)))
+            y = min(height, max(0, y + rnd.uniform(-20, 20)))
+            xy.extend((x, y))
+        strokes.append(Stroke(xy, rnd.choice(('red', 'blue', 'black')), 4))
+
+    image = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(image)
+    for stroke in strokes:
+        draw.line(list(stroke.points), fill=stroke.color, width=stroke.width)
+    png = os.path.join(folder, 'source.png')
+    image.save(png)
+    session = os.path.join(folder, 'source.journal')
+    write_journal_snapshot(strokes, session)
+
+    for i in range(files):
+        source = session if i % 10 == 0 else png
+        shutil.copyfile(source, os.path.join(folder, f'drawing_{i:05d}{os.path.splitext(source)[1]}'))
+    os.remove(png)
+    os.remove(session)
+
+def first_screen(cache, files):
+    """Миниатюры первого экрана: из кэша или через фоновый поток; секунды до последней"""
+    start = time.perf_counter()
+    loader = ThumbnailLoader(cache)
+    loader.start()
+    loader.want(path for path, mtime, size in files)
+    pending = set()
+    for path, mtime, size in files:
+        if cache.get(path, mtime, size) is None:
+            loader.request(path, mtime, size)
+            pending.add(path)
+    while pending:
+        time.sleep(0.001)
+        for path, thumbnail in loader.take():
+            pending.discard(path)
+    elapsed = time.perf_counter() - start
+    loader.close()
+    return elapsed
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк галереи рисунков")
+    parser.add_argument('-o', '--output', default='bench_gallery.json')
+    parser.add_argument('--files', type=int, default=5000)
+    parser.add_argument('--screen', type=int, default=24, help="миниатюр на первом экране")
+    parser.add_argument('--size', default='1920x1080', help="размер рисунков WxH")
+    args = parser.parse_args(argv)
+
+    size = tuple(int(v) for v in args.size.lower().split('x'))
+    folder = tempfile.mkdtemp(prefix='rabpaint_bench_gallery_')
+    make_folder(folder, args.files, size)
+    cache_path = os.path.join(folder, '.thumbnails')
+
+    start = time.perf_counter()
+    files = scan_drawings(folder)
+    scan_seconds = time.perf_counter() - start
+    screen = files[:args.screen]
+
+    cache = ThumbnailCache(cache_path).open()
+    cold_seconds = first_screen(cache, screen)
+    cache.close()
+
+    start = time.perf_counter()
+    cache = ThumbnailCache(cache_path).open()
+    open_seconds = time.perf_counter() - start
+    warm_seconds = first_screen(cache, screen)
+    cache.close()
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'files': len(files),
+        'screen': len(screen),
+        'image_size': list(size),
+        'scan_ms': round(scan_seconds * 1000, 1),
+        'cold_first_screen_ms': round(cold_seconds * 1000, 1),
+        'cache_open_ms': round(open_seconds * 1000, 2),
+        'warm_first_screen_ms': round(warm_seconds * 1000, 2),
+        'cache_file_mb': round(os.path.getsize(cache_path) / 2**20, 1),
+    }
+    print(f"{report['files']} файлов: чтение папки {report['scan_ms']} мс; "
+          f"первый экран ({report['screen']} миниатюр) без кэша {report['cold_first_screen_ms']} мс, "
+          f"из кэша {report['warm_first_screen_ms']} мс (открытие кэша {report['cache_open_ms']} мс)")
+    shutil.rmtree(folder)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,316 @@
+"""Бенчмарк окна рисования: рисование, стирание, очистка, сохранение, прокрутка
+
+Загружает "rabpaint 2.py" без главного цикла, прячет окно и вызывает
+обработчики событий (on_button_press, on_move_press, on_button_release,
+on_key_press) напрямую - с синтетическими или записанными траекториями.
+Нужен дисплей; на сервере запускать под Xvfb с экраном не меньше 4K:
+
+    xvfb-run -s "-screen 0 3840x2160x24" python benchmarks/bench_overlay.py
+
+Результаты пишутся в JSON, чтобы сравнивать их между ревизиями.
+redraw - полная перерисовка холста с теми же штрихами из отрезков по
+две точки и из ломаных (то, что дали ломаные в StrokeBuilder).
+Записанная траектория (--trace) - JSON-список штрихов, каждый штрих -
+список точек [t_мс, x, y].
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import runpy
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_DIR, "rabpaint 2.py")
+
+RESOLUTIONS = {
+    '1080p': (1920, 1080),
+    '1440p': (2560, 1440),
+    '4k': (3840, 2160),
+}
+
+def load_app():
+    """Выполняет скрипт окна рисования и возвращает его глобальные имена"""
+    from tkinter import messagebox
+    
+    # Модальные окна остановили бы бенчмарк - подменяем их заглушками
+    for name in ('showinfo', 'showwarning', 'showerror'):
+        setattr(messagebox, name, lambda *args, **kwargs: None)
+    
+    sys.path.insert(0, REPO_DIR)
+    namespace = runpy.run_path(APP_PATH, run_name='rabpaint_bench')
+    # run_path возвращает копию; функции работают с исходным словарем
+    app = namespace['on_key_press'].__globals__
+    app['root'].withdraw()
+    app['root'].update()
+    return app
+
+def use_canvas_size(app, width, height):
+    """Заменяет буфер изображения на буфер нужного размера"""
+    backing = app['BackingImage'](width, height)
+    backing.view = app['viewport']
+    backing.set_layers(app['document'].layers)
+    backing.on_change = app['canvas_baker'].refresh
+    app['backing_image'] = backing
+    app['png_cache'] = app['PNGTileCache']()
+    app['last_quick_save'] = None
+    for module in ('stroke_builder', 'eraser_module', 'history_module', 'canvas_baker', 'layer_module',
+                   'viewport_module'):
+        app[module].backing = backing
+
+def synthetic_trace(width, height, strokes=50, points=400, seed=1):
+    """Штрихи-петли, как при быстром рукописном вводе с частотой 1 кГц"""
+    rng = random.Random(seed)
+    trace = []
+    for _ in range(strokes):
+        x, y = rng.uniform(0.1, 0.9) * width, rng.uniform(0.1, 0.9) * height
+        phase = rng.uniform(0, math.tau)
+        stroke = []
+        for t in range(points):
+            speed = 0.3 + 0.7 * abs(math.sin(t / 90 + phase))
+            angle = math.sin(t / 15 + phase) * 2.5 + t / 40
+            x = min(width - 1, max(0, x + speed * math.cos(angle)))
+            y = min(height - 1, max(0, y + speed * math.sin(angle)))
+            stroke.append((t, round(x), round(y)))
+        trace.append(stroke)
+    return trace
+
+def event(x=0, y=0, keysym='', state=0):
+    return SimpleNamespace(x=x, y=y, x_root=x, y_root=y, keysym=keysym, state=state)
+
+def resident_mb():
+    """Текущая резидентная память процесса (Linux) или пиковая (другие Unix)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except OSError:
+        try:
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        except ImportError:
+            return None
+
+def replay(app, trace, frame_ms=16):
+    """Прогоняет траекторию через обработчики; возвращает (событий, секунд)"""
+    root = app['root']
+    events = 0
+    start = time.perf_counter()
+    for stroke in trace:
+        t0, x, y = stroke[0]
+        app['on_button_press'](event(x, y))
+        next_frame = t0 + frame_ms
+        for t, x, y in stroke[1:]:
+            app['on_move_press'](event(x, y))
+            events += 1
+            if t >= next_frame:
+                root.update()
+                next_frame = t + frame_ms
+        app['on_button_release'](event(x, y))
+        root.update()
+    return events, time.perf_counter() - start
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    # Сохранения идут в фоне - ждем готовности файла
+    if hasattr(result, 'result'):
+        result.result()
+    return (time.perf_counter() - start) * 1000
+
+def bench_resolution(app, size, trace, workdir):
+    width, height = size
+    use_canvas_size(app, width, height)
+    app['clear_canvas']()
+    
+    result = {}
+    events, seconds = replay(app, trace)
+    result['motion_events'] = events
+    result['motion_events_per_sec'] = round(events / seconds)
+    result['canvas_items'] = len(app['canvas'].find_all())
+    result['stored_points'] = app['document'].point_count()
+    result['rss_mb'] = resident_mb()
+    
+    filename = os.path.join(workdir, f"bench_{width}x{height}.png")
+    result['save_image_ms'] = round(timed(lambda: app['save_image'](filename)), 1)
+    result['save_as_pdf_ms'] = round(timed(app['save_as_pdf']), 1)
+    result['copy_to_clipboard_ms'] = round(timed(app['copy_to_clipboard']), 1)
+    
+    # Повторные быстрые сохранения: без изменений и после короткой стрелки
+    result['quick_save_ms'] = round(timed(app['quick_save']), 1)
+    result['quick_save_unchanged_ms'] = round(timed(app['quick_save']), 2)
+    replay(app, [[(t, width // 2 + t, height // 2 + t // 3) for t in range(60)]])
+    result['quick_save_small_change_ms'] = round(timed(app['quick_save']), 1)
+    
+    # Стирание: ластик проходит по тем же траекториям
+    app['on_key_press'](event(keysym='s'))
+    events, seconds = replay(app, trace[::5])
+    app['on_key_press'](event(keysym='d'))
+    result['erase_events_per_sec'] = round(events / seconds)
+    result['canvas_items_after_erase'] = len(app['canvas'].find_all())
+    
+    result['clear_ms'] = round(timed(lambda: app['on_key_press'](event(keysym='c'))), 2)
+    app['root'].update()
+    return result
+
+def full_redraw_ms(app, frames=20):
+    """Медиана полной перерисовки холста Tk со всеми его элементами
+    
+    Прямоугольник во весь холст создается и удаляется - Tk перерисовывает
+    под ним все элементы; update_idletasks ждет конца перерисовки.
+    """
+    canvas, root = app['canvas'], app['root']
+    width, height = canvas.winfo_width(), canvas.winfo_height()
+    root.update()
+    times = []
+    for _ in range(frames):
+        cover = canvas.create_rectangle(0, 0, width, height, outline='')
+        root.update_idletasks()
+        start = time.perf_counter()
+        canvas.delete(cover)
+        root.update_idletasks()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return round(times[len(times) // 2], 3)
+
+def bench_redraw(app, trace):
+    """Перерисовка холста: отрезок на каждое движение мыши против ломаной на штрих
+    
+    Те же точки рисуются на холсте двумя способами - отдельными линиями
+    из двух точек (как до ломаных в StrokeBuilder) и ломаными
+    create_polyline - и для каждого меряется полная перерисовка. Спрятанное
+    окно Tk не рисует, поэтому на время замера оно показывается.
+    """
+    canvas, root = app['canvas'], app['root']
+    app['clear_canvas']()
+    root.deiconify()
+    result = {}
+    for name in ('segments', 'polylines'):
+        items = []
+        for stroke in trace:
+            points = [coord for t, x, y in stroke for coord in (x, y)]
+            if name == 'polylines':
+                items += app['create_polyline'](canvas, points, 'black', 3)
+                continue
+            for i in range(0, len(points) - 2, 2):
+                items.append(canvas.create_line(*points[i:i + 4], fill='black', width=3,
+                                                capstyle='round', joinstyle='round'))
+        result[name] = {'canvas_items': len(items), 'redraw_ms': full_redraw_ms(app)}
+        canvas.delete(*items)
+    root.withdraw()
+    root.update()
+    return result
+
+def bench_viewport(app, stored, world=30000, frames=120, seed=2):
+    """Прокрутка и масштаб при stored штрихах в рисунке размером world x world"""
+    rng = random.Random(seed)
+    document, root, viewport_module = app['document'], app['root'], app['viewport_module']
+    # Штрихи кладутся прямо в Document - журнал автосохранения здесь не меряется
+    journal, document.journal = document.journal, None
+    for _ in range(stored):
+        x, y = rng.uniform(0, world), rng.uniform(0, world)
+        xy = []
+        for _ in range(20):
+            x += rng.uniform(-6, 6)
+            y += rng.uniform(-6, 6)
+            xy.extend((x, y))
+        document.add(app['Stroke'](xy, 'blue', 3))
+    document.journal = journal
+    
+    view = viewport_module.view
+    view.x = view.y = world / 2
+    viewport_module.rescaled = True
+    result = {'stored_strokes': len(document)}
+    result['render_view_ms'] = round(timed(viewport_module.settle), 1)
+    
+    # Кадр прокрутки: сдвиг холста Tk и его перерисовка
+    times = []
+    for _ in range(frames):
+        start = time.perf_counter()
+        viewport_module.pan(12, 5)
+        viewport_module.flush_move()
+        root.update()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    result['pan_frame_ms'] = {
+        'mean': round(sum(times) / len(times), 3),
+        'p99': round(times[min(len(times) - 1, int(len(times) * 0.99))], 3),
+        'max': round(times[-1], 3),
+    }
+    result['pan_settle_ms'] = round(timed(viewport_module.settle), 1)
+    result['canvas_items'] = len(app['canvas'].find_all())
+    
+    width, height = viewport_module.backing.size
+    result['zoom'] = []
+    for steps in (1, 1, -1, -1, -1, -1, -1, -1):
+        wheel_ms = timed(lambda: (viewport_module.zoom(width // 2, height // 2, steps), root.update()))
+        settle_ms = timed(lambda: (viewport_module.settle(), root.update()))
+        result['zoom'].append({'zoom': round(view.zoom, 3), 'wheel_ms': round(wheel_ms, 2),
+                               'settle_ms': round(settle_ms, 1)})
+    viewport_module.reset()
+    return result
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк окна рисования")
+    parser.add_argument('-o', '--output', default='bench_results.json')
+    parser.add_argument('--trace', help="JSON с записанной траекторией")
+    parser.add_argument('--resolutions', default=','.join(RESOLUTIONS),
+                        help="список через запятую: " + ', '.join(RESOLUTIONS))
+    parser.add_argument('--strokes', type=int, default=50)
+    parser.add_argument('--points', type=int, default=400)
+    parser.add_argument('--stored-strokes', type=int, default=200000,
+                        help="штрихов в рисунке для замера прокрутки и масштаба (0 - не мерить)")
+    args = parser.parse_args(argv)
+    output = os.path.abspath(args.output)
+    
+    recorded = None
+    if args.trace:
+        with open(args.trace, encoding='utf-8') as f:
+            recorded = [[tuple(point) for point in stroke] for stroke in json.load(f)]
+    
+    # Журнал и сохранения пишутся в drawings/ - уводим их во временную папку
+    workdir = tempfile.mkdtemp(prefix='rabpaint_bench_')
+    os.chdir(workdir)
+    app = load_app()
+    
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'trace': os.path.basename(args.trace) if args.trace else 'synthetic',
+        'results': {},
+    }
+    for name in args.resolutions.split(','):
+        size = RESOLUTIONS[name.strip()]
+        trace = recorded or synthetic_trace(*size, strokes=args.strokes, points=args.points)
+        report['results'][name.strip()] = bench_resolution(app, size, trace, workdir)
+        print(name, report['results'][name.strip()])
+    # Перерисовка - на холсте окна, размер буфера на нее не влияет
+    report['redraw'] = bench_redraw(app, recorded or synthetic_trace(
+        *RESOLUTIONS['1080p'], strokes=args.strokes, points=args.points))
+    print('redraw', report['redraw'])
+    if args.stored_strokes:
+        report['viewport'] = bench_viewport(app, args.stored_strokes)
+        print('viewport', report['viewport'])
+    
+    app['export_module'].shutdown()
+    app['autosave_journal'].close()
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Результаты: {output}")
+
+if __name__ == '__main__':
+    main()
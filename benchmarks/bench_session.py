@@ -0,0 +1,167 @@
+"""Бенчмарк файла сеанса: открытие против разбора такого же JSON
+
+Строит синтетический сеанс (каракули по большому холсту), сохраняет
+его файлом сеанса (write_session_file), журналом автосохранения и JSON
+тех же полей и меряет:
+  - JSON: json.load и сборку штрихов - так пришлось бы открывать
+    сеанс, сохраненный текстом;
+  - журнал: load_journal - так же, только по кадрам, окно разбирает
+    журнал прошлого сеанса после запуска;
+  - файл сеанса: открытие (заголовок, слои, цвета), первый экран -
+    query по области просмотра и разбор только видимых штрихов, - и
+    разбор всех штрихов, который идет потом по кадрам.
+Дисплей не нужен:
+
+    python benchmarks/bench_session.py --strokes 100000 --points 40
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from rabpaint_engine import (  # noqa: E402
+    Layer, SessionFile, Stroke, Viewport, encode_journal_add, load_journal, write_session_file,
+    JOURNAL_MAGIC
+)
+
+def make_strokes(count, points, world, seed=1):
+    """Каракули по холсту world x world с центром в начале координат"""
+    rnd = random.Random(seed)
+    colors = ('red', 'blue', 'black', 'green', '#ff8800', '#336699')
+    strokes = {}
+    for sid in range(1, count + 1):
+        x, y = rnd.uniform(-world / 2, world / 2), rnd.uniform(-world / 2, world / 2)
+        xy = []
+        for _ in range(points):
+            x += rnd.uniform(-8, 8)
+            y += rnd.uniform(-8, 8)
+            xy.extend((x, y))
+        strokes[sid] = Stroke(xy, rnd.choice(colors), rnd.choice((3, 6)), z=sid,
+                              started=1.7e9 + sid, duration=0.5)
+    return strokes
+
+def write_json(path, strokes, layers, view):
+    data = {
+        'layers': [{'id': layer.lid, 'name': layer.name, 'visible': layer.visible} for layer in layers],
+        'view': [view.x, view.y, view.zoom],
+        'strokes': [{'id': sid, 'points': stroke.points.tolist(), 'color': stroke.color,
+                     'width': stroke.width, 'tool': stroke.tool, 'z': stroke.z, 'layer': stroke.layer,
+                     'started': stroke.started, 'duration': stroke.duration}
+                    for sid, stroke in strokes.items()],
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+
+def load_json(path):
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    return {item['id']: Stroke(item['points'], item['color'], item['width'], item['tool'],
+                               z=item['z'], layer=item['layer'], started=item['started'],
+                               duration=item['duration'])
+            for item in data['strokes']}
+
+def write_journal(path, strokes):
+    with open(path, 'wb') as f:
+        f.write(JOURNAL_MAGIC)
+        for sid, stroke in strokes.items():
+            f.write(encode_journal_add(sid, stroke))
+
+def best(func, runs):
+    """Лучшее время из runs запусков, в миллисекундах, и результат последнего"""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = func()
+        times.append((time.perf_counter() - start) * 1000)
+    return round(min(times), 2), result
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк файла сеанса")
+    parser.add_argument('-o', '--output', default='bench_session.json')
+    parser.add_argument('--strokes', type=int, default=100000)
+    parser.add_argument('--points', type=int, default=40, help="точек в штрихе")
+    parser.add_argument('--world', type=float, default=40000.0, help="сторона холста с рисунком")
+    parser.add_argument('--screen', default='1920x1080', help="область просмотра WxH")
+    parser.add_argument('--runs', type=int, default=3, help="запусков на замер, берется лучший")
+    args = parser.parse_args(argv)
+    
+    screen = tuple(int(v) for v in args.screen.lower().split('x'))
+    strokes = make_strokes(args.strokes, args.points, args.world)
+    layers = [Layer(0, 'Рисунок')]
+    view = Viewport(-screen[0] / 2, -screen[1] / 2, 1.0)
+    workdir = tempfile.mkdtemp(prefix='rabpaint_bench_session_')
+    paths = {name: os.path.join(workdir, 'bench' + ext)
+             for name, ext in (('session', '.rps'), ('json', '.json'), ('journal', '.journal'))}
+    write_session_file(paths['session'], strokes, layers, view)
+    write_json(paths['json'], strokes, layers, view)
+    write_journal(paths['journal'], strokes)
+    
+    json_ms, loaded = best(lambda: load_json(paths['json']), args.runs)
+    assert len(loaded) == len(strokes)
+    journal_ms, loaded = best(lambda: load_journal(paths['journal']), args.runs)
+    assert len(loaded) == len(strokes)
+    
+    def open_session():
+        return SessionFile(paths['session']).open()
+    
+    def first_screen():
+        session = open_session()
+        visible = dict(session.strokes(session.query(session.view.world_bbox(screen))))
+        session.close()
+        return visible
+    
+    def all_strokes():
+        session = open_session()
+        result = dict(session.strokes())
+        session.close()
+        return result
+    
+    open_ms, session = best(open_session, args.runs)
+    session.close()
+    first_ms, visible = best(first_screen, args.runs)
+    all_ms, loaded = best(all_strokes, args.runs)
+    assert len(loaded) == len(strokes)
+    
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'strokes': args.strokes,
+        'points_per_stroke': args.points,
+        'visible_strokes': len(visible),
+        'file_mb': {name: round(os.path.getsize(path) / 2**20, 1) for name, path in paths.items()},
+        'json_load_ms': json_ms,
+        'journal_load_ms': journal_ms,
+        'session_open_ms': open_ms,
+        'session_first_screen_ms': first_ms,
+        'session_all_strokes_ms': all_ms,
+    }
+    print(f"{args.strokes} штрихов по {args.points} точек: "
+          f"JSON {json_ms} мс, журнал {journal_ms} мс; файл сеанса: открытие {open_ms} мс, "
+          f"первый экран ({len(visible)} штрихов) {first_ms} мс, все штрихи {all_ms} мс; "
+          f"размеры, МБ: {report['file_mb']}")
+    for path in paths.values():
+        os.remove(path)
+    os.rmdir(workdir)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""Бенчмарк запуска: от старта процесса до первого кадра, на котором можно рисовать
+
+Запускает "rabpaint 2.py" отдельным процессом с RABPAINT_STARTUP_PROBE=1 -
+окно печатает "first-frame", когда холст показан и отрисован, - и
+меряет время от запуска процесса до этой строки. Процесс затем
+завершается. Каждый запуск идет в чистой временной папке; с
+--journal-strokes N в нее кладется журнал прошлого сеанса из N
+штрихов - окно восстанавливает его уже после первого кадра, и время
+до кадра от размера журнала расти не должно.
+
+Медиана сравнивается с бюджетом (--budget-ms); при превышении скрипт
+завершается с кодом 1, так что его можно ставить в CI как проверку
+регрессии. Нужен дисплей; на сервере - под Xvfb:
+
+    xvfb-run python benchmarks/bench_startup.py --runs 10 --budget-ms 400
+    xvfb-run python benchmarks/bench_startup.py --journal-strokes 20000
+
+Тот же бюджет проверяет tests/test_startup.py (без дисплея тест первого
+кадра пропускается, а импорт движка меряется всегда).
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_DIR, "rabpaint 2.py")
+
+# Медиана времени до первого кадра, мс
+BUDGET_MS = 400.0
+
+def make_journal(path, count, points=40, seed=17):
+    """Журнал автосохранения из count каракуль по экрану 1920x1080"""
+    sys.path.insert(0, REPO_DIR)
+    from rabpaint_engine import Stroke, write_journal_snapshot
+    
+    rnd = random.Random(seed)
+    strokes = []
+    for _ in range(count):
+        x, y = rnd.uniform(0, 1920), rnd.uniform(0, 1080)
+        xy = []
+        for _ in range(points):
+            x += rnd.uniform(-8, 8)
+            y += rnd.uniform(-8, 8)
+            xy.extend((x, y))
+        strokes.append(Stroke(xy, rnd.choice(('red', 'blue', 'black')), 3))
+    write_journal_snapshot(strokes, path)
+
+def time_startup(timeout=30.0, journal=None):
+    """Один запуск окна; возвращает миллисекунды до первого кадра
+    
+    journal - файл журнала, который окно найдет как прошлый сеанс.
+    """
+    workdir = tempfile.mkdtemp(prefix='rabpaint_startup_')
+    if journal is not None:
+        os.makedirs(os.path.join(workdir, 'drawings'))
+        shutil.copyfile(journal, os.path.join(workdir, 'drawings', 'session.journal'))
+    env = dict(os.environ, RABPAINT_STARTUP_PROBE='1')
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, APP_PATH], cwd=workdir, env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    )
+    try:
+        for line in process.stdout:
+            if line.strip() == 'first-frame':
+                return (time.perf_counter() - start) * 1000
+            if time.perf_counter() - start > timeout:
+                break
+        raise RuntimeError(f"окно не показало первый кадр: {process.stderr.read().strip()}")
+    finally:
+        process.kill()
+        process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк запуска окна рисования")
+    parser.add_argument('-o', '--output', default='bench_startup.json')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--budget-ms', type=float, default=BUDGET_MS,
+                        help="допустимая медиана времени до первого кадра")
+    parser.add_argument('--journal-strokes', type=int, default=0,
+                        help="штрихов в журнале прошлого сеанса (0 - без журнала)")
+    args = parser.parse_args(argv)
+
+    journal = None
+    if args.journal_strokes:
+        journal = os.path.join(tempfile.mkdtemp(prefix='rabpaint_journal_'), 'session.journal')
+        make_journal(journal, args.journal_strokes)
+
+    # Первый запуск прогревает кэш байткода и файловый кэш ОС - его не считаем
+    time_startup(journal=journal)
+    times = [time_startup(journal=journal) for _ in range(args.runs)]
+    if journal is not None:
+        shutil.rmtree(os.path.dirname(journal), ignore_errors=True)
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'runs_ms': [round(t, 1) for t in times],
+        'median_ms': round(statistics.median(times), 1),
+        'min_ms': round(min(times), 1),
+        'max_ms': round(max(times), 1),
+        'budget_ms': args.budget_ms,
+        'journal_strokes': args.journal_strokes,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print(f"до первого кадра: медиана {report['median_ms']} мс "
+          f"(мин {report['min_ms']}, макс {report['max_ms']}), бюджет {args.budget_ms:g} мс")
+    if report['median_ms'] > args.budget_ms:
+        print("Бюджет превышен")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""Бенчмарк планировщика кадров: сколько изменений интерфейса доходит до окна
+
+Имитирует два потока событий и считает, сколько раз в секунду окно
+меняется по-старому (изменение прямо в обработчике события) и через
+FrameScheduler (одно изменение за кадр):
+  - перетаскивание слайдера прозрачности: --event-rate событий в секунду,
+    каждое изменение - три вызова (-alpha, значение слайдера, текст метки);
+  - быстрое движение мыши по элементам с подсказками: вход и выход
+    каждые --hover-ms мс; по-старому каждый вход создает окно подсказки,
+    а выход уничтожает его, через планировщик окно одно и только
+    прячется и показывается.
+Вместо окна - интерпретатор Tcl без Tk (таймеры after те же, что в окне
+рисования), изменения окна - команды Tcl, поэтому дисплей не нужен:
+
+    python benchmarks/bench_ui.py --event-rate 125 1000 --seconds 3
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tkinter
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from rabpaint_engine import FrameScheduler, Profiler  # noqa: E402
+
+class Window:
+    """Считает изменения окна; каждое изменение - команда интерпретатора"""
+    
+    def __init__(self, tcl):
+        self.tcl = tcl
+        self.alpha_updates = 0
+        self.tooltip_updates = 0
+        self.windows_created = 0
+        self.value = 100
+        self.tooltip = None
+    
+    def apply_alpha(self):
+        self.alpha_updates += 1
+        self.tcl.call('set', 'alpha', self.value / 100)
+        self.tcl.call('set', 'slider', self.value)
+        self.tcl.call('set', 'label', f"Прозрачность: {self.value}%")
+    
+    def create_tooltip(self, text):
+        self.windows_created += 1
+        self.tcl.call('set', 'tooltip', text)
+        self.tooltip = text
+    
+    def destroy_tooltip(self):
+        self.tcl.call('unset', '-nocomplain', 'tooltip')
+        self.tooltip = None
+    
+    def update_tooltip(self, text):
+        self.tooltip_updates += 1
+        if text is not None and self.tooltip is None:
+            self.create_tooltip(text)
+        self.tcl.call('set', 'tooltip_text', text or '')
+
+def drive(tcl, events, seconds):
+    """Вызывает events(i) с равными промежутками, обрабатывая таймеры между вызовами"""
+    count = 0
+    start = time.perf_counter()
+    while True:
+        now = time.perf_counter()
+        if now - start >= seconds:
+            break
+        events(count)
+        count += 1
+        tcl.update()
+    # Добираем последний кадр
+    end = time.perf_counter() + 0.05
+    while time.perf_counter() < end:
+        tcl.update()
+        time.sleep(0.001)
+    return count, time.perf_counter() - start
+
+def paced(handler, rate):
+    """Обертка: событие i приходит в момент i / rate от первого вызова"""
+    start = []
+    
+    def event(i):
+        if not start:
+            start.append(time.perf_counter())
+        delay = start[0] + i / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        handler(i)
+    return event
+
+def bench_slider(rate, seconds, scheduled, interval_ms, budget_ms):
+    tcl = tkinter.Tcl()
+    window = Window(tcl)
+    profiler = Profiler()
+    profiler.enable()
+    scheduler = FrameScheduler(tcl, interval_ms, budget_ms, profiler)
+    
+    def on_slider(i):
+        # Слайдер ходит туда и обратно от 5% до 100%
+        window.value = 5 + abs(i % 190 - 95)
+        if scheduled:
+            scheduler.schedule(window.apply_alpha)
+        else:
+            window.apply_alpha()
+    
+    events, elapsed = drive(tcl, paced(on_slider, rate), seconds)
+    return {
+        'events_per_second': round(events / elapsed, 1),
+        'alpha_updates_per_second': round(window.alpha_updates / elapsed, 1),
+        'widget_calls_per_second': round(3 * window.alpha_updates / elapsed, 1),
+        'frames_per_second': round(profiler.counters.get('ui_frames', 0) / elapsed, 1),
+    }
+
+def bench_hover(hover_ms, seconds, scheduled, interval_ms, budget_ms):
+    tcl = tkinter.Tcl()
+    window = Window(tcl)
+    scheduler = FrameScheduler(tcl, interval_ms, budget_ms)
+    tips = ["Текущий цвет", "Панель сохранения", "Область рисования", "Прозрачность"]
+    
+    def on_hover(i):
+        # Четные события - вход на элемент, нечетные - выход с него
+        text = tips[i // 2 % len(tips)]
+        if scheduled:
+            scheduler.schedule(window.update_tooltip, None if i % 2 else text)
+        elif i % 2:
+            window.destroy_tooltip()
+        else:
+            window.create_tooltip(text)
+    
+    events, elapsed = drive(tcl, paced(on_hover, 2000 / hover_ms), seconds)
+    return {
+        'events_per_second': round(events / elapsed, 1),
+        'tooltip_updates_per_second': round((window.tooltip_updates if scheduled else events)
+                                            / elapsed, 1),
+        'windows_created': window.windows_created,
+    }
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк планировщика кадров")
+    parser.add_argument('-o', '--output', default='bench_ui.json')
+    parser.add_argument('--event-rate', type=float, nargs='+', default=[125.0, 1000.0],
+                        help="событий слайдера в секунду (мышь 125 Гц, игровая 1000 Гц)")
+    parser.add_argument('--hover-ms', type=float, default=30.0,
+                        help="сколько мс курсор задерживается на элементе с подсказкой")
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--interval-ms', type=int, default=16)
+    parser.add_argument('--budget-ms', type=float, default=8.0)
+    args = parser.parse_args(argv)
+    
+    runs = []
+    for rate in args.event_rate:
+        for scheduled in (False, True):
+            result = bench_slider(rate, args.seconds, scheduled, args.interval_ms, args.budget_ms)
+            result.update(scenario='slider', event_rate=rate, scheduled=scheduled)
+            runs.append(result)
+            print(f"слайдер {rate:g} Гц, {'планировщик' if scheduled else 'напрямую'}: "
+                  f"{result['events_per_second']} событий/с -> "
+                  f"{result['alpha_updates_per_second']} изменений -alpha/с")
+    for scheduled in (False, True):
+        result = bench_hover(args.hover_ms, args.seconds, scheduled, args.interval_ms, args.budget_ms)
+        result.update(scenario='hover', hover_ms=args.hover_ms, scheduled=scheduled)
+        runs.append(result)
+        print(f"подсказки каждые {args.hover_ms:g} мс, {'планировщик' if scheduled else 'напрямую'}: "
+              f"{result['events_per_second']} событий/с -> "
+              f"{result['tooltip_updates_per_second']} изменений/с, "
+              f"создано окон: {result['windows_created']}")
+    
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'interval_ms': args.interval_ms,
+        'budget_ms': args.budget_ms,
+        'runs': runs,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
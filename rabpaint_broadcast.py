@@ -0,0 +1,373 @@
+"""Трансляция штрихов на другие окна рисования по локальному сокету
+
+Окно-ведущий поднимает asyncio-сервер в фоновом потоке и рассылает
+изменения рисунка: начало, точки и конец текущего штриха, добавление и
+удаление штрихов (так приходят стирание и отмена) и очистку. Окна-зрители
+подключаются клиентом, тоже в фоновом потоке, и складывают изменения в
+очередь; окно Tk забирает их раз в кадр через root.after и никогда не
+ждет сети.
+
+Кадры имеют формат записей журнала автосохранения (rabpaint_engine):
+тип (1 байт), длина данных (4 байта), данные, crc32 (4 байта). Записи
+JOURNAL_ADD / JOURNAL_REMOVE / JOURNAL_CLEAR передаются как есть, к ним
+добавлены кадры текущего штриха:
+  LIVE_BEGIN  - x, y, толщина (float32), слой (uint32), цвет (строка с длиной в 1 байт)
+  LIVE_POINTS - новые точки штриха, пары float32; один кадр на кадр ввода
+  LIVE_END    - штрих закончен; следом идет его JOURNAL_ADD (если он не пустой)
+Соединение начинается с сигнатуры BROADCAST_MAGIC и снимка рисунка.
+
+Модуль подключается только при включенной трансляции, поэтому asyncio
+не замедляет обычный запуск.
+"""
+import asyncio
+import os
+import queue
+import struct
+import sys
+import threading
+from array import array
+
+from rabpaint_engine import (
+    JOURNAL_ADD, JOURNAL_CLEAR, JOURNAL_REMOVE, decode_journal_add, encode_journal_add,
+    encode_journal_record, encode_journal_remove, parse_journal_record
+)
+
+BROADCAST_MAGIC = b'RPB1'
+DEFAULT_PORT = 47800
+
+LIVE_BEGIN = 16
+LIVE_POINTS = 17
+LIVE_END = 18
+# Событие приемника (не кадр): установлено новое соединение, дальше
+# ведущий пришлет рисунок целиком
+RECEIVER_CONNECTED = 0
+
+_live_begin = struct.Struct('<fffI')
+_sid = struct.Struct('<I')
+
+def parse_address(address):
+    """Разбирает адрес трансляции
+    
+    "unix:/путь" - Unix-сокет, "host:port" или просто "port" - TCP
+    (по умолчанию 127.0.0.1:DEFAULT_PORT). Возвращает ('unix', путь)
+    или ('tcp', host, port).
+    """
+    address = (address or '').strip()
+    if address.startswith('unix:'):
+        return 'unix', address[len('unix:'):]
+    host, sep, port = address.rpartition(':')
+    if not sep:
+        host, port = '', address
+    return 'tcp', host or '127.0.0.1', int(port) if port else DEFAULT_PORT
+
+def _float_bytes(points):
+    points = array('f', points)
+    if sys.byteorder != 'little':
+        points.byteswap()
+    return points.tobytes()
+
+def encode_live_begin(x, y, color, width, layer=0):
+    color = color.encode('utf-8')
+    payload = _live_begin.pack(x, y, width, layer) + bytes((len(color),)) + color
+    return encode_journal_record(LIVE_BEGIN, payload)
+
+def encode_live_points(xy):
+    return encode_journal_record(LIVE_POINTS, _float_bytes(xy))
+
+def decode_frame(data, kind, start, end):
+    """Превращает данные кадра в событие (тип, значение)"""
+    if kind == JOURNAL_ADD:
+        return kind, decode_journal_add(data, start, end)
+    if kind == JOURNAL_REMOVE:
+        return kind, _sid.unpack_from(data, start)[0]
+    if kind == LIVE_BEGIN:
+        x, y, width, layer = _live_begin.unpack_from(data, start)
+        p = start + _live_begin.size
+        color = bytes(data[p + 1:p + 1 + data[p]]).decode('utf-8')
+        return kind, (x, y, color, width, layer)
+    if kind == LIVE_POINTS:
+        points = array('f')
+        points.frombytes(data[start:end])
+        if sys.byteorder != 'little':
+            points.byteswap()
+        return kind, points
+    return kind, None
+
+def split_frames(buffer):
+    """Разбирает готовые кадры из начала буфера (bytearray) и убирает их оттуда
+    
+    Оборванный последний кадр остается в буфере до следующей порции;
+    на испорченном кадре - ValueError.
+    """
+    events = []
+    pos = 0
+    while True:
+        record = parse_journal_record(buffer, pos)
+        if record is None:
+            break
+        kind, start, end, pos = record
+        events.append(decode_frame(buffer, kind, start, end))
+    del buffer[:pos]
+    return events
+
+async def _open_connection(address):
+    address = parse_address(address)
+    if address[0] == 'unix':
+        return await asyncio.open_unix_connection(address[1])
+    return await asyncio.open_connection(address[1], address[2])
+
+class StrokeBroadcaster:
+    """Раздает изменения рисунка подключенным окнам-зрителям
+    
+    Методы begin/points/end и add/remove/clear (как у журнала, поэтому
+    раздатчик ставится в document.journal) вызываются из потока Tk: они
+    только кодируют кадр и откладывают его. Цикл asyncio в фоновом потоке
+    сливает все отложенное в один буфер и пишет его каждому клиенту.
+    Новый клиент сначала получает текущий рисунок целиком. Клиент, у
+    которого в буфере отправки больше max_buffer байт, отключается -
+    медленный зритель не копит память ведущего.
+    """
+    
+    def __init__(self, address, max_buffer=8 << 20):
+        self.address = address
+        self.max_buffer = max_buffer
+        self.loop = None
+        self.thread = None
+        self.server = None
+        self.clients = set()
+        self.lock = threading.Lock()
+        self.pending = []
+        self.scheduled = False
+        # Снимок для новых клиентов, меняется только в потоке цикла:
+        # id штриха -> кадр JOURNAL_ADD и кадры текущего штриха
+        self.strokes = {}
+        self.live = []
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.dropped_clients = 0
+        self._ready = threading.Event()
+        self._error = None
+    
+    def start(self, strokes=None):
+        """Запускает сервер; strokes - уже нарисованные штрихи {id: штрих}
+        
+        Если адрес занят, бросает OSError.
+        """
+        for sid, stroke in (strokes or {}).items():
+            self.strokes[sid] = encode_journal_add(sid, stroke)
+        self.thread = threading.Thread(target=self._run, name='stroke-broadcast', daemon=True)
+        self.thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            self.thread.join()
+            self.thread = None
+            raise self._error
+    
+    def client_count(self):
+        return len(self.clients)
+    
+    def begin(self, x, y, color, width, layer=0):
+        self._post(LIVE_BEGIN, None, encode_live_begin(x, y, color, width, layer))
+    
+    def points(self, xy):
+        if xy:
+            self._post(LIVE_POINTS, None, encode_live_points(xy))
+    
+    def end(self):
+        self._post(LIVE_END, None, encode_journal_record(LIVE_END))
+    
+    def add(self, sid, stroke):
+        self._post(JOURNAL_ADD, sid, encode_journal_add(sid, stroke))
+    
+    def remove(self, sid):
+        self._post(JOURNAL_REMOVE, sid, encode_journal_remove(sid))
+    
+    def clear(self):
+        self._post(JOURNAL_CLEAR, None, encode_journal_record(JOURNAL_CLEAR))
+    
+    def close(self):
+        """Отправляет отложенное, закрывает соединения и останавливает поток"""
+        if self.thread is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.thread = None
+    
+    def _post(self, kind, sid, frame):
+        with self.lock:
+            self.pending.append((kind, sid, frame))
+            if self.scheduled or self.thread is None:
+                return
+            self.scheduled = True
+        self.loop.call_soon_threadsafe(self._flush)
+    
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.server = self.loop.run_until_complete(self._listen())
+        except OSError as error:
+            self._error = error
+            self.loop.close()
+            self._ready.set()
+            return
+        
+        self._ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self._flush()
+            self.server.close()
+            for writer in list(self.clients):
+                writer.close()
+            self.loop.run_until_complete(self.server.wait_closed())
+            self.loop.close()
+    
+    async def _listen(self):
+        address = parse_address(self.address)
+        if address[0] == 'unix':
+            # Сокет, оставшийся от упавшего ведущего, мешает bind
+            if os.path.exists(address[1]):
+                os.unlink(address[1])
+            return await asyncio.start_unix_server(self._serve, address[1])
+        return await asyncio.start_server(self._serve, address[1], address[2])
+    
+    async def _serve(self, reader, writer):
+        writer.write(BROADCAST_MAGIC + b''.join(self.strokes.values()) + b''.join(self.live))
+        self.clients.add(writer)
+        try:
+            # Зрители ничего не шлют - просто ждем отключения
+            while await reader.read(4096):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+    
+    def _flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+            self.scheduled = False
+        if not pending:
+            return
+        
+        for kind, sid, frame in pending:
+            if kind == JOURNAL_ADD:
+                self.strokes[sid] = frame
+            elif kind == JOURNAL_REMOVE:
+                self.strokes.pop(sid, None)
+            elif kind == JOURNAL_CLEAR:
+                self.strokes.clear()
+            elif kind == LIVE_BEGIN:
+                self.live = [frame]
+            elif kind == LIVE_POINTS:
+                self.live.append(frame)
+            else:
+                self.live = []
+        
+        data = b''.join(frame for kind, sid, frame in pending)
+        for writer in list(self.clients):
+            if writer.transport.get_write_buffer_size() > self.max_buffer:
+                self.clients.discard(writer)
+                writer.transport.abort()
+                self.dropped_clients += 1
+                continue
+            writer.write(data)
+            self.bytes_sent += len(data)
+        self.frames_sent += len(pending)
+
+class StrokeReceiver:
+    """Принимает изменения рисунка от ведущего окна
+    
+    Цикл asyncio живет в фоновом потоке и кладет события пачками в
+    очередь; поток Tk забирает их методом take(), не дожидаясь сети.
+    События - (тип, значение):
+      RECEIVER_CONNECTED, None      - новое соединение, прежний рисунок сбросить
+      LIVE_BEGIN, (x, y, цвет, толщина, слой)
+      LIVE_POINTS, точки array('f')
+      LIVE_END, None
+      JOURNAL_ADD, (id, штрих)
+      JOURNAL_REMOVE, id
+      JOURNAL_CLEAR, None
+    Пока ведущего нет или связь оборвалась, клиент переподключается
+    раз в retry_interval секунд.
+    """
+    
+    def __init__(self, address, retry_interval=1.0, read_size=1 << 16):
+        self.address = address
+        self.retry_interval = retry_interval
+        self.read_size = read_size
+        self.events = queue.Queue()
+        self.connected = False
+        self.loop = None
+        self.thread = None
+        self.task = None
+        self.frames_received = 0
+        self.bytes_received = 0
+    
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, name='stroke-receiver', daemon=True)
+        self.thread.start()
+    
+    def take(self):
+        """Все события, пришедшие с прошлого вызова, по порядку"""
+        events = []
+        while True:
+            try:
+                events.extend(self.events.get_nowait())
+            except queue.Empty:
+                return events
+    
+    def close(self):
+        if self.thread is not None:
+            self.loop.call_soon_threadsafe(self._cancel)
+            self.thread.join()
+            self.thread = None
+    
+    def _cancel(self):
+        if self.task is not None:
+            self.task.cancel()
+    
+    def _run(self):
+        self.task = self.loop.create_task(self._receive())
+        try:
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.loop.close()
+    
+    async def _receive(self):
+        while True:
+            try:
+                reader, writer = await _open_connection(self.address)
+            except OSError:
+                await asyncio.sleep(self.retry_interval)
+                continue
+            
+            try:
+                await self._read_frames(reader)
+            except (OSError, EOFError, ValueError):
+                pass
+            finally:
+                self.connected = False
+                writer.close()
+            await asyncio.sleep(self.retry_interval)
+    
+    async def _read_frames(self, reader):
+        if await reader.readexactly(len(BROADCAST_MAGIC)) != BROADCAST_MAGIC:
+            raise ValueError("на этом адресе не трансляция штрихов")
+        self.connected = True
+        self.events.put([(RECEIVER_CONNECTED, None)])
+        
+        buffer = bytearray()
+        while True:
+            chunk = await reader.read(self.read_size)
+            if not chunk:
+                return
+            self.bytes_received += len(chunk)
+            buffer += chunk
+            events = split_frames(buffer)
+            if events:
+                self.frames_received += len(events)
+                self.events.put(events)
@@ -0,0 +1,3107 @@
+"""Движок рисунка без Tk: модель штрихов, растеризация, журнал и экспорт
+
+Используется окном рисования (rabpaint 2.py), но работает и без дисплея,
+например для пакетного рендера сохраненных сеансов:
+
+    python rabpaint_engine.py drawings/session.journal
+    python rabpaint_engine.py sessions/*.journal -o renders -f pdf -j 8
+    python rabpaint_engine.py drawings/session.journal -f gif --speedup 10
+    python rabpaint_engine.py drawings/session.journal --scale 4 -j 8
+
+Окно рисования запускается по горячей клавише, поэтому модуль должен
+импортироваться быстро: PIL, subprocess и прочее тяжелое импортируется
+внутри функций, при первом использовании.
+"""
+import io
+import math
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_right
+from itertools import compress
+
+# ========== МОДЕЛЬ РИСУНКА ==========
+
+class Stroke:
+    """Штрих: точки, цвет, толщина, инструмент, слой и элементы холста
+    
+    started - когда штрих начали рисовать (time.time()), duration - сколько
+    его рисовали, в секундах; по ним проигрывается таймлапс.
+    
+    Фигуры и заливки (tool из SHAPE_TOOLS) - тоже штрихи: их points -
+    два угла рамки (x0, y0, x1, y1), а у заливки еще mask - ее пиксели
+    (ширина, высота, биты строк как в картинке PIL режима '1').
+    
+    Точки хранятся в плоском массиве array('f') - x0, y0, x1, y1, ... -
+    по 8 байт на точку (два float32) плюс запас массива при росте.
+    Сам штрих без точек занимает несколько сотен байт, поэтому сеанс
+    в миллион точек укладывается примерно в 8.5 МБ. Индекс ластика
+    (SpatialGrid) добавляет к этому около 7 байт на отрезок.
+    """
+    
+    __slots__ = ('points', 'color', 'width', 'tool', 'items', 'z', 'layer', 'started', 'duration',
+                 'mask')
+    
+    def __init__(self, points, color, width, tool='pen', items=None, z=0, layer=0,
+                 started=0.0, duration=0.0, mask=None):
+        self.points = points if isinstance(points, array) else array('f', points)
+        self.color = color
+        self.width = width
+        self.tool = tool
+        self.items = items if items is not None else []
+        self.z = z
+        self.layer = layer
+        self.started = started
+        self.duration = duration
+        self.mask = mask
+    
+    def segment(self, i):
+        """Возвращает координаты i-го отрезка штриха"""
+        return self.points[2 * i:2 * i + 4]
+    
+    def segment_count(self):
+        return max(0, len(self.points) // 2 - 1)
+    
+    def point_count(self):
+        return len(self.points) // 2
+    
+    def nbytes(self):
+        """Память, занятая точками штриха (и маской заливки)"""
+        size = self.points.buffer_info()[1] * self.points.itemsize
+        if self.mask is not None:
+            size += len(self.mask[2])
+        return size
+    
+    def bbox(self, pad=0):
+        """Габариты штриха (x0, y0, x1, y1) с запасом pad"""
+        xs, ys = self.points[0::2], self.points[1::2]
+        return (min(xs) - pad, min(ys) - pad, max(xs) + pad, max(ys) + pad)
+
+# Инструменты, штрих которых - целая фигура, а не ломаная
+SHAPE_TOOLS = ('rect', 'ellipse', 'fill')
+
+def union_bbox(a, b):
+    """Объединяет два прямоугольника; None - пустой прямоугольник"""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+class Layer:
+    """Слой рисунка: его штрихи показываются, скрываются и очищаются вместе"""
+    
+    __slots__ = ('lid', 'name', 'visible')
+    
+    def __init__(self, lid, name, visible=True):
+        self.lid = lid
+        self.name = name
+        self.visible = visible
+
+class Document:
+    """Все штрихи рисунка - из них строятся холст, буфер изображения и ластик"""
+    
+    def __init__(self):
+        # id -> штрих; порядок добавления совпадает с порядком рисования
+        self.strokes = {}
+        self.index = SpatialGrid()
+        self.next_id = 1
+        # Слои снизу вверх
+        self.layers = [Layer(0, 'Рисунок')]
+        # Журнал автосохранения, в который уходят все изменения
+        self.journal = None
+    
+    def layer(self, lid):
+        """Возвращает слой по id или None"""
+        for layer in self.layers:
+            if layer.lid == lid:
+                return layer
+        return None
+    
+    def add_layer(self, name=None, lid=None):
+        """Добавляет слой поверх остальных и возвращает его"""
+        if lid is None:
+            lid = max(layer.lid for layer in self.layers) + 1
+        layer = Layer(lid, name or f"Слой {lid + 1}")
+        self.layers.append(layer)
+        return layer
+    
+    def layer_strokes(self, lid):
+        """Штрихи слоя {id: штрих}"""
+        return {sid: stroke for sid, stroke in self.strokes.items() if stroke.layer == lid}
+    
+    def add(self, stroke, sid=None):
+        """Добавляет штрих и возвращает его id (sid - вернуть штрих под старым id)"""
+        if sid is None:
+            sid = self.next_id
+        self.next_id = max(self.next_id, sid + 1)
+        if not stroke.z:
+            stroke.z = sid
+        if not stroke.started:
+            # Кусок после стирания появляется в момент стирания
+            stroke.started = time.time()
+        if self.layer(stroke.layer) is None:
+            self.add_layer(lid=stroke.layer)
+        self.strokes[sid] = stroke
+        if stroke.tool in SHAPE_TOOLS:
+            self.index.insert_box(sid, stroke.bbox())
+        else:
+            self.index.insert(sid, stroke.points, stroke.width / 2)
+        if self.journal is not None:
+            self.journal.add(sid, stroke)
+        return sid
+    
+    def remove(self, sid):
+        """Удаляет штрих и возвращает его"""
+        self.index.remove(sid)
+        if self.journal is not None:
+            self.journal.remove(sid)
+        return self.strokes.pop(sid)
+    
+    def clear(self):
+        self.strokes.clear()
+        self.index.clear()
+        if self.journal is not None:
+            self.journal.clear()
+    
+    def __len__(self):
+        return len(self.strokes)
+    
+    def __iter__(self):
+        return iter(self.strokes.values())
+    
+    def ordered(self):
+        """Штрихи видимых слоев в порядке наложения (снизу вверх)"""
+        positions = {layer.lid: i for i, layer in enumerate(self.layers) if layer.visible}
+        items = sorted(
+            ((positions[stroke.layer], stroke.z, sid), stroke)
+            for sid, stroke in self.strokes.items() if stroke.layer in positions
+        )
+        return [stroke for key, stroke in items]
+    
+    def point_count(self):
+        return sum(stroke.point_count() for stroke in self.strokes.values())
+    
+    def nbytes(self):
+        """Память, занятая точками всех штрихов"""
+        return sum(stroke.nbytes() for stroke in self.strokes.values())
+    
+    def segments_in(self, bbox, layer=None):
+        """Отрезки (x0, y0, x1, y1, цвет, толщина) рядом с bbox в порядке наложения
+        
+        layer - брать только штрихи этого слоя. Фигуры и заливки идут
+        в списке самим штрихом, а не отрезками.
+        """
+        found = self.index.query(*bbox)
+        if layer is not None:
+            found = {sid: segs for sid, segs in found.items() if self.strokes[sid].layer == layer}
+        segments = []
+        for sid in sorted(found, key=lambda s: (self.strokes[s].z, s)):
+            stroke = self.strokes[sid]
+            if stroke.tool in SHAPE_TOOLS:
+                segments.append(stroke)
+                continue
+            for i in sorted(found[sid]):
+                segments.append(tuple(stroke.segment(i)) + (stroke.color, stroke.width))
+        return segments
+
+# ========== МОДУЛЬ ПРОСТРАНСТВЕННОГО ИНДЕКСА ==========
+
+def segment_distance(px, py, x0, y0, x1, y1):
+    """Расстояние от точки до отрезка"""
+    dx, dy = x1 - x0, y1 - y0
+    length2 = dx * dx + dy * dy
+    if length2 == 0:
+        t = 0
+    else:
+        t = max(0.0, min(1.0, ((px - x0) * dx + (py - y0) * dy) / length2))
+    ex, ey = x0 + t * dx - px, y0 + t * dy - py
+    return (ex * ex + ey * ey) ** 0.5
+
+class SpatialGrid:
+    """Равномерная сетка отрезков штрихов для быстрого поиска по области"""
+    
+    def __init__(self, cell_size=64):
+        self.cell_size = cell_size
+        # (cx, cy) -> {id штриха: [номера отрезков]}
+        self.cells = {}
+        # id штриха -> клетки, в которые он попал
+        self.stroke_cells = {}
+    
+    def _cell_keys(self, x0, y0, x1, y1):
+        cs = self.cell_size
+        for cx in range(int(x0 // cs), int(x1 // cs) + 1):
+            for cy in range(int(y0 // cs), int(y1 // cs) + 1):
+                yield cx, cy
+    
+    def insert(self, sid, points, pad=0):
+        """Добавляет отрезки штриха; pad - запас на половину толщины линии"""
+        cells = self.cells
+        touched = self.stroke_cells.setdefault(sid, set())
+        for i in range(len(points) // 2 - 1):
+            x0, y0, x1, y1 = points[2 * i:2 * i + 4]
+            for key in self._cell_keys(min(x0, x1) - pad, min(y0, y1) - pad,
+                                       max(x0, x1) + pad, max(y0, y1) + pad):
+                cell = cells.get(key)
+                if cell is None:
+                    cell = cells[key] = {}
+                segs = cell.get(sid)
+                if segs is None:
+                    segs = cell[sid] = array('I')
+                    touched.add(key)
+                segs.append(i)
+    
+    def insert_box(self, sid, bbox):
+        """Добавляет фигуру целиком: отрезок 0 во всех клетках ее рамки"""
+        cells = self.cells
+        touched = self.stroke_cells.setdefault(sid, set())
+        for key in self._cell_keys(*bbox):
+            cell = cells.get(key)
+            if cell is None:
+                cell = cells[key] = {}
+            cell[sid] = array('I', (0,))
+            touched.add(key)
+    
+    def remove(self, sid):
+        """Удаляет все отрезки штриха"""
+        for key in self.stroke_cells.pop(sid, ()):
+            cell = self.cells[key]
+            del cell[sid]
+            if not cell:
+                del self.cells[key]
+    
+    def query(self, x0, y0, x1, y1):
+        """Возвращает {id штриха: множество номеров отрезков} рядом с прямоугольником"""
+        found = {}
+        cells = self.cells
+        for key in self._cell_keys(x0, y0, x1, y1):
+            cell = cells.get(key)
+            if cell:
+                for sid, segs in cell.items():
+                    found.setdefault(sid, set()).update(segs)
+        return found
+    
+    def clear(self):
+        self.cells.clear()
+        self.stroke_cells.clear()
+
+# ========== МОДУЛЬ ОБРАБОТКИ ТОЧЕК ==========
+
+def decimate_points(xy, last_x, last_y, min_distance):
+    """Отбрасывает точки, лежащие ближе min_distance к предыдущей оставленной"""
+    result = []
+    min_d2 = min_distance * min_distance
+    for i in range(0, len(xy), 2):
+        x, y = xy[i], xy[i + 1]
+        if (x - last_x) ** 2 + (y - last_y) ** 2 >= min_d2:
+            result.extend((x, y))
+            last_x, last_y = x, y
+    return result
+
+def simplify_points(xy, tolerance):
+    """Упрощает ломаную (плоский список) алгоритмом Рамера-Дугласа-Пекера
+    
+    Первая и последняя точки всегда сохраняются.
+    """
+    n = len(xy) // 2
+    if n < 3 or tolerance <= 0:
+        return list(xy)
+    
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        x0, y0, x1, y1 = xy[2 * first], xy[2 * first + 1], xy[2 * last], xy[2 * last + 1]
+        max_d, index = -1.0, first
+        for i in range(first + 1, last):
+            d = segment_distance(xy[2 * i], xy[2 * i + 1], x0, y0, x1, y1)
+            if d > max_d:
+                max_d, index = d, i
+        if max_d > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    
+    result = []
+    for i in range(n):
+        if keep[i]:
+            result.extend((xy[2 * i], xy[2 * i + 1]))
+    return result
+
+# ========== МОДУЛЬ ОБЛАСТИ ПРОСМОТРА ==========
+
+class Viewport:
+    """Видимая часть бесконечного холста
+    
+    Штрихи в Document хранятся в координатах мира, а элементы холста,
+    буфер изображения и плитки - в координатах экрана:
+    экран = (мир - (x, y)) * zoom. В начальном положении (0, 0, 1)
+    координаты совпадают, и пересчет пропускается.
+    """
+    
+    __slots__ = ('x', 'y', 'zoom')
+    
+    def __init__(self, x=0.0, y=0.0, zoom=1.0):
+        self.x = x
+        self.y = y
+        self.zoom = zoom
+    
+    def identity(self):
+        return self.x == 0 and self.y == 0 and self.zoom == 1
+    
+    def to_world(self, sx, sy):
+        return self.x + sx / self.zoom, self.y + sy / self.zoom
+    
+    def to_screen(self, wx, wy):
+        return (wx - self.x) * self.zoom, (wy - self.y) * self.zoom
+    
+    def points_to_screen(self, xy):
+        """Плоский список точек мира -> точки экрана"""
+        if self.identity():
+            return xy
+        vx, vy, z = self.x, self.y, self.zoom
+        result = array('f', xy)
+        result[0::2] = array('f', [(x - vx) * z for x in xy[0::2]])
+        result[1::2] = array('f', [(y - vy) * z for y in xy[1::2]])
+        return result
+    
+    def points_to_world(self, xy):
+        """Плоский список точек экрана -> точки мира"""
+        if self.identity():
+            return xy
+        vx, vy, z = self.x, self.y, self.zoom
+        result = list(xy)
+        result[0::2] = [vx + x / z for x in xy[0::2]]
+        result[1::2] = [vy + y / z for y in xy[1::2]]
+        return result
+    
+    def bbox_to_screen(self, bbox):
+        if bbox is None or self.identity():
+            return bbox
+        x0, y0 = self.to_screen(bbox[0], bbox[1])
+        x1, y1 = self.to_screen(bbox[2], bbox[3])
+        return x0, y0, x1, y1
+    
+    def bbox_to_world(self, bbox):
+        if bbox is None or self.identity():
+            return bbox
+        x0, y0 = self.to_world(bbox[0], bbox[1])
+        x1, y1 = self.to_world(bbox[2], bbox[3])
+        return x0, y0, x1, y1
+    
+    def visible(self, bbox, size):
+        """Попадает ли прямоугольник мира bbox на экран размером size"""
+        x0, y0, x1, y1 = self.bbox_to_screen(bbox)
+        return x1 >= 0 and y1 >= 0 and x0 <= size[0] and y0 <= size[1]
+    
+    def world_bbox(self, size):
+        """Видимая область мира для экрана размером size"""
+        return self.bbox_to_world((0, 0) + tuple(size))
+    
+    def segments_to_screen(self, segments):
+        """Отрезки (x0, y0, x1, y1, цвет, толщина) мира -> экрана"""
+        if self.identity():
+            return segments
+        vx, vy, z = self.x, self.y, self.zoom
+        return [self.stroke_to_screen(segment) if isinstance(segment, Stroke) else
+                ((segment[0] - vx) * z, (segment[1] - vy) * z, (segment[2] - vx) * z,
+                 (segment[3] - vy) * z, segment[4], segment[5] * z)
+                for segment in segments]
+    
+    def stroke_to_screen(self, stroke):
+        """Копия штриха в координатах экрана (сам штрих, если пересчет не нужен)"""
+        if self.identity():
+            return stroke
+        return Stroke(self.points_to_screen(stroke.points), stroke.color,
+                      stroke.width * self.zoom, stroke.tool, z=stroke.z, layer=stroke.layer,
+                      started=stroke.started, duration=stroke.duration, mask=stroke.mask)
+    
+    def pan(self, dx, dy):
+        """Сдвигает картинку на экране на (dx, dy) пикселей"""
+        self.x -= dx / self.zoom
+        self.y -= dy / self.zoom
+    
+    def zoom_at(self, sx, sy, factor, min_zoom=0.25, max_zoom=8.0):
+        """Меняет масштаб, оставляя точку экрана (sx, sy) на месте
+        
+        Возвращает множитель, который получился с учетом пределов масштаба.
+        """
+        zoom = min(max_zoom, max(min_zoom, self.zoom * factor))
+        factor = zoom / self.zoom
+        if factor != 1:
+            wx, wy = self.to_world(sx, sy)
+            self.zoom = zoom
+            self.x, self.y = wx - sx / zoom, wy - sy / zoom
+        return factor
+    
+    def reset(self):
+        self.x, self.y, self.zoom = 0.0, 0.0, 1.0
+
+# ========== МОДУЛЬ БУФЕРА ИЗОБРАЖЕНИЯ ==========
+
+def draw_round_segment(draw, x0, y0, x1, y1, color, width, start_cap=True):
+    """Рисует отрезок штриха с круглыми концами, как на холсте
+    
+    Координаты округляются вниз: PIL отбрасывает дробную часть, а у
+    отрицательных чисел это сдвиг в другую сторону, и кусок картинки,
+    нарисованный со сдвигом (область буфера, полоса экспорта), иначе
+    расходился бы с целой картинкой по краям линий.
+    """
+    floor = math.floor
+    draw.line((floor(x0), floor(y0), floor(x1), floor(y1)), fill=color, width=round(width))
+    
+    r = width / 2
+    if start_cap:
+        draw.ellipse((floor(x0 - r), floor(y0 - r), floor(x0 + r), floor(y0 + r)), fill=color)
+    draw.ellipse((floor(x1 - r), floor(y1 - r), floor(x1 + r), floor(y1 + r)), fill=color)
+
+def draw_stroke(draw, stroke):
+    """Рисует весь штрих отрезками с круглыми концами (фигуру - целиком)"""
+    if stroke.tool in SHAPE_TOOLS:
+        draw_shape(draw, stroke)
+        return
+    for i in range(stroke.segment_count()):
+        draw_round_segment(draw, *stroke.segment(i), stroke.color, stroke.width)
+
+def draw_segments(draw, segments, dx=0, dy=0):
+    """Рисует список из Document.segments_in со сдвигом (dx, dy)
+    
+    Цвет разбирается один раз на цвет, а начало отрезка, совпадающее
+    с концом предыдущего отрезка того же штриха, уже закруглено.
+    """
+    from PIL import ImageColor
+    
+    inks = {}
+    previous = None
+    for segment in segments:
+        if isinstance(segment, Stroke):
+            draw_shape(draw, segment, dx, dy)
+            previous = None
+            continue
+        x0, y0, x1, y1, color, width = segment
+        ink = inks.get(color)
+        if ink is None:
+            ink = inks[color] = ImageColor.getrgb(color)
+        draw_round_segment(draw, x0 + dx, y0 + dy, x1 + dx, y1 + dy, ink, width,
+                           start_cap=previous != (x0, y0, color, width))
+        previous = (x1, y1, color, width)
+
+def render_strokes(strokes, size, background='white'):
+    """Растеризует штрихи (в порядке наложения) в новую картинку"""
+    from PIL import Image, ImageDraw
+    
+    image = Image.new('RGB', size, background)
+    draw = ImageDraw.Draw(image)
+    for stroke in strokes:
+        draw_stroke(draw, stroke)
+    return image
+
+def select_bake(live, item_limit, keep_recent, deadline):
+    """Выбирает штрихи холста, которые пора запечь в растровый фон
+    
+    live - {id: (время появления, штрих)} штрихов с элементами на холсте.
+    Если элементов больше item_limit, запекается все, кроме keep_recent
+    верхних штрихов; штрих, появившийся раньше deadline, запекается
+    вместе со всем, что лежит под ним. Возвращает [(id, штрих)] по
+    возрастанию z - пустой, если запекать нечего.
+    """
+    over_limit = sum(len(stroke.items) for created, stroke in live.values()) > item_limit
+    if not over_limit and all(created >= deadline for created, stroke in live.values()):
+        return []
+    
+    candidates = sorted(live.items(), key=lambda kv: (kv[1][1].z, kv[0]))
+    count = 0
+    if over_limit:
+        count = max(0, len(candidates) - keep_recent)
+    for index, (sid, (created, stroke)) in enumerate(candidates):
+        if created < deadline:
+            count = max(count, index + 1)
+    return [(sid, stroke) for sid, (created, stroke) in candidates[:count]]
+
+class LayerCache:
+    """Растровый кэш слоя: его штрихи на прозрачном фоне
+    
+    bbox - где на слое что-то нарисовано, dirty - что изменилось с
+    последней сборки общей картинки (None - ничего).
+    """
+    
+    __slots__ = ('image', 'draw', 'bbox', 'dirty')
+    
+    def __init__(self, size):
+        from PIL import Image, ImageDraw
+        
+        self.image = Image.new('RGBA', size, (0, 0, 0, 0))
+        self.draw = ImageDraw.Draw(self.image)
+        self.bbox = None
+        self.dirty = None
+    
+    def touch(self, bbox):
+        """Отмечает, что в области bbox слой изменился"""
+        self.bbox = union_bbox(self.bbox, bbox)
+        self.dirty = union_bbox(self.dirty, bbox)
+
+class BackingImage:
+    """Копия рисунка в памяти, из которой делается сохранение и копирование
+    
+    У каждого слоя свой растровый кэш (LayerCache), а общая картинка
+    из видимых слоев хранится готовой и пересобирается только там, где
+    что-то поменялось: в измененной области слоя, а при показе, скрытии
+    и перестановке слоев - в области, где эти слои что-то содержат.
+    Штрихи при этом заново не рисуются. Пока рисуют на верхнем видимом
+    слое, отрезки сразу попадают и в общую картинку.
+    
+    Сама картинка заводится при первом рисовании или заранее вызовом
+    prepare(), чтобы PIL не замедлял запуск окна.
+    
+    Буфер хранит только видимую часть холста (view): методы рисования
+    принимают координаты мира и сами переводят их в экранные, а
+    прямоугольники в on_change, take_changed() и snapshot() - экранные.
+    """
+    
+    def __init__(self, width, height, background='white'):
+        self.background = background
+        self.size = (width, height)
+        self.composite = None
+        self.composite_draw = None
+        # id слоя -> LayerCache; кэш заводится при первом рисовании на слое
+        self.caches = {}
+        # Видимые слои снизу вверх
+        self.order = [0]
+        # Область общей картинки, которую нужно пересобрать (кроме изменений слоев)
+        self.dirty = None
+        # Область общей картинки, измененная с прошлого take_changed()
+        self.changed = None
+        # Вызывается с прямоугольником, когда буфер перерисован не штрихом,
+        # а заново (стирание, отмена, очистка, смена слоев)
+        self.on_change = None
+        # Какая часть холста видна в буфере
+        self.view = Viewport()
+    
+    def prepare(self):
+        """Заводит общую картинку, если ее еще нет"""
+        if self.composite is None:
+            from PIL import Image, ImageDraw
+            
+            self.composite = Image.new('RGB', self.size, self.background)
+            self.composite_draw = ImageDraw.Draw(self.composite)
+    
+    @property
+    def image(self):
+        """Общая картинка видимых слоев"""
+        self.compose()
+        return self.composite
+    
+    def nbytes(self):
+        """Память под пиксели буфера и кэшей слоев"""
+        if self.composite is None:
+            return 0
+        width, height = self.size
+        return width * height * (3 + 4 * len(self.caches))
+    
+    def top_layer(self):
+        """Верхний видимый слой - рисование на нем не требует пересборки"""
+        return self.order[-1] if self.order else None
+    
+    def covered(self, layer, bbox):
+        """Скрыт ли слой или перекрыт ли bbox на нем содержимым видимых слоев выше"""
+        if layer not in self.order:
+            return True
+        bbox = self.view.bbox_to_screen(bbox)
+        for lid in self.order[self.order.index(layer) + 1:]:
+            cache = self.caches.get(lid)
+            if cache is not None and cache.bbox is not None:
+                x0, y0, x1, y1 = cache.bbox
+                if x0 <= bbox[2] and bbox[0] <= x1 and y0 <= bbox[3] and bbox[1] <= y1:
+                    return True
+        return False
+    
+    def _cache(self, layer):
+        cache = self.caches.get(layer)
+        if cache is None:
+            self.prepare()
+            cache = self.caches[layer] = LayerCache(self.size)
+        return cache
+    
+    def _changed(self, layer, bbox):
+        """Учитывает изменение слоя; на верхнем слое пересборка не нужна"""
+        cache = self.caches[layer]
+        if layer == self.top_layer():
+            cache.bbox = union_bbox(cache.bbox, bbox)
+        else:
+            cache.touch(bbox)
+    
+    def draw_segment(self, x0, y0, x1, y1, color, width, start_cap=False, layer=0):
+        """Рисует один отрезок штриха в буфер"""
+        view = self.view
+        if not view.identity():
+            x0, y0 = view.to_screen(x0, y0)
+            x1, y1 = view.to_screen(x1, y1)
+            width *= view.zoom
+        draw_round_segment(self._cache(layer).draw, x0, y0, x1, y1, color, width, start_cap)
+        pad = width / 2 + 1
+        bbox = (min(x0, x1) - pad, min(y0, y1) - pad, max(x0, x1) + pad, max(y0, y1) + pad)
+        if layer == self.top_layer():
+            draw_round_segment(self.composite_draw, x0, y0, x1, y1, color, width, start_cap)
+            self.changed = union_bbox(self.changed, bbox)
+        self._changed(layer, bbox)
+    
+    def draw_stroke(self, stroke):
+        """Рисует в буфер весь штрих целиком"""
+        stroke = self.view.stroke_to_screen(stroke)
+        draw_stroke(self._cache(stroke.layer).draw, stroke)
+        bbox = stroke.bbox(stroke.width / 2 + 1)
+        if stroke.layer == self.top_layer():
+            draw_stroke(self.composite_draw, stroke)
+            self.changed = union_bbox(self.changed, bbox)
+        self._changed(stroke.layer, bbox)
+    
+    def _clip(self, bbox):
+        """Целочисленный прямоугольник внутри буфера или None"""
+        w, h = self.size
+        left, top = max(0, int(bbox[0])), max(0, int(bbox[1]))
+        right, bottom = min(w, int(bbox[2]) + 1), min(h, int(bbox[3]) + 1)
+        if left >= right or top >= bottom:
+            return None
+        return left, top, right, bottom
+    
+    def _notify(self, bbox):
+        if self.on_change is not None and bbox is not None:
+            self.on_change(bbox)
+    
+    def redraw_region(self, bbox, segments, layer=0):
+        """Перерисовывает прямоугольник bbox слоя layer заново из списка отрезков
+        
+        segments - кортежи (x0, y0, x1, y1, цвет, толщина) в порядке наложения
+        """
+        box = self._clip(self.view.bbox_to_screen(bbox))
+        if box is None:
+            return
+        segments = self.view.segments_to_screen(segments)
+        
+        from PIL import Image, ImageDraw
+        
+        left, top, right, bottom = box
+        region = Image.new('RGBA', (right - left, bottom - top), (0, 0, 0, 0))
+        draw_segments(ImageDraw.Draw(region), segments, -left, -top)
+        cache = self._cache(layer)
+        cache.image.paste(region, (left, top))
+        cache.touch(box)
+        if layer in self.order:
+            self._notify(box)
+    
+    def clear(self, layer=None):
+        """Очищает слой layer или, если он не задан, весь буфер"""
+        if layer is None:
+            self.prepare()
+            self.caches.clear()
+            self.dirty = None
+            self.composite_draw.rectangle((0, 0) + self.size, fill=self.background)
+            self.changed = (0, 0) + self.size
+            self._notify((0, 0) + self.size)
+            return
+        
+        cache = self.caches.pop(layer, None)
+        if cache is not None and cache.bbox is not None and layer in self.order:
+            self.dirty = union_bbox(self.dirty, cache.bbox)
+            self._notify(self._clip(cache.bbox))
+    
+    def scroll(self, dx, dy):
+        """Сдвигает картинку буфера на (dx, dy) пикселей вслед за областью просмотра
+        
+        Ушедшее за край пропадает, открывшиеся полосы остаются пустыми;
+        возвращает их экранные прямоугольники, чтобы дорисовать из штрихов.
+        """
+        from PIL import Image, ImageDraw
+        
+        dx, dy = int(dx), int(dy)
+        w, h = self.size
+        
+        def shift(bbox):
+            return bbox and self._clip((bbox[0] + dx, bbox[1] + dy, bbox[2] + dx, bbox[3] + dy))
+        
+        self.compose()
+        image = Image.new('RGB', self.size, self.background)
+        image.paste(self.composite, (dx, dy))
+        self.composite, self.composite_draw = image, ImageDraw.Draw(image)
+        for cache in self.caches.values():
+            image = Image.new('RGBA', self.size, (0, 0, 0, 0))
+            image.paste(cache.image, (dx, dy))
+            cache.image, cache.draw = image, ImageDraw.Draw(image)
+            cache.bbox, cache.dirty = shift(cache.bbox), shift(cache.dirty)
+        self.changed = (0, 0, w, h)
+        
+        strips = []
+        if dx > 0:
+            strips.append((0, 0, dx, h))
+        elif dx < 0:
+            strips.append((w + dx, 0, w, h))
+        if dy > 0:
+            strips.append((0, 0, w, dy))
+        elif dy < 0:
+            strips.append((0, h + dy, w, h))
+        return strips
+    
+    def set_layers(self, layers):
+        """Применяет видимость и порядок слоев (список Layer снизу вверх)
+        
+        Пересобирается только область слоев, которые появились, исчезли
+        или поменялись местами.
+        """
+        order = [layer.lid for layer in layers if layer.visible]
+        if order == self.order:
+            return
+        
+        changed = set(order) ^ set(self.order)
+        common_old = [lid for lid in self.order if lid in order]
+        common_new = [lid for lid in order if lid in self.order]
+        changed.update(a for a, b in zip(common_old, common_new) if a != b)
+        self.order = order
+        
+        dirty = None
+        for lid in changed:
+            cache = self.caches.get(lid)
+            if cache is not None:
+                dirty = union_bbox(dirty, cache.bbox)
+        if dirty is not None:
+            self.dirty = union_bbox(self.dirty, dirty)
+            self._notify(self._clip(dirty))
+    
+    def compose(self):
+        """Пересобирает измененную часть общей картинки из кэшей видимых слоев"""
+        self.prepare()
+        dirty = self.dirty
+        for lid in self.order:
+            cache = self.caches.get(lid)
+            if cache is not None:
+                dirty = union_bbox(dirty, cache.dirty)
+        # Изменения скрытых слоев учтены в их bbox и попадут в картинку при показе
+        for cache in self.caches.values():
+            cache.dirty = None
+        self.dirty = None
+        box = dirty and self._clip(dirty)
+        if box is None:
+            return
+        
+        from PIL import Image
+        
+        left, top, right, bottom = box
+        region = Image.new('RGB', (right - left, bottom - top), self.background)
+        for lid in self.order:
+            cache = self.caches.get(lid)
+            if cache is not None and cache.bbox is not None:
+                part = cache.image.crop(box)
+                region.paste(part, (0, 0), part)
+        self.composite.paste(region, (left, top))
+        self.changed = union_bbox(self.changed, box)
+    
+    def take_changed(self):
+        """Область общей картинки, измененная с прошлого вызова (None - ничего)"""
+        self.compose()
+        changed, self.changed = self.changed, None
+        return changed
+    
+    def snapshot_size(self, width=None, height=None):
+        """Размер снимка: буфер, обрезанный до размера холста"""
+        w, h = self.size
+        if width and height and width > 1 and height > 1:
+            w, h = min(w, width), min(h, height)
+        return w, h
+    
+    def snapshot(self, width=None, height=None):
+        """Возвращает копию общей картинки, обрезанную до размера холста"""
+        return self.image.crop((0, 0) + self.snapshot_size(width, height))
+
+# ========== МОДУЛЬ ЗАЛИВКИ И ФИГУР ==========
+
+def flood_fill_mask(image, x, y, tolerance=0):
+    """Область заливки из точки (x, y) картинки image
+    
+    В область попадают пиксели, цвет которых отличается от цвета в
+    (x, y) не больше чем на tolerance по каждому каналу и которые
+    связаны с ним по сторонам (не по диагонали). Возвращает
+    (left, top, mask) - угол рамки области и маску в формате
+    Stroke.mask - или None, если точка вне картинки.
+    
+    Сравнение цветов идет таблицами PIL, а связность - по отрезкам строк
+    в NumPy (seed_runs): ищутся только отрезки, связанные с отрезком
+    точки, так что Python-цикл идет по волнам поиска или итерациям
+    слияния, а не по пикселям. Маска собирается из отрезков одним
+    np.repeat. Без NumPy работает ImageDraw.floodfill - заметно медленнее,
+    с той же маской.
+    """
+    width, height = image.size
+    if not (0 <= x < width and 0 <= y < height):
+        return None
+    
+    # 0 там, где все каналы совпали с цветом точки, иначе не 0
+    target = image.getpixel((x, y))
+    bands = image.getbands()
+    if len(bands) == 1:
+        target = (target,)
+    lut = []
+    for value in target:
+        lut.extend(0 if abs(v - value) <= tolerance else 255 for v in range(256))
+    other = image.point(lut)
+    if len(bands) > 1:
+        other = other.convert('L')
+    
+    try:
+        import numpy as np
+    except ImportError:
+        from PIL import ImageDraw
+        
+        # 128 ставится только в связную область точки - ее и вырезаем
+        ImageDraw.floodfill(other, (x, y), 128)
+        mask = other.point(lambda v: 255 if v == 128 else 0).convert('1')
+        left, top, right, bottom = mask.getbbox()
+        mask = mask.crop((left, top, right, bottom))
+        return left, top, (right - left, bottom - top, mask.tobytes())
+    
+    # Отрезки строк: переходы 0/1 в строке с нулем по краям идут парами
+    # начало-конец, поэтому в плоском списке переходов начала - на четных
+    # местах. Номер перехода = строка * stride + столбец.
+    stride = width + 1
+    same = np.zeros((height, width + 2), bool)
+    same[:, 1:-1] = np.asarray(other) == 0
+    # 4K - около 8 млн позиций, int32 вдвое меньше гоняет память
+    edges = np.flatnonzero(same[:, 1:] != same[:, :-1]).astype(np.int32)
+    starts, ends = edges[0::2], edges[1::2]
+    seed = np.searchsorted(starts, y * stride + x, 'right') - 1
+    chosen = seed_runs(starts, ends, stride, seed)
+    
+    rows = starts[chosen] // stride
+    run_starts = starts[chosen] - rows * stride
+    run_ends = ends[chosen] - rows * stride
+    top, left = int(rows[0]), int(run_starts.min())
+    bottom, right = int(rows[-1]) + 1, int(run_ends.max())
+    w, h = right - left, bottom - top
+    
+    # Маска построчно подряд: чередование "вне области" и "в области",
+    # длины - между границами отрезков в координатах рамки
+    bounds = np.empty(2 * len(chosen), np.int64)
+    bounds[0::2] = (rows - top) * w + run_starts - left
+    bounds[1::2] = (rows - top) * w + run_ends - left
+    inside = np.zeros(len(bounds) + 1, bool)
+    inside[1::2] = True
+    mask = np.repeat(inside, np.diff(bounds, prepend=0, append=w * h)).reshape(h, w)
+    return left, top, (w, h, np.packbits(mask, axis=1).tobytes())
+
+def seed_runs(starts, ends, stride, seed):
+    """Номера отрезков строк, связанных с отрезком seed (для flood_fill_mask)
+    
+    starts, ends - начала и концы отрезков по возрастанию, номер позиции =
+    строка * stride + столбец; связаны отрезки соседних строк, у которых
+    есть общий столбец.
+    
+    Связность для всех отрезков сразу: каждый подвешивается к первому
+    перекрывающему отрезку строки выше (лес с прыжками по указателям), а
+    деревья сливает link_runs по остальным перекрытиям - их мало. Это
+    линейно по числу отрезков, и в плотном рисунке, где отрезков сотни
+    тысяч, а область точки мала, дороже поиска в ширину от seed: волна
+    берет перекрывающие ее отрезки строк выше и ниже, и хватает сотни
+    волн. Поэтому при многих отрезках сначала идет поиск, а если область
+    оказалась высокой (волн столько же, сколько строк) или большой
+    (волны огромны), он бросается ради леса.
+    """
+    import numpy as np
+    
+    count = len(starts)
+    reached = np.zeros(count, bool)
+    reached[seed] = True
+    frontier = np.array([seed])
+    found = 1
+    # Бюджет волн растет с числом отрезков; при немногих лес дешевле сразу
+    for _ in range(count // 2048 - 32):
+        # Отрезок строки выше перекрывает [s, e), если кончается после
+        # s - stride и начинается до e - stride; строки ниже - с + stride
+        s, e = starts[frontier], ends[frontier]
+        lo = np.searchsorted(ends, np.concatenate((s - stride, s + stride)), 'right')
+        hi = np.searchsorted(starts, np.concatenate((e - stride, e + stride)), 'left')
+        links = np.maximum(0, hi - lo)
+        total = int(links.sum())
+        near = np.repeat(lo - np.cumsum(links) + links, links) + np.arange(total)
+        frontier = near[~reached[near]]
+        if not len(frontier):
+            return np.flatnonzero(reached)
+        reached[frontier] = True
+        found += len(frontier)
+        if found > count >> 6:
+            break
+    
+    # Отрезки строки выше, перекрывающие отрезок, идут подряд с first;
+    # first - единственный или первый из них, если начинается до e - stride
+    first = np.minimum(np.searchsorted(ends, starts - stride, 'right'), count - 1)
+    limit = ends - stride
+    linked = starts[first] < limit
+    parent = np.arange(count, dtype=starts.dtype)
+    parent[linked] = first[linked]
+    while True:
+        jumped = parent[parent]
+        if np.array_equal(jumped, parent):
+            break
+        parent = jumped
+    
+    # Остальные перекрытия - у отрезков, которых перекрывает и first + 1
+    lower = np.flatnonzero(linked & (starts[np.minimum(first + 1, count - 1)] < limit) & (first + 1 < count))
+    extra = np.searchsorted(starts, limit[lower], 'left') - 1 - first[lower]
+    upper = np.repeat(first[lower] + 1 - np.cumsum(extra) + extra, extra) + np.arange(int(extra.sum()))
+    lower = np.repeat(lower, extra)
+    a, b = parent[upper], parent[lower]
+    merged = a != b
+    # Корни деревьев нумеруются заново, последний - корень дерева seed
+    roots, pairs = np.unique(np.concatenate((a[merged], b[merged], parent[[seed]])), return_inverse=True)
+    n = int(merged.sum())
+    labels = link_runs(np.arange(len(roots)), pairs[:n], pairs[n:2 * n])
+    joined = np.zeros(count, bool)
+    joined[roots[labels == labels[pairs[-1]]]] = True
+    return np.flatnonzero(joined[parent])
+
+def link_runs(parent, upper, lower):
+    """Поиск объединений: сливает пары (upper, lower), корень - наименьший номер"""
+    import numpy as np
+    
+    while True:
+        a, b = parent[upper], parent[lower]
+        if np.array_equal(a, b):
+            return parent
+        np.minimum.at(parent, np.maximum(a, b), np.minimum(a, b))
+        while True:
+            jumped = parent[parent]
+            if np.array_equal(jumped, parent):
+                break
+            parent = jumped
+
+def mask_image(stroke, size=None, crop=None):
+    """Маска заливки как картинка PIL режима '1', растянутая до size
+    
+    crop - вернуть только эту часть растянутой маски (x0, y0, x1, y1):
+    растягивается лишь она; от куска целой маски она может отличаться
+    разве что выбором соседнего пикселя на краях заливки.
+    """
+    from PIL import Image
+    
+    width, height, bits = stroke.mask
+    image = Image.frombytes('1', (width, height), bits)
+    size = size or image.size
+    if crop is None or crop == (0, 0) + tuple(size):
+        return image if size == image.size else image.resize(size, Image.NEAREST)
+    sx, sy = width / size[0], height / size[1]
+    return image.resize((crop[2] - crop[0], crop[3] - crop[1]), Image.NEAREST,
+                        box=(crop[0] * sx, crop[1] * sy, crop[2] * sx, crop[3] * sy))
+
+def draw_shape(draw, stroke, dx=0, dy=0):
+    """Рисует фигуру или заливку со сдвигом (dx, dy)"""
+    x0, y0, x1, y1 = stroke.points
+    box = (x0 + dx, y0 + dy, x1 + dx, y1 + dy)
+    if stroke.tool == 'rect':
+        draw.rectangle(box, fill=stroke.color)
+    elif stroke.tool == 'ellipse':
+        draw.ellipse(box, fill=stroke.color)
+    else:
+        left, top = round(box[0]), round(box[1])
+        size = (max(1, round(box[2]) - left), max(1, round(box[3]) - top))
+        # Растягиваем только ту часть маски, что попадает на картинку, -
+        # при большом увеличении целая маска заняла бы сотни мегабайт
+        width, height = draw.im.size
+        x0, y0 = max(left, 0), max(top, 0)
+        x1, y1 = min(left + size[0], width), min(top + size[1], height)
+        if x1 > x0 and y1 > y0:
+            crop = (x0 - left, y0 - top, x1 - left, y1 - top)
+            draw.bitmap((x0, y0), mask_image(stroke, size, crop), fill=stroke.color)
+
+def shape_contains(stroke, x, y, reach=0):
+    """Задевает ли круг радиуса reach с центром (x, y) фигуру или заливку"""
+    x0, y0, x1, y1 = stroke.points
+    if not (x0 - reach <= x <= x1 + reach and y0 - reach <= y <= y1 + reach):
+        return False
+    if stroke.tool == 'rect':
+        return True
+    if stroke.tool == 'ellipse':
+        rx, ry = (x1 - x0) / 2 + reach, (y1 - y0) / 2 + reach
+        return ((x - (x0 + x1) / 2) / rx) ** 2 + ((y - (y0 + y1) / 2) / ry) ** 2 <= 1
+    
+    # Заливка: есть ли пиксель маски в квадрате вокруг точки
+    width, height, bits = stroke.mask
+    sx, sy = width / max(x1 - x0, 1e-9), height / max(y1 - y0, 1e-9)
+    row_bytes = (width + 7) // 8
+    for my in range(max(0, int((y - reach - y0) * sy)), min(height, int((y + reach - y0) * sy) + 1)):
+        for mx in range(max(0, int((x - reach - x0) * sx)), min(width, int((x + reach - x0) * sx) + 1)):
+            if bits[my * row_bytes + mx // 8] & (0x80 >> (mx % 8)):
+                return True
+    return False
+
+def mask_runs(stroke):
+    """Прямоугольники (x, y, ширина, высота), из которых состоит заливка
+    
+    Одинаковые отрезки соседних строк маски сливаются в один прямоугольник.
+    """
+    width, height, bits = stroke.mask
+    pixels = mask_image(stroke).convert('L').tobytes()
+    x0, y0, x1, y1 = stroke.points
+    sx, sy = (x1 - x0) / width, (y1 - y0) / height
+    opened = {}
+    rects = []
+    for row in range(height + 1):
+        runs = set()
+        if row < height:
+            line = pixels[row * width:(row + 1) * width]
+            start = line.find(255)
+            while start >= 0:
+                end = line.find(0, start)
+                if end < 0:
+                    end = width
+                runs.add((start, end))
+                start = line.find(255, end)
+        for run in [run for run in opened if run not in runs]:
+            first = opened.pop(run)
+            rects.append((x0 + run[0] * sx, y0 + first * sy, (run[1] - run[0]) * sx, (row - first) * sy))
+        for run in runs:
+            opened.setdefault(run, row)
+    return rects
+
+# ========== МОДУЛЬ АВТОСОХРАНЕНИЯ ==========
+
+# Формат журнала: сигнатура JOURNAL_MAGIC, затем записи
+#   тип (1 байт), длина данных (4 байта), данные, crc32 типа и данных (4 байта)
+# Запись добавления штриха: id, z, толщина, число точек, цвет и инструмент
+# (строки с длиной в 1 байт), затем точки float32, номер слоя (4 байта;
+# в журналах без слоев его нет - это слой 0), время начала штриха (float64)
+# и длительность рисования (float32; в старых журналах их нет - это 0).
+# У заливки за ними маска: ширина, высота, длина сжатых данных (по 4 байта)
+# и биты маски, сжатые zlib. Все числа - little-endian.
+JOURNAL_MAGIC = b'RPJ1'
+JOURNAL_ADD = 1
+JOURNAL_REMOVE = 2
+JOURNAL_CLEAR = 3
+
+_journal_record = struct.Struct('<BI')
+_journal_add = struct.Struct('<IIfI')
+_journal_sid = struct.Struct('<I')
+_journal_crc = struct.Struct('<I')
+_journal_time = struct.Struct('<df')
+_journal_mask = struct.Struct('<III')
+
+def encode_journal_record(kind, payload=b''):
+    """Упаковывает запись журнала вместе с контрольной суммой"""
+    head = _journal_record.pack(kind, len(payload))
+    return head + payload + _journal_crc.pack(zlib.crc32(payload, zlib.crc32(head)))
+
+def encode_journal_add(sid, stroke):
+    color = stroke.color.encode('utf-8')
+    tool = stroke.tool.encode('utf-8')
+    points = stroke.points
+    if sys.byteorder != 'little':
+        points = array('f', points)
+        points.byteswap()
+    payload = b''.join((
+        _journal_add.pack(sid, stroke.z, stroke.width, len(points) // 2),
+        bytes((len(color),)), color,
+        bytes((len(tool),)), tool,
+        points.tobytes(),
+        _journal_sid.pack(stroke.layer),
+        _journal_time.pack(stroke.started, stroke.duration)
+    ))
+    if stroke.mask is not None:
+        width, height, bits = stroke.mask
+        bits = zlib.compress(bits, 1)
+        payload += _journal_mask.pack(width, height, len(bits)) + bits
+    return encode_journal_record(JOURNAL_ADD, payload)
+
+def encode_journal_remove(sid):
+    return encode_journal_record(JOURNAL_REMOVE, _journal_sid.pack(sid))
+
+def parse_journal_record(data, pos):
+    """Проверяет запись журнала с позиции pos
+    
+    Возвращает (тип, начало данных, конец данных, начало следующей записи)
+    или None, если запись оборвана; на испорченной записи (не сходится
+    crc32) - ValueError. Тем же форматом идут кадры трансляции штрихов.
+    """
+    if pos + _journal_record.size > len(data):
+        return None
+    kind, length = _journal_record.unpack_from(data, pos)
+    end = pos + _journal_record.size + length
+    if end + _journal_crc.size > len(data):
+        return None
+    (crc,) = _journal_crc.unpack_from(data, end)
+    if zlib.crc32(memoryview(data)[pos:end]) != crc:
+        raise ValueError("испорченная запись журнала")
+    return kind, pos + _journal_record.size, end, end + _journal_crc.size
+
+def decode_journal_add(data, start, end):
+    """Достает (sid, штрих) из данных записи JOURNAL_ADD"""
+    view = memoryview(data)
+    sid, z, width, count = _journal_add.unpack_from(data, start)
+    p = start + _journal_add.size
+    color = bytes(view[p + 1:p + 1 + data[p]]).decode('utf-8')
+    p += 1 + data[p]
+    tool = bytes(view[p + 1:p + 1 + data[p]]).decode('utf-8')
+    p += 1 + data[p]
+    points = array('f')
+    points.frombytes(view[p:p + 8 * count])
+    if sys.byteorder != 'little':
+        points.byteswap()
+    p += 8 * count
+    layer = _journal_sid.unpack_from(data, p)[0] if p + _journal_sid.size <= end else 0
+    p += _journal_sid.size
+    started, duration = _journal_time.unpack_from(data, p) if p + _journal_time.size <= end else (0.0, 0.0)
+    p += _journal_time.size
+    mask = None
+    if p + _journal_mask.size <= end:
+        mask_width, mask_height, length = _journal_mask.unpack_from(data, p)
+        p += _journal_mask.size
+        mask = (mask_width, mask_height, zlib.decompress(view[p:p + length]))
+    return sid, Stroke(points, color, width, tool, z=z, layer=layer, started=started, duration=duration,
+                       mask=mask)
+
+def read_journal_records(data):
+    """Разбирает записи журнала (kind, sid, stroke) из байтов
+    
+    Останавливается на первой оборванной или испорченной записи -
+    так выглядит хвост журнала после аварийного завершения.
+    """
+    if data[:len(JOURNAL_MAGIC)] != JOURNAL_MAGIC:
+        return
+    
+    pos = len(JOURNAL_MAGIC)
+    while True:
+        try:
+            record = parse_journal_record(data, pos)
+        except ValueError:
+            return
+        if record is None:
+            return
+        kind, start, end, pos = record
+        if kind == JOURNAL_ADD:
+            sid, stroke = decode_journal_add(data, start, end)
+            yield kind, sid, stroke
+        elif kind == JOURNAL_REMOVE:
+            yield kind, _journal_sid.unpack_from(data, start)[0], None
+        elif kind == JOURNAL_CLEAR:
+            yield kind, None, None
+
+def load_journal(path):
+    """Восстанавливает штрихи {id: Stroke} из журнала; нет файла - пустой рисунок"""
+    strokes = {}
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return strokes
+    
+    for record in read_journal_records(data):
+        apply_journal_record(strokes, *record)
+    return strokes
+
+def apply_journal_record(strokes, kind, sid, stroke):
+    """Применяет запись журнала к штрихам {id: Stroke}"""
+    if kind == JOURNAL_ADD:
+        strokes[sid] = stroke
+    elif kind == JOURNAL_REMOVE:
+        strokes.pop(sid, None)
+    else:
+        strokes.clear()
+
+class AutosaveJournal:
+    """Фоновая запись изменений рисунка в журнал, только дописыванием в конец
+    
+    Главный поток лишь кладет события в очередь. Поток записи забирает их
+    пачками, после каждой пачки отдает данные ОС (это переживает падение
+    программы), а fsync делает не чаще раза в sync_interval секунд.
+    
+    Ошибка записи (диск полон, ошибка ввода-вывода) останавливает поток и
+    остается в error; после нее события больше не копятся в очереди.
+    Главный поток проверяет error сам - из потока записи Tk трогать нельзя.
+    """
+    
+    _stop = object()
+    
+    def __init__(self, path, sync_interval=1.0):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.queue = queue.Queue()
+        self.thread = None
+        self.error = None
+    
+    def start(self, strokes):
+        """Переписывает журнал начисто из текущих штрихов и запускает запись"""
+        self.thread = threading.Thread(
+            target=self._run, args=(dict(strokes),), name='autosave-journal', daemon=True
+        )
+        self.thread.start()
+    
+    def add(self, sid, stroke):
+        if self.error is None:
+            self.queue.put((JOURNAL_ADD, sid, stroke))
+    
+    def remove(self, sid):
+        if self.error is None:
+            self.queue.put((JOURNAL_REMOVE, sid, None))
+    
+    def clear(self):
+        if self.error is None:
+            self.queue.put((JOURNAL_CLEAR, None, None))
+    
+    def flush(self, timeout=None):
+        """Ждет, пока все поставленные события окажутся в файле журнала
+        
+        Возвращает False, если журнал не ведется, остановлен ошибкой
+        или не успел за timeout секунд.
+        """
+        return self.mark()(timeout)
+    
+    def mark(self):
+        """Ставит в очередь отметку и возвращает wait(timeout=None) для нее
+        
+        wait отвечает как flush, но только за события, поставленные до
+        mark, и ждать ее можно из другого потока: главный поток ставит
+        отметку и не блокируется, а ждет фоновая задача.
+        """
+        thread = self.thread
+        if thread is None or self.error is not None:
+            return lambda timeout=None: False
+        written = threading.Event()
+        self.queue.put(written)
+        
+        def wait(timeout=None):
+            deadline = None if timeout is None else time.monotonic() + timeout
+            # Поток, умерший после проверки выше, событие уже не отметит
+            while not written.wait(0.05):
+                if not thread.is_alive() or (deadline is not None and time.monotonic() > deadline):
+                    return False
+            return self.error is None
+        
+        return wait
+    
+    def close(self):
+        """Дописывает очередь, делает fsync и останавливает поток"""
+        if self.thread is not None:
+            self.queue.put(self._stop)
+            self.thread.join()
+            self.thread = None
+    
+    def _encode(self, event):
+        kind, sid, stroke = event
+        if kind == JOURNAL_ADD:
+            return encode_journal_add(sid, stroke)
+        if kind == JOURNAL_REMOVE:
+            return encode_journal_remove(sid)
+        return encode_journal_record(kind)
+    
+    def _compact(self, strokes):
+        """Пишет снимок штрихов во временный файл и подменяет им журнал"""
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(JOURNAL_MAGIC)
+            for sid, stroke in strokes.items():
+                f.write(encode_journal_add(sid, stroke))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+    
+    def _run(self, strokes):
+        f = None
+        try:
+            self._compact(strokes)
+            f = open(self.path, 'ab')
+            self._write_loop(f)
+        except OSError as e:
+            self.error = e
+            # Очередь больше никто не разберет - освобождаем ее и будим flush
+            while True:
+                try:
+                    event = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if isinstance(event, threading.Event):
+                    event.set()
+        finally:
+            if f is not None:
+                try:
+                    f.close()
+                except OSError:
+                    pass
+    
+    def _write_loop(self, f):
+        unsynced = False
+        last_sync = time.monotonic()
+        stopping = False
+        while not stopping:
+            try:
+                first = self.queue.get(timeout=self.sync_interval if unsynced else None)
+                batch = [first]
+            except queue.Empty:
+                batch = []
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            chunks = []
+            flushed = []
+            for event in batch:
+                if event is self._stop:
+                    stopping = True
+                elif isinstance(event, threading.Event):
+                    flushed.append(event)
+                else:
+                    chunks.append(self._encode(event))
+            if chunks:
+                f.write(b''.join(chunks))
+                f.flush()
+                unsynced = True
+            for event in flushed:
+                event.set()
+            
+            now = time.monotonic()
+            if unsynced and (stopping or not batch or now - last_sync >= self.sync_interval):
+                os.fsync(f.fileno())
+                unsynced = False
+                last_sync = now
+
+class JournalTee:
+    """Отдает изменения рисунка нескольким получателям с методами журнала
+    
+    Ставится в document.journal, когда кроме автосохранения изменения
+    нужны еще кому-то (например, трансляции на другие окна).
+    """
+    
+    def __init__(self, *targets):
+        self.targets = targets
+    
+    def add(self, sid, stroke):
+        for target in self.targets:
+            target.add(sid, stroke)
+    
+    def remove(self, sid):
+        for target in self.targets:
+            target.remove(sid)
+    
+    def clear(self):
+        for target in self.targets:
+            target.clear()
+
+# ========== МОДУЛЬ ПРОФИЛИРОВАНИЯ ==========
+
+class LatencyHistogram:
+    """Гистограмма задержек в логарифмических корзинах (шаг 5%)
+    
+    Запись - O(1) и без выделения памяти; перцентили считаются по
+    корзинам с точностью до ширины корзины.
+    """
+    
+    min_ms = 0.01
+    growth = 1.05
+    bucket_count = 340  # от 0.01 мс до ~160 с
+    
+    def __init__(self):
+        self.buckets = [0] * self.bucket_count
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self._log_growth = math.log(self.growth)
+    
+    def record(self, ms):
+        if ms <= self.min_ms:
+            index = 0
+        else:
+            index = min(self.bucket_count - 1, int(math.log(ms / self.min_ms) / self._log_growth))
+        self.buckets[index] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+    
+    def bucket_upper(self, index):
+        """Верхняя граница корзины в миллисекундах"""
+        return self.min_ms * self.growth ** (index + 1)
+    
+    def percentile(self, p):
+        """Задержка, ниже которой лежит p процентов замеров (None - замеров нет)"""
+        if not self.count:
+            return None
+        rank = p / 100.0 * self.count
+        seen = 0
+        for index, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return min(self.bucket_upper(index), self.max_ms)
+        return self.max_ms
+    
+    def reset(self):
+        self.buckets = [0] * self.bucket_count
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+    
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total_ms / self.count if self.count else None,
+            'max_ms': self.max_ms,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+            'buckets': {
+                f"{self.bucket_upper(i):.3f}": n for i, n in enumerate(self.buckets) if n
+            },
+        }
+
+class Profiler:
+    """Счетчики производительности для панели F3 и выгрузки в файл
+    
+    Места замеров проверяют только флаг enabled, поэтому выключенный
+    профилировщик почти ничего не стоит.
+    """
+    
+    def __init__(self):
+        self.enabled = False
+        self.latency = LatencyHistogram()
+        self.counters = {}
+        self.gauges = {}
+        self.started = time.monotonic()
+    
+    def enable(self):
+        self.reset()
+        self.enabled = True
+    
+    def disable(self):
+        self.enabled = False
+    
+    def reset(self):
+        self.latency.reset()
+        self.counters.clear()
+        self.gauges.clear()
+        self.started = time.monotonic()
+    
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+    
+    def gauge(self, name, value):
+        self.gauges[name] = value
+    
+    def gauge_max(self, name, value):
+        """Запоминает наибольшее значение показателя"""
+        if value > self.gauges.get(name, value - 1):
+            self.gauges[name] = value
+    
+    def snapshot(self):
+        """Все счетчики одним словарем"""
+        return {
+            'seconds': time.monotonic() - self.started,
+            'counters': dict(self.counters),
+            'gauges': dict(self.gauges),
+            'motion_to_canvas_latency': self.latency.to_dict(),
+        }
+    
+    def dump(self, path):
+        """Записывает снимок счетчиков в JSON-файл"""
+        import json
+        
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, indent=2, ensure_ascii=False)
+        return path
+
+# ========== МОДУЛЬ ПЛАНИРОВЩИКА КАДРОВ ==========
+
+class FrameScheduler:
+    """Выполняет отложенные изменения интерфейса раз в кадр
+    
+    Обработчики событий не трогают окно сами, а ставят функцию в очередь
+    (schedule). Повторная постановка той же функции до кадра только
+    заменяет ее аргументы, поэтому десяток событий слайдера между кадрами
+    дает одно изменение. В кадре задачи выполняются в порядке постановки,
+    пока не кончится бюджет; остальные ждут следующего кадра. Таймер -
+    root.after, так что сам планировщик от Tk не зависит.
+    """
+    
+    def __init__(self, root, interval_ms=16, budget_ms=8.0, profiler=None):
+        self.root = root
+        self.interval_ms = interval_ms
+        self.budget = budget_ms / 1000
+        self.profiler = profiler or Profiler()
+        # Функция -> аргументы последней постановки, в порядке первой постановки
+        self.pending = {}
+        self.after_id = None
+    
+    def schedule(self, func, *args):
+        self.pending[func] = args
+        if self.profiler.enabled:
+            self.profiler.count('ui_requests')
+        if self.after_id is None:
+            self.after_id = self.root.after(self.interval_ms, self.run)
+    
+    def cancel(self, func):
+        """Снимает задачу, если она еще не выполнена"""
+        self.pending.pop(func, None)
+    
+    def run(self):
+        """Кадр: выполняет задачи, пока укладывается в бюджет"""
+        self.after_id = None
+        # Поставленное во время кадра выполняется уже в следующем
+        jobs, self.pending = self.pending, {}
+        deadline = time.perf_counter() + self.budget
+        done = 0
+        try:
+            while jobs:
+                func = next(iter(jobs))
+                func(*jobs.pop(func))
+                done += 1
+                if time.perf_counter() >= deadline:
+                    break
+        finally:
+            # Невыполненные идут первыми; новые аргументы той же функции важнее старых
+            jobs.update(self.pending)
+            self.pending = jobs
+            if self.pending and self.after_id is None:
+                self.after_id = self.root.after(self.interval_ms, self.run)
+            if self.profiler.enabled:
+                self.profiler.count('ui_updates', done)
+                self.profiler.count('ui_frames')
+
+# ========== МОДУЛЬ ЭКСПОРТА ==========
+
+def write_image(image, filename):
+    """Кодирует и записывает картинку; формат определяется по расширению"""
+    image.save(filename)
+
+def adler32_combine(adler1, adler2, length2):
+    """Контрольная сумма Adler-32 склейки двух блоков по их суммам (как в zlib)"""
+    base = 65521
+    rem = length2 % base
+    sum1 = adler1 & 0xffff
+    sum2 = rem * sum1 % base
+    sum1 = (sum1 + (adler2 & 0xffff) + base - 1) % base
+    sum2 = (sum2 + (adler1 >> 16) + (adler2 >> 16) + base - rem) % base
+    return sum1 | (sum2 << 16)
+
+def png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(data, zlib.crc32(kind)))
+
+def png_header(size):
+    """Сигнатура и заголовок PNG для картинки RGB размером size"""
+    width, height = size
+    return b'\x89PNG\r\n\x1a\n' + png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+
+def encode_png_band(band, level=6):
+    """Сжимает полосу строк картинки в кусок deflate-потока PNG
+    
+    Возвращает (байты, adler32, длина несжатых данных). Поток закрыт
+    Z_SYNC_FLUSH, поэтому куски полос склеиваются подряд.
+    """
+    band = band if band.mode == 'RGB' else band.convert('RGB')
+    raw = band.tobytes()
+    stride = 3 * band.size[0]
+    # Фильтр 0 (без предсказания) - строки полосы не зависят от соседних полос
+    filtered = b''.join(b'\0' + raw[i:i + stride] for i in range(0, len(raw), stride))
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    data = compressor.compress(filtered) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    return data, zlib.adler32(filtered), len(filtered)
+
+class PNGTileCache:
+    """PNG рисунка, собранный из независимо сжатых полос строк
+    
+    Картинка делится на полосы по band_height строк во всю ширину (строки
+    PNG сжимаются одним потоком, поэтому плитка во всю ширину - самая
+    мелкая, которую можно склеить без перекодирования). Каждая полоса
+    сжимается отдельным deflate-потоком, закрытым Z_SYNC_FLUSH, так что
+    готовые куски склеиваются в один корректный zlib-поток, а Adler-32
+    всей картинки считается из сумм полос.
+    
+    Главный поток отмечает измененные области (mark_dirty) и готовит
+    задачу (prepare) - копии только измененных полос. Фоновый поток
+    (encode) пережимает эти полосы и склеивает PNG; задачи применяются
+    строго по порядку номеров, даже если пул запустил их параллельно.
+    
+    Если задача не пережалась (ошибка в encode), ее полосы остаются в
+    lost: PNG не собирается, пока они не будут пережаты, а prepare
+    добавляет их в каждую следующую задачу.
+    """
+    
+    def __init__(self, band_height=64, level=6):
+        self.band_height = band_height
+        self.level = level
+        # Состояние главного потока: размер, измененные полосы, номер последней задачи
+        self.size = None
+        self.dirty = set()
+        self.submitted = 0
+        # Состояние кодирования (под condition): сжатые полосы
+        # (байты, adler32, длина), номер примененной задачи и готовый PNG
+        self.condition = threading.Condition()
+        self.bands = []
+        self.encoded = 0
+        self.png = None
+        # Полосы, чьи сжатые копии устарели после ошибки; под своим замком,
+        # чтобы prepare не ждал кодирования
+        self.lost = set()
+        self.lost_lock = threading.Lock()
+    
+    def mark_dirty(self, bbox):
+        """Отмечает измененную область картинки"""
+        if bbox is None or self.size is None:
+            return
+        first = max(0, int(bbox[1]) // self.band_height)
+        last = min(self.band_count(self.size) - 1, int(bbox[3]) // self.band_height)
+        self.dirty.update(range(first, last + 1))
+    
+    def band_count(self, size):
+        return -(-size[1] // self.band_height)
+    
+    def prepare(self, image, size):
+        """Копирует измененные полосы картинки для кодирования в фоне
+        
+        Возвращает задачу для encode или None, если с прошлой задачи
+        ничего не менялось.
+        """
+        if size != self.size:
+            self.size = size
+            self.dirty = set(range(self.band_count(size)))
+        else:
+            with self.lost_lock:
+                self.dirty |= self.lost
+        if not self.dirty and self.submitted:
+            return None
+        
+        width, height = size
+        bands = {}
+        for index in self.dirty:
+            top = index * self.band_height
+            bands[index] = image.crop((0, top, width, min(height, top + self.band_height)))
+        self.dirty = set()
+        self.submitted += 1
+        return self.submitted, size, bands
+    
+    def encode(self, job=None):
+        """Пережимает полосы задачи и возвращает PNG; без задачи - последний PNG"""
+        with self.condition:
+            if job is None:
+                self.condition.wait_for(lambda: self.encoded >= self.submitted)
+                if self.png is None:
+                    raise RuntimeError("PNG не собран после ошибки кодирования")
+                return self.png
+            
+            seq, size, bands = job
+            self.condition.wait_for(lambda: self.encoded == seq - 1)
+            try:
+                if len(bands) == self.band_count(size):
+                    self.bands = [None] * len(bands)
+                    with self.lost_lock:
+                        self.lost.clear()
+                for index, band in bands.items():
+                    self.bands[index] = encode_png_band(band, self.level)
+                with self.lost_lock:
+                    self.lost.difference_update(bands)
+                    missing = len(self.lost)
+                if missing:
+                    # Задачу готовили до ошибки - пропавших полос в ней нет
+                    raise RuntimeError(f"{missing} полос PNG ждут повторного кодирования")
+                self.png = self._assemble(size)
+            except Exception:
+                self.png = None
+                with self.lost_lock:
+                    self.lost.update(bands)
+                raise
+            finally:
+                self.encoded = seq
+                self.condition.notify_all()
+            return self.png
+    
+    def _assemble(self, size):
+        adler = 1
+        for data, band_adler, length in self.bands:
+            adler = adler32_combine(adler, band_adler, length)
+        idat = b''.join((
+            b'\x78\x9c',
+            b''.join(band[0] for band in self.bands),
+            _deflate_end,
+            struct.pack('>I', adler)
+        ))
+        return b''.join((
+            png_header(size),
+            png_chunk(b'IDAT', idat),
+            png_chunk(b'IEND', b'')
+        ))
+    
+    def write(self, job, filename):
+        """Кодирует задачу (с кэшем полос) и записывает PNG"""
+        data = self.encode(job)
+        with open(filename, 'wb') as f:
+            f.write(data)
+
+# Пустой завершающий блок deflate, закрывающий склеенные полосы
+_deflate_end = zlib.compressobj(6, zlib.DEFLATED, -15).flush()
+
+def format_coords(points):
+    """Координаты через пробел, округленные до пикселя (события Tk целочисленные)"""
+    return ' '.join(map(str, map(round, points)))
+
+def visible_on_page(strokes, size, view=None):
+    """Штрихи, видимые на странице size в области просмотра view, в координатах страницы
+    
+    Штрихи хранятся в координатах мира; без view страница начинается в
+    начале координат мира в масштабе 1.
+    """
+    view = view or Viewport()
+    for stroke in strokes:
+        if view.visible(stroke.bbox(stroke.width / 2 + 1), size):
+            yield view.stroke_to_screen(stroke)
+
+def write_svg(strokes, size, filename, view=None):
+    """Записывает штрихи в SVG ломаными, по одному штриху за раз
+    
+    view - область просмотра, которую показывает страница (см. visible_on_page).
+    """
+    width, height = size
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+            f'viewBox="0 0 {width} {height}">\n'
+            f'<rect width="{width}" height="{height}" fill="white"/>\n'
+            '<g fill="none" stroke-linecap="round" stroke-linejoin="round">\n'
+        )
+        for stroke in visible_on_page(strokes, size, view):
+            if stroke.tool in SHAPE_TOOLS:
+                f.write(svg_shape(stroke))
+                continue
+            f.write(
+                f'<polyline stroke="{stroke.color}" stroke-width="{stroke.width:g}" '
+                f'points="{format_coords(stroke.points)}"/>\n'
+            )
+        f.write('</g>\n</svg>\n')
+
+def svg_shape(stroke):
+    """Элемент SVG для фигуры; заливка - одним путем из прямоугольников маски"""
+    x0, y0, x1, y1 = stroke.points
+    if stroke.tool == 'rect':
+        return (f'<rect fill="{stroke.color}" x="{x0:.1f}" y="{y0:.1f}" '
+                f'width="{x1 - x0:.1f}" height="{y1 - y0:.1f}"/>\n')
+    if stroke.tool == 'ellipse':
+        return (f'<ellipse fill="{stroke.color}" cx="{(x0 + x1) / 2:.1f}" cy="{(y0 + y1) / 2:.1f}" '
+                f'rx="{(x1 - x0) / 2:.1f}" ry="{(y1 - y0) / 2:.1f}"/>\n')
+    path = ''.join(f'M{x:.2f} {y:.2f}h{w:.2f}v{h:.2f}h{-w:.2f}z' for x, y, w, h in mask_runs(stroke))
+    return f'<path fill="{stroke.color}" d="{path}"/>\n'
+
+def pdf_shape(stroke):
+    """Команды PDF, закрашивающие фигуру (цвет заливки уже выбран)"""
+    x0, y0, x1, y1 = stroke.points
+    if stroke.tool == 'rect':
+        return f'{x0:.2f} {y0:.2f} {x1 - x0:.2f} {y1 - y0:.2f} re f\n'
+    if stroke.tool == 'ellipse':
+        # Четыре кривые Безье; k - доля радиуса для опорных точек
+        cx, cy, rx, ry = (x0 + x1) / 2, (y0 + y1) / 2, (x1 - x0) / 2, (y1 - y0) / 2
+        k = 0.5523
+        return (f'{cx + rx:.2f} {cy:.2f} m\n'
+                f'{cx + rx:.2f} {cy + k * ry:.2f} {cx + k * rx:.2f} {cy + ry:.2f} {cx:.2f} {cy + ry:.2f} c\n'
+                f'{cx - k * rx:.2f} {cy + ry:.2f} {cx - rx:.2f} {cy + k * ry:.2f} {cx - rx:.2f} {cy:.2f} c\n'
+                f'{cx - rx:.2f} {cy - k * ry:.2f} {cx - k * rx:.2f} {cy - ry:.2f} {cx:.2f} {cy - ry:.2f} c\n'
+                f'{cx + k * rx:.2f} {cy - ry:.2f} {cx + rx:.2f} {cy - k * ry:.2f} {cx + rx:.2f} {cy:.2f} c\n'
+                'f\n')
+    return ''.join(f'{x:.2f} {y:.2f} {w:.2f} {h:.2f} re\n' for x, y, w, h in mask_runs(stroke)) + 'f\n'
+
+def write_vector_pdf(strokes, size, filename, view=None, resolution=100.0):
+    """Записывает штрихи в PDF контурами, сжимая поток содержимого на лету
+    
+    Длина потока заранее неизвестна, поэтому она вынесена в отдельный
+    объект после потока - так файл пишется за один проход. view -
+    область просмотра, которую показывает страница (см. visible_on_page).
+    """
+    width, height = size
+    scale = 72.0 / resolution
+    offsets = []
+    
+    with open(filename, 'wb') as f:
+        def begin_object():
+            offsets.append(f.tell())
+            f.write(b'%d 0 obj\n' % len(offsets))
+        
+        f.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        begin_object()
+        f.write(b'<< /Type /Catalog /Pages 2 0 R >>\nendobj\n')
+        begin_object()
+        f.write(b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>\nendobj\n')
+        begin_object()
+        f.write(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.2f %.2f] /Contents 4 0 R >>\nendobj\n'
+                % (width * scale, height * scale))
+        
+        begin_object()
+        from PIL import ImageColor
+        
+        f.write(b'<< /Length 5 0 R /Filter /FlateDecode >>\nstream\n')
+        start = f.tell()
+        compressor = zlib.compressobj(1)
+        # Белый фон, круглые концы и стыки, ось y вниз, как на холсте
+        f.write(compressor.compress(
+            b'1 g 0 0 %.2f %.2f re f\n1 J 1 j\n%.4f 0 0 %.4f 0 %.2f cm\n'
+            % (width * scale, height * scale, scale, -scale, height * scale)
+        ))
+        for stroke in visible_on_page(strokes, size, view):
+            r, g, b = ImageColor.getrgb(stroke.color)[:3]
+            if stroke.tool in SHAPE_TOOLS:
+                path = f'{r / 255:.3f} {g / 255:.3f} {b / 255:.3f} rg\n' + pdf_shape(stroke)
+                f.write(compressor.compress(path.encode('ascii')))
+                continue
+            coords = format_coords(stroke.points).split(' ')
+            pairs = list(map(' '.join, zip(coords[0::2], coords[1::2])))
+            path = (f'{r / 255:.3f} {g / 255:.3f} {b / 255:.3f} RG {stroke.width:g} w\n'
+                    f'{pairs[0]} m\n' + ' l\n'.join(pairs[1:]) + ' l\nS\n')
+            f.write(compressor.compress(path.encode('ascii')))
+        f.write(compressor.flush())
+        length = f.tell() - start
+        f.write(b'\nendstream\nendobj\n')
+        
+        begin_object()
+        f.write(b'%d\nendobj\n' % length)
+        
+        xref = f.tell()
+        f.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(offsets) + 1))
+        for offset in offsets:
+            f.write(b'%010d 00000 n \n' % offset)
+        f.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+                % (len(offsets) + 1, xref))
+
+# ========== МОДУЛЬ ЭКСПОРТА В ВЫСОКОМ РАЗРЕШЕНИИ ==========
+
+# Процесс пула, рисующий полосы: открытый файл сеанса и масштаб
+_band_state = None
+
+def init_band_worker(path, scale):
+    """Открывает файл сеанса в процессе пула
+    
+    Все штрихи процесс в памяти не держит: для каждой полосы он
+    достает из файла (через mmap - страницы файла общие для всех
+    процессов) только штрихи, габариты которых ее задевают. Память
+    процесса растет с числом штрихов в полосе, а не во всем сеансе.
+    """
+    global _band_state
+    _band_state = (SessionFile(path).open(), scale)
+
+def render_png_band(top, width, height, level=6):
+    """Рисует строки [top, top + height) увеличенной картинки и сжимает их для PNG"""
+    from PIL import Image, ImageDraw
+    
+    session, scale = _band_state
+    bottom = top + height
+    band = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(band)
+    view = Viewport(0.0, 0.0, scale)
+    # Полосы идут во всю ширину - штрих попадает в полосу по размаху по
+    # вертикали. Штрихи рисуются по одному, в памяти только текущий
+    for sid, stroke in session.strokes(session.query((-math.inf, top / scale, math.inf, bottom / scale))):
+        # Точки увеличиваются так же, как для render_strokes, - в float32:
+        # отрезки, пересчитанные в float64, округлялись бы иначе на границах пикселей
+        stroke = view.stroke_to_screen(stroke)
+        if stroke.tool in SHAPE_TOOLS:
+            draw_shape(draw, stroke, 0, -top)
+            continue
+        # Из штриха берутся только отрезки, задевающие полосу
+        points, color, line_width = stroke.points, stroke.color, stroke.width
+        pad = line_width / 2 + 1
+        segments = []
+        for j in range(1, len(points) - 2, 2):
+            y0, y1 = points[j], points[j + 2]
+            if min(y0, y1) - pad <= bottom and max(y0, y1) + pad >= top:
+                segments.append((points[j - 1], y0, points[j + 1], y1, color, line_width))
+        draw_segments(draw, segments, 0, -top)
+    return encode_png_band(band, level)
+
+def scaled_png_bands(path, scale, jobs, workers=1):
+    """Сжатые полосы по порядку jobs; больше 2 * workers полос разом не бывает"""
+    global _band_state
+    if workers <= 1:
+        init_band_worker(path, scale)
+        try:
+            for job in jobs:
+                yield render_png_band(*job)
+        finally:
+            _band_state[0].close()
+            _band_state = None
+        return
+    
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+    
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_band_worker,
+                             initargs=(path, scale)) as pool:
+        pending = deque()
+        for job in jobs:
+            pending.append(pool.submit(render_png_band, *job))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def write_scaled_png(path, output, size, scale=2.0, workers=1, band_height=256, level=6):
+    """Рендерит сеанс path в PNG размером size, увеличенным в scale раз
+    
+    Картинка рисуется полосами по band_height строк во всю ширину (строки
+    PNG сжимаются одним потоком, поэтому плитка во всю ширину - самая
+    мелкая, которую можно склеить без перекодирования, как в PNGTileCache).
+    Полосы рисуют и сжимают процессы пула, а этот процесс дописывает их
+    в файл отдельными блоками IDAT по мере готовности - в памяти
+    одновременно лишь несколько полос, каким бы большим ни был результат.
+    Возвращает размер картинки.
+    
+    Полосы рисуются из файла сеанса (SESSION_EXTENSION); журнал сначала
+    переписывается во временный файл сеанса - для этого он один раз
+    целиком читается в этом процессе.
+    """
+    if not path.lower().endswith(SESSION_EXTENSION):
+        import shutil
+        import tempfile
+        
+        workdir = tempfile.mkdtemp(prefix='rabpaint_bands_')
+        try:
+            session = os.path.join(workdir, 'bands' + SESSION_EXTENSION)
+            write_band_session(load_session(path), session)
+            return write_scaled_png(session, output, size, scale, workers, band_height, level)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    
+    width, height = max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+    jobs = [(top, width, min(band_height, height - top), level) for top in range(0, height, band_height)]
+    adler = 1
+    with open(output, 'wb') as f:
+        f.write(png_header((width, height)))
+        f.write(png_chunk(b'IDAT', b'\x78\x9c'))
+        for data, band_adler, length in scaled_png_bands(path, scale, jobs, workers):
+            f.write(png_chunk(b'IDAT', data))
+            adler = adler32_combine(adler, band_adler, length)
+        f.write(png_chunk(b'IDAT', _deflate_end + struct.pack('>I', adler)))
+        f.write(png_chunk(b'IEND', b''))
+    return width, height
+
+def write_band_session(strokes, filename, view=None):
+    """Записывает штрихи одним слоем в файл сеанса для write_scaled_png
+    
+    Порядок наложения - порядок strokes; view - пересчитать точки в
+    координаты экрана этой области просмотра. Сами штрихи не меняются.
+    """
+    view = view or Viewport()
+    snapshot = {}
+    for i, stroke in enumerate(strokes, 1):
+        stroke = view.stroke_to_screen(stroke)
+        snapshot[i] = Stroke(stroke.points, stroke.color, stroke.width, stroke.tool, z=i,
+                             mask=stroke.mask)
+    return write_session_file(filename, snapshot, [Layer(0, '')])
+
+def export_scaled_png(strokes, size, output, scale=2.0, view=None, workers=None):
+    """Рендерит штрихи в увеличенный PNG отдельным процессом движка
+    
+    Для окна рисования: пул процессов, запущенный прямо из окна, на
+    Windows (и везде, где процессы не форкаются) заново импортировал
+    бы скрипт окна в каждом процессе пула. Поэтому штрихи, видимые
+    в области просмотра view размером size, пишутся во временный сеанс
+    в координатах экрана, а рендерит его `rabpaint_engine.py --scale`
+    с пулом на workers процессов (по умолчанию - по числу ядер).
+    """
+    import shutil
+    import subprocess
+    import tempfile
+    
+    view = view or Viewport()
+    workdir = tempfile.mkdtemp(prefix='rabpaint_scaled_')
+    try:
+        session = os.path.join(workdir, 'scaled' + SESSION_EXTENSION)
+        visible = [stroke for stroke in strokes if view.visible(stroke.bbox(stroke.width / 2 + 1), size)]
+        write_band_session(visible, session, view)
+        result = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), session, '-o', workdir,
+             '--size', f'{size[0]}x{size[1]}', '--scale', str(scale), '-j', str(workers or os.cpu_count() or 1)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+            creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0)
+        )
+        if result.returncode:
+            raise RuntimeError(result.stderr.strip() or f"код выхода {result.returncode}")
+        shutil.move(os.path.join(workdir, 'scaled.png'), output)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return output
+
+# ========== МОДУЛЬ БУФЕРА ОБМЕНА ==========
+
+class Win32Clipboard:
+    """Буфер обмена Windows: PNG (для браузеров и Office) и CF_DIB для остальных
+    
+    DIB получается из того же PNG и переиспользуется, пока PNG не сменится.
+    """
+    
+    name = 'win32'
+    
+    def __init__(self):
+        self.png = None
+        self.dib = None
+    
+    def available(self):
+        if sys.platform != 'win32':
+            return False
+        import importlib.util
+        
+        return importlib.util.find_spec('win32clipboard') is not None
+    
+    def copy_png(self, png):
+        import win32clipboard
+        
+        if png is not self.png:
+            from PIL import Image
+            
+            output = io.BytesIO()
+            Image.open(io.BytesIO(png)).convert('RGB').save(output, 'BMP')
+            # Без 14-байтового заголовка файла BMP остается DIB
+            self.dib = output.getvalue()[14:]
+            self.png = png
+        
+        png_format = win32clipboard.RegisterClipboardFormat('PNG')
+        win32clipboard.OpenClipboard()
+        try:
+            win32clipboard.EmptyClipboard()
+            win32clipboard.SetClipboardData(png_format, png)
+            win32clipboard.SetClipboardData(win32clipboard.CF_DIB, self.dib)
+        finally:
+            win32clipboard.CloseClipboard()
+
+class CommandClipboard:
+    """Буфер обмена через внешнюю программу (xclip в X11, wl-copy в Wayland)
+    
+    Программа читает PNG из stdin и сама остается в фоне, отдавая
+    выделение другим приложениям, поэтому окно может закрыться.
+    """
+    
+    def __init__(self, name, command, display_variable, timeout=5.0):
+        self.name = name
+        self.command = command
+        self.display_variable = display_variable
+        self.timeout = timeout
+    
+    def available(self):
+        import shutil
+        
+        return bool(os.environ.get(self.display_variable)) and shutil.which(self.command[0]) is not None
+    
+    def copy_png(self, png):
+        import subprocess
+        import tempfile
+        
+        # Ошибки - во временный файл, а не в канал: фоновый процесс, который
+        # держит выделение, унаследовал бы канал, и communicate ждал бы, пока
+        # выделение не заберут. Ждем только выхода самой программы.
+        with tempfile.TemporaryFile() as errors:
+            process = subprocess.Popen(
+                self.command, stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL, stderr=errors
+            )
+            try:
+                process.communicate(png, timeout=self.timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+                raise RuntimeError(f"{self.command[0]} не ответил за {self.timeout:g} с")
+            if process.returncode:
+                errors.seek(0)
+                message = errors.read().decode(errors='replace').strip()
+                raise RuntimeError(f"{self.command[0]}: {message}")
+
+def clipboard_backends():
+    """Все известные способы копирования картинки, в порядке предпочтения"""
+    return [
+        Win32Clipboard(),
+        CommandClipboard('wl-copy', ['wl-copy', '--type', 'image/png'], 'WAYLAND_DISPLAY'),
+        CommandClipboard('xclip', ['xclip', '-selection', 'clipboard', '-t', 'image/png', '-i'], 'DISPLAY'),
+    ]
+
+def find_clipboard_backend(backends=None):
+    """Первый доступный на этой системе способ или None"""
+    for backend in clipboard_backends() if backends is None else backends:
+        if backend.available():
+            return backend
+    return None
+
+def copy_png_to_clipboard(backend, png_cache, job):
+    """Кодирует PNG через кэш полос (или берет готовый) и кладет его в буфер обмена"""
+    backend.copy_png(png_cache.encode(job))
+
+# ========== МОДУЛЬ ТАЙМЛАПСА ==========
+
+class ImageSequenceWriter:
+    """Таймлапс как последовательность PNG: файл на каждый кадр
+    
+    pattern - путь с номером кадра в стиле printf ("frames/frame_%05d.png"),
+    так его понимает ffmpeg -i. Кадры кодируются через PNGTileCache, то
+    есть пережимаются только полосы, изменившиеся с прошлого кадра.
+    """
+    
+    def __init__(self, pattern, size, fps):
+        self.pattern = pattern
+        self.size = size
+        self.fps = fps
+        self.cache = PNGTileCache()
+        self.count = 0
+        folder = os.path.dirname(pattern)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+    
+    def frame(self, image, box):
+        self.cache.mark_dirty(box)
+        job = self.cache.prepare(image, self.size)
+        with open(self.pattern % self.count, 'wb') as f:
+            f.write(self.cache.encode(job))
+        self.count += 1
+    
+    def close(self):
+        pass
+
+class AnimationWriter:
+    """Основа потоковых GIF и APNG
+    
+    Кадр пишется прямоугольником изменений поверх предыдущего. Последний
+    кадр держится в памяти до следующего изменения: кадры без изменений
+    только удлиняют его показ, поэтому паузы не раздувают файл.
+    """
+    
+    def __init__(self, path, size, fps):
+        self.size = size
+        self.fps = fps
+        self.file = open(path, 'wb')
+        self.count = 0
+        # [картинка прямоугольника, прямоугольник, число кадров показа]
+        self.pending = None
+        self.begin()
+    
+    def frame(self, image, box):
+        width, height = self.size
+        if box is not None:
+            box = (max(0, math.floor(box[0])), max(0, math.floor(box[1])),
+                   min(width, math.ceil(box[2])), min(height, math.ceil(box[3])))
+            if box[0] >= box[2] or box[1] >= box[3]:
+                box = None
+        if self.pending is None:
+            # Первый кадр всегда во весь размер
+            box = (0, 0, width, height)
+        elif box is None:
+            self.pending[2] += 1
+            return
+        else:
+            self._flush()
+        self.pending = [image.crop(box), box, 1]
+    
+    def close(self):
+        if self.pending is not None:
+            self._flush()
+        self.finish()
+        self.file.close()
+    
+    def _flush(self):
+        region, box, frames = self.pending
+        self.pending = None
+        self.write_frame(region if region.mode == 'RGB' else region.convert('RGB'), box, frames)
+        self.count += 1
+
+class APNGWriter(AnimationWriter):
+    """Анимированный PNG, который пишется по кадру
+    
+    Число кадров (acTL) заранее неизвестно - оно дописывается на место
+    в конце. Кадры сжимает PIL; из его PNG берутся только данные IDAT.
+    """
+    
+    def __init__(self, path, size, fps, level=6):
+        self.level = level
+        self.sequence = 0
+        super().__init__(path, size, fps)
+    
+    def begin(self):
+        width, height = self.size
+        self.file.write(b'\x89PNG\r\n\x1a\n')
+        self.file.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        self.actl_offset = self.file.tell()
+        self.file.write(png_chunk(b'acTL', struct.pack('>II', 0, 0)))
+    
+    def write_frame(self, region, box, frames):
+        x0, y0, x1, y1 = box
+        delay = min(65535, round(frames * 1000 / self.fps))
+        self.file.write(png_chunk(b'fcTL', struct.pack(
+            '>IIIIIHHBB', self.sequence, x1 - x0, y1 - y0, x0, y0, delay, 1000, 0, 0
+        )))
+        self.sequence += 1
+        data = self._idat(region)
+        if self.count == 0:
+            self.file.write(png_chunk(b'IDAT', data))
+        else:
+            self.file.write(png_chunk(b'fdAT', struct.pack('>I', self.sequence) + data))
+            self.sequence += 1
+    
+    def _idat(self, region):
+        buffer = io.BytesIO()
+        region.save(buffer, 'PNG', compress_level=self.level)
+        data = buffer.getvalue()
+        chunks = []
+        pos = 8
+        while pos < len(data):
+            length, kind = struct.unpack_from('>I4s', data, pos)
+            if kind == b'IDAT':
+                chunks.append(data[pos + 8:pos + 8 + length])
+            pos += 12 + length
+        return b''.join(chunks)
+    
+    def finish(self):
+        self.file.write(png_chunk(b'IEND', b''))
+        self.file.seek(self.actl_offset)
+        self.file.write(png_chunk(b'acTL', struct.pack('>II', self.count, 0)))
+
+class GIFWriter(AnimationWriter):
+    """Анимированный GIF, который пишется по кадру
+    
+    Каждый прямоугольник изменений кодирует PIL как отдельный GIF со своей
+    палитрой; его блок картинки переносится в общий файл с локальной
+    палитрой и смещением. Задержка в GIF - в сотых долях секунды.
+    """
+    
+    def begin(self):
+        width, height = self.size
+        self.file.write(b'GIF89a' + struct.pack('<HHBBB', width, height, 0, 0, 0))
+        # Бесконечный повтор
+        self.file.write(b'\x21\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00')
+    
+    def write_frame(self, region, box, frames):
+        delay = min(65535, max(1, round(frames * 100 / self.fps)))
+        # Графическое расширение: кадр остается под следующим (disposal 1)
+        self.file.write(b'\x21\xf9\x04\x04' + struct.pack('<H', delay) + b'\x00\x00')
+        self.file.write(self._image_block(region, box))
+    
+    def _image_block(self, region, box):
+        from PIL import Image
+        
+        buffer = io.BytesIO()
+        region.convert('P', palette=Image.Palette.ADAPTIVE, colors=256).save(buffer, 'GIF')
+        data = buffer.getvalue()
+        flags = data[10]
+        pos = 13
+        table = b''
+        if flags & 0x80:
+            table_size = 3 << ((flags & 7) + 1)
+            table = data[pos:pos + table_size]
+            pos += table_size
+        # Пропускаем расширения до описания картинки
+        while data[pos] == 0x21:
+            pos += 2
+            while data[pos]:
+                pos += data[pos] + 1
+            pos += 1
+        left, top, width, height, packed = struct.unpack_from('<HHHHB', data, pos + 1)
+        if table:
+            # Общая палитра одиночного GIF становится локальной палитрой кадра
+            packed = (packed & 0x78) | 0x80 | (flags & 7)
+        descriptor = b'\x2c' + struct.pack('<HHHHB', box[0], box[1], width, height, packed)
+        return descriptor + table + data[pos + 10:-1]
+    
+    def finish(self):
+        self.file.write(b'\x3b')
+
+def timelapse_writer(output, size, fps):
+    """Писатель по имени файла: "%" в имени - картинки, .gif - GIF, иначе APNG"""
+    if '%' in output:
+        return ImageSequenceWriter(output, size, fps)
+    if output.lower().endswith('.gif'):
+        return GIFWriter(output, size, fps)
+    return APNGWriter(output, size, fps)
+
+class TimelapseRenderer:
+    """Проигрывает записи журнала сеанса и отдает кадры писателю
+    
+    Каждый кадр - предыдущий плюс отрезки, появившиеся за его время;
+    писатель получает картинку и прямоугольник изменений. В памяти одна
+    картинка размера кадра и векторы штрихов (для стирания), так что
+    память кадров от длины сеанса не зависит. Кадр - speedup / fps секунд
+    сеанса; паузы длиннее max_idle секунд сокращаются до max_idle.
+    Штрихи из журналов без времени рисуются по default_duration секунд,
+    куски после стирания и возвращенные отменой штрихи - сразу. Слои
+    сводятся в порядке рисования.
+    """
+    
+    def __init__(self, size, writer, fps=10, speedup=8.0, max_idle=1.0, hold=2.0,
+                 default_duration=0.5, background='white'):
+        from PIL import Image, ImageDraw
+        
+        self.size = size
+        self.writer = writer
+        self.fps = fps
+        self.step = speedup / fps
+        self.max_idle = max_idle
+        self.hold = hold
+        self.default_duration = default_duration
+        self.background = background
+        self.image = Image.new('RGB', size, background)
+        self.draw = ImageDraw.Draw(self.image)
+        self.document = Document()
+        self.frame_time = 0.0
+        self.changed = (0, 0) + size
+        # Штрих, который сейчас рисуется: (штрих, начало, конец, сколько точек нарисовано)
+        self.active = None
+        self.frame_count = 0
+    
+    def timeline(self, records):
+        """Записи журнала со временем в ролике: (начало, конец, kind, sid, stroke)"""
+        clock = 0.0
+        last = None
+        seen = set()
+        for kind, sid, stroke in records:
+            if kind != JOURNAL_ADD or sid in seen:
+                yield clock, clock, kind, sid, stroke
+                continue
+            seen.add(sid)
+            
+            if stroke.started:
+                if last is not None:
+                    clock += min(self.max_idle, max(0.0, stroke.started - last))
+                last = max(last or 0.0, stroke.started + stroke.duration)
+                duration = stroke.duration
+            else:
+                duration = self.default_duration
+            yield clock, clock + duration, kind, sid, stroke
+            clock += duration
+    
+    def play(self, records):
+        """Рисует весь сеанс и закрывает писателя; возвращает число кадров"""
+        try:
+            for start, end, kind, sid, stroke in self.timeline(records):
+                self.advance(start)
+                self._finish_active()
+                if kind == JOURNAL_ADD:
+                    self._add(sid, stroke, start, end)
+                elif kind == JOURNAL_REMOVE:
+                    self._remove(sid)
+                else:
+                    self._clear()
+            if self.active is not None:
+                self.advance(self.active[2])
+            self._finish_active()
+            self._emit()
+            for _ in range(round(self.hold * self.fps)):
+                self._emit()
+        finally:
+            self.writer.close()
+        return self.frame_count
+    
+    def advance(self, t):
+        """Выпускает кадры до момента t ролика"""
+        while self.frame_time < t:
+            self._draw_active(self.frame_time)
+            self._emit()
+            self.frame_time += self.step
+    
+    def _emit(self):
+        self.writer.frame(self.image, self.changed)
+        self.changed = None
+        self.frame_count += 1
+    
+    def _add(self, sid, stroke, start, end):
+        if sid in self.document.strokes:
+            self._remove(sid)
+        self.document.add(stroke, sid)
+        if end > start and stroke.segment_count() and stroke.tool not in SHAPE_TOOLS:
+            self.active = (stroke, start, end, 1)
+        else:
+            draw_stroke(self.draw, stroke)
+            self.changed = union_bbox(self.changed, stroke.bbox(stroke.width / 2 + 1))
+    
+    def _draw_active(self, t, fraction=None):
+        if self.active is None:
+            return
+        stroke, start, end, drawn = self.active
+        if fraction is None:
+            fraction = min(1.0, max(0.0, (t - start) / (end - start)))
+        visible = 1 + int(fraction * (stroke.point_count() - 1))
+        for i in range(drawn - 1, visible - 1):
+            x0, y0, x1, y1 = stroke.segment(i)
+            draw_round_segment(self.draw, x0, y0, x1, y1, stroke.color, stroke.width)
+            pad = stroke.width / 2 + 1
+            self.changed = union_bbox(
+                self.changed, (min(x0, x1) - pad, min(y0, y1) - pad, max(x0, x1) + pad, max(y0, y1) + pad)
+            )
+        self.active = (stroke, start, end, max(drawn, visible))
+    
+    def _finish_active(self):
+        if self.active is not None:
+            self._draw_active(None, fraction=1.0)
+            self.active = None
+    
+    def _remove(self, sid):
+        stroke = self.document.strokes.get(sid)
+        if stroke is None:
+            return
+        self.document.remove(sid)
+        self._redraw(stroke.bbox(stroke.width / 2 + 1))
+    
+    def _redraw(self, bbox):
+        from PIL import Image, ImageDraw
+        
+        width, height = self.size
+        left, top = max(0, int(bbox[0])), max(0, int(bbox[1]))
+        right, bottom = min(width, int(bbox[2]) + 1), min(height, int(bbox[3]) + 1)
+        if left >= right or top >= bottom:
+            return
+        region = Image.new('RGB', (right - left, bottom - top), self.background)
+        draw_segments(ImageDraw.Draw(region), self.document.segments_in(bbox), -left, -top)
+        self.image.paste(region, (left, top))
+        self.changed = union_bbox(self.changed, (left, top, right, bottom))
+    
+    def _clear(self):
+        self.document.clear()
+        self.draw.rectangle((0, 0) + self.size, fill=self.background)
+        self.changed = (0, 0) + self.size
+
+def export_timelapse(path, output, size=None, fps=10, speedup=8.0, view=None, max_idle=1.0, hold=2.0):
+    """Пишет таймлапс сеанса из журнала path в output (GIF, APNG или картинки)
+    
+    size - размер кадра (по умолчанию - по габаритам штрихов), view -
+    область просмотра, которую показывает кадр (по умолчанию - мир от
+    начала координат в масштабе 1). Возвращает число кадров. В файле
+    сеанса стертого уже нет - его таймлапс только добавляет оставшиеся
+    штрихи в порядке рисования.
+    """
+    if path.lower().endswith(SESSION_EXTENSION):
+        strokes = sorted(load_session(path), key=lambda stroke: stroke.started)
+        records = [(JOURNAL_ADD, sid, stroke) for sid, stroke in enumerate(strokes, 1)]
+        size = size or strokes_size(strokes)
+    else:
+        with open(path, 'rb') as f:
+            data = f.read()
+        if size is None:
+            size = strokes_size(stroke for kind, sid, stroke in read_journal_records(data) if kind == JOURNAL_ADD)
+        records = read_journal_records(data)
+    if view is not None:
+        records = ((kind, sid, view.stroke_to_screen(stroke) if kind == JOURNAL_ADD else stroke)
+                   for kind, sid, stroke in records)
+    writer = timelapse_writer(output, size, fps)
+    renderer = TimelapseRenderer(size, writer, fps, speedup, max_idle, hold)
+    return renderer.play(records)
+
+# ========== МОДУЛЬ ФАЙЛА СЕАНСА ==========
+
+# Формат файла сеанса (SESSION_EXTENSION) - рисунок, который можно открыть
+# и рисовать дальше. Заголовок: сигнатура SESSION_MAGIC, версия, число
+# слоев, цветов и штрихов, следующий свободный id штриха, область
+# просмотра (x, y, масштаб; float64) и смещения таблиц от начала файла:
+#   слои снизу вверх - id (4 байта), видимость (1 байт), имя (длина в 1 байт + UTF-8);
+#   цвета - строки (длина в 1 байт + UTF-8), штрих ссылается на цвет номером;
+#   записи штрихов одной длины в порядке наложения: id, z, слой, номер
+#     цвета, инструмент (номер в SESSION_TOOLS), толщина, габариты точек
+#     (4 x float32), время начала (float64), длительность (float32), номер
+#     первой точки и число точек, смещение, ширина, высота и длина маски
+#     заливки (длина 0 - маски нет);
+#   точки всех штрихов подряд, float32, с границы 8 байт;
+#   маски заливок, сжатые zlib.
+# Все числа - little-endian.
+SESSION_MAGIC = b'RPS1'
+SESSION_VERSION = 1
+SESSION_EXTENSION = '.rps'
+SESSION_TOOLS = ('pen',) + SHAPE_TOOLS
+
+_session_header = struct.Struct('<4sHHIII3d4Q')
+_session_layer = struct.Struct('<iB')
+_session_record = struct.Struct('<IiiIB3xf4fdfQIQIII')
+
+def write_session_file(filename, strokes, layers, view=None):
+    """Записывает штрихи {id: Stroke} и слои (снизу вверх) в файл сеанса
+    
+    Файл пишется под временным именем и заменяет старый переименованием:
+    старый может быть открыт через mmap, пока его штрихи еще читаются.
+    """
+    positions = {layer.lid: i for i, layer in enumerate(layers)}
+    order = sorted(strokes.items(),
+                   key=lambda kv: (positions.get(kv[1].layer, len(layers)), kv[1].z, kv[0]))
+    
+    colors = {}
+    records = []
+    masks = []
+    point_index = mask_offset = 0
+    for sid, stroke in order:
+        color = colors.setdefault(stroke.color, len(colors))
+        points = stroke.points
+        bbox = stroke.bbox() if len(points) else (0.0, 0.0, 0.0, 0.0)
+        mask_width = mask_height = mask_length = 0
+        if stroke.mask is not None:
+            mask_width, mask_height, bits = stroke.mask
+            bits = zlib.compress(bits, 1)
+            mask_length = len(bits)
+            masks.append(bits)
+        records.append(_session_record.pack(
+            sid, stroke.z, stroke.layer, color, SESSION_TOOLS.index(stroke.tool), stroke.width,
+            *bbox, stroke.started, stroke.duration, point_index, len(points) // 2,
+            mask_offset, mask_width, mask_height, mask_length
+        ))
+        point_index += len(points) // 2
+        mask_offset += mask_length
+    
+    tables = []
+    for layer in layers:
+        name = layer.name.encode('utf-8')[:255].decode('utf-8', 'ignore').encode('utf-8')
+        tables.append(_session_layer.pack(layer.lid, layer.visible) + bytes((len(name),)) + name)
+    layers_offset = _session_header.size
+    colors_offset = layers_offset + sum(map(len, tables))
+    for color in colors:
+        color = color.encode('utf-8')
+        tables.append(bytes((len(color),)) + color)
+    records_offset = _session_header.size + sum(map(len, tables))
+    points_offset = -(-(records_offset + len(records) * _session_record.size) // 8) * 8
+    
+    view = view or Viewport()
+    next_id = max(strokes, default=0) + 1
+    header = _session_header.pack(SESSION_MAGIC, SESSION_VERSION, len(layers), len(colors),
+                                  len(records), next_id, view.x, view.y, view.zoom,
+                                  layers_offset, colors_offset, records_offset, points_offset)
+    
+    temp = filename + '.tmp'
+    with open(temp, 'wb') as f:
+        f.write(header)
+        f.writelines(tables)
+        f.writelines(records)
+        f.write(bytes(points_offset - f.tell()))
+        for sid, stroke in order:
+            points = stroke.points
+            if sys.byteorder != 'little':
+                points = array('f', points)
+                points.byteswap()
+            f.write(points.tobytes())
+        f.writelines(masks)
+    os.replace(temp, filename)
+    return filename
+
+class SessionFile:
+    """Файл сеанса, открытый через mmap; штрихи достаются по одному
+    
+    open читает только заголовок, слои и цвета. Габариты штрихов берутся
+    из записей при первом query, а точки копируются из
+    mmap, только когда штрих запрошен (stroke). Так из большого сеанса
+    сразу достается то, что видно на экране, а остальное - потом.
+    
+    Первый query проходит по габаритам всех штрихов. Со второго работает
+    индекс по вертикали: номера штрихов по верхнему краю и нижний край
+    каждого блока из index_block штрихов. Сортировка дороже нескольких
+    проходов, поэтому окно, которое при открытии спрашивает один раз, ее
+    не ждет, а экспорт полосами, который спрашивает на каждую полосу, -
+    строит один раз.
+    """
+    
+    index_block = 64
+    
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.map = None
+        self.layers = []
+        self.colors = []
+        self.view = Viewport()
+        self.count = 0
+        self.next_id = 1
+        self.records_offset = self.points_offset = self.masks_offset = 0
+        # Габариты штрихов (x0, y0, x1, y1 - по массиву) и запас на толщину;
+        # читаются при первом query
+        self.boxes = None
+        self.pad = 0.0
+        # Индекс по вертикали: номера штрихов по верхнему краю, верхние края
+        # в том же порядке и нижний край каждого блока
+        self.order = self.tops = self.bottoms = None
+    
+    def open(self):
+        import mmap
+        
+        self.file = open(self.path, 'rb')
+        try:
+            if os.fstat(self.file.fileno()).st_size < _session_header.size:
+                raise ValueError("не файл сеанса")
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._read_tables()
+        except Exception:
+            self.close()
+            raise
+        return self
+    
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+    
+    def _read_tables(self):
+        data = self.map
+        (magic, version, layer_count, color_count, self.count, self.next_id, x, y, zoom,
+         layers_offset, colors_offset, self.records_offset,
+         self.points_offset) = _session_header.unpack_from(data)
+        if magic != SESSION_MAGIC:
+            raise ValueError("не файл сеанса")
+        if version > SESSION_VERSION:
+            raise ValueError(f"файл сеанса версии {version} - обновите программу")
+        self.view = Viewport(x, y, zoom)
+        
+        p = layers_offset
+        for _ in range(layer_count):
+            lid, visible = _session_layer.unpack_from(data, p)
+            p += _session_layer.size
+            self.layers.append(Layer(lid, data[p + 1:p + 1 + data[p]].decode('utf-8'), bool(visible)))
+            p += 1 + data[p]
+        p = colors_offset
+        for _ in range(color_count):
+            self.colors.append(data[p + 1:p + 1 + data[p]].decode('utf-8'))
+            p += 1 + data[p]
+        
+        end = self.records_offset + self.count * _session_record.size
+        if end > len(data):
+            raise ValueError("файл сеанса оборван")
+        if self.count:
+            last = _session_record.unpack_from(data, end - _session_record.size)
+            self.masks_offset = self.points_offset + 8 * (last[12] + last[13])
+    
+    def __len__(self):
+        return self.count
+    
+    def query(self, bbox):
+        """Номера штрихов рядом с прямоугольником мира bbox, в порядке наложения"""
+        if self.boxes is None:
+            # Запись - целое число float32, так что толщина и габариты всех штрихов
+            # достаются срезами с шагом в запись, без разбора записей по одной
+            floats = array('f')
+            floats.frombytes(self.map[self.records_offset:
+                                      self.records_offset + self.count * _session_record.size])
+            if sys.byteorder != 'little':
+                floats.byteswap()
+            step = _session_record.size // 4
+            self.boxes = tuple(floats[i::step] for i in range(6, 10))
+            self.pad = max(floats[5::step], default=0) / 2 + 1
+        elif self.order is None:
+            self._build_index()
+        # Запас - на самую толстую линию: лишний штрих у края экрана безвреден
+        left, top = bbox[0] - self.pad, bbox[1] - self.pad
+        right, bottom = bbox[2] + self.pad, bbox[3] + self.pad
+        
+        if self.order is not None:
+            size = self.index_block
+            end = bisect_right(self.tops, bottom)
+            # Блоки штрихов, начинающихся выше низа рамки и кончающихся ниже ее верха
+            blocks = list(compress(range(0, end, size), map(top.__le__, self.bottoms)))
+            # Рамка во весь рисунок: проход по всем дешевле обхода блоков
+            if len(blocks) * size <= self.count // 2:
+                x0s, y0s, x1s, y1s = self.boxes
+                order = self.order
+                found = [i for k in blocks for i in order[k:min(end, k + size)]
+                         if x0s[i] <= right and x1s[i] >= left and y1s[i] >= top]
+                found.sort()
+                return found
+        return [i for i, (x0, y0, x1, y1) in enumerate(zip(*self.boxes))
+                if x0 <= right and x1 >= left and y0 <= bottom and y1 >= top]
+    
+    def _build_index(self):
+        x0s, y0s, x1s, y1s = self.boxes
+        size = self.index_block
+        self.order = array('I', sorted(range(self.count), key=y0s.__getitem__))
+        self.tops = array('f', map(y0s.__getitem__, self.order))
+        self.bottoms = array('f', [max(map(y1s.__getitem__, self.order[k:k + size]))
+                                   for k in range(0, self.count, size)])
+    
+    def stroke(self, i):
+        """Достает i-й штрих: (id, Stroke)"""
+        (sid, z, layer, color, tool, width, x0, y0, x1, y1, started, duration, first, count,
+         mask_offset, mask_width, mask_height, mask_length) = _session_record.unpack_from(
+            self.map, self.records_offset + i * _session_record.size)
+        start = self.points_offset + 8 * first
+        points = array('f')
+        points.frombytes(self.map[start:start + 8 * count])
+        if sys.byteorder != 'little':
+            points.byteswap()
+        mask = None
+        if mask_length:
+            start = self.masks_offset + mask_offset
+            mask = (mask_width, mask_height, zlib.decompress(self.map[start:start + mask_length]))
+        return sid, Stroke(points, self.colors[color], width, SESSION_TOOLS[tool], z=z, layer=layer,
+                           started=started, duration=duration, mask=mask)
+    
+    def strokes(self, indices=None):
+        """Штрихи (id, Stroke) с номерами indices или все, в порядке наложения"""
+        for i in range(self.count) if indices is None else indices:
+            yield self.stroke(i)
+
+# ========== МОДУЛЬ МИНИАТЮР ==========
+
+# Файлы, которые показывает галерея; миниатюры бывают у картинок и сеансов
+GALLERY_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.pdf', '.svg', '.journal',
+                      SESSION_EXTENSION)
+THUMBNAIL_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.journal', SESSION_EXTENSION)
+
+def scan_drawings(folder):
+    """Файлы рисунков в папке [(путь, mtime в нс, размер)], новые первыми"""
+    files = []
+    try:
+        entries = os.scandir(folder)
+    except OSError:
+        return files
+    with entries:
+        for entry in entries:
+            if os.path.splitext(entry.name)[1].lower() not in GALLERY_EXTENSIONS:
+                continue
+            try:
+                if entry.is_file():
+                    stat = entry.stat()
+                    files.append((entry.path, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                continue
+    files.sort(key=lambda f: (-f[1], f[0]))
+    return files
+
+def make_thumbnail(path, size):
+    """Уменьшенная копия картинки или сеанса (RGB, не больше size); None - не умеем"""
+    from PIL import Image
+    
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.journal', SESSION_EXTENSION):
+        strokes = load_session(path)
+        width, height = strokes_size(strokes)
+        view = Viewport(0.0, 0.0, min(size[0] / width, size[1] / height))
+        return render_strokes([view.stroke_to_screen(stroke) for stroke in strokes],
+                              (max(1, round(width * view.zoom)), max(1, round(height * view.zoom))))
+    if extension not in THUMBNAIL_EXTENSIONS:
+        return None
+    
+    with Image.open(path) as image:
+        # JPEG декодируется сразу уменьшенным, остальные - уменьшаются через reduce
+        image.draft('RGB', size)
+        image = image.convert('RGB') if image.mode != 'RGB' else image
+        image.thumbnail(size)
+        image.load()
+        return image
+
+class ThumbnailCache:
+    """Миниатюры картинок в одном файле, отображенном в память (mmap)
+    
+    Файл - заголовок и slots одинаковых ячеек. В ячейке ключ (хэш пути,
+    mtime в наносекундах, размер файла), номер последнего обращения для
+    вытеснения самой давно не нужной миниатюры (LRU), размер миниатюры и
+    ее пиксели RGB. Измененный файл не совпадет по mtime или размеру,
+    так что его старая миниатюра просто не найдется. Таблицу ключей
+    open строит по заголовкам ячеек, пиксели читаются прямо из mmap.
+    
+    Методы вызываются и из главного потока, и из потока ThumbnailLoader.
+    """
+    
+    MAGIC = b'RPT1'
+    # Сигнатура, число ячеек, наибольшие ширина и высота миниатюры
+    _header = struct.Struct('<4sIHH')
+    # Хэш пути, mtime, размер файла, номер обращения, ширина и высота
+    _slot = struct.Struct('<QqqQHH')
+    header_size = 64
+    
+    def __init__(self, path, slots=1024, size=(128, 96)):
+        self.path = path
+        self.slots = slots
+        self.size = size
+        self.slot_size = self.header_size + size[0] * size[1] * 3
+        self.lock = threading.Lock()
+        # (хэш пути, mtime, размер) -> ячейка, и наоборот
+        self.index = {}
+        self.keys = [None] * slots
+        self.used = [0] * slots
+        self.clock = 0
+        self.file = None
+        self.map = None
+    
+    def open(self):
+        """Открывает файл кэша; файл другой раскладки создается заново"""
+        import mmap
+        
+        length = self.header_size + self.slots * self.slot_size
+        header = self._header.pack(self.MAGIC, self.slots, *self.size)
+        fresh = not os.path.exists(self.path) or os.path.getsize(self.path) != length
+        self.file = open(self.path, 'w+b' if fresh else 'r+b')
+        if fresh:
+            # Файл растет до полного размера без записи - место занимают только заполненные ячейки
+            self.file.truncate(length)
+        self.map = mmap.mmap(self.file.fileno(), length)
+        if self.map[:self._header.size] != header:
+            self.map[:self._header.size] = header
+            for slot in range(self.slots):
+                self._slot.pack_into(self.map, self._offset(slot), 0, 0, 0, 0, 0, 0)
+            return self
+        
+        for slot in range(self.slots):
+            path_hash, mtime, size, used, width, height = self._slot.unpack_from(self.map, self._offset(slot))
+            if path_hash:
+                key = (path_hash, mtime, size)
+                self.index[key] = slot
+                self.keys[slot] = key
+                self.used[slot] = used
+        self.clock = max(self.used)
+        return self
+    
+    def close(self):
+        if self.map is not None:
+            with self.lock:
+                self.map.flush()
+                self.map.close()
+                self.file.close()
+                self.map = self.file = None
+    
+    def _offset(self, slot):
+        return self.header_size + slot * self.slot_size
+    
+    @staticmethod
+    def path_hash(path):
+        import hashlib
+        
+        path = os.path.normcase(os.path.abspath(path)).encode('utf-8', 'surrogatepass')
+        return int.from_bytes(hashlib.blake2b(path, digest_size=8).digest(), 'little') or 1
+    
+    def get(self, path, mtime, size):
+        """Миниатюра файла (ширина, высота, пиксели RGB) или None"""
+        key = (self.path_hash(path), mtime, size)
+        with self.lock:
+            slot = self.index.get(key)
+            if slot is None or self.map is None:
+                return None
+            offset = self._offset(slot)
+            width, height = self._slot.unpack_from(self.map, offset)[4:]
+            self.clock += 1
+            self.used[slot] = self.clock
+            self._slot.pack_into(self.map, offset, *key, self.clock, width, height)
+            start = offset + self.header_size
+            return width, height, self.map[start:start + width * height * 3]
+    
+    def put(self, path, mtime, size, image):
+        """Кладет миниатюру (картинка RGB не больше self.size), вытесняя самую старую"""
+        path_hash = self.path_hash(path)
+        key = (path_hash, mtime, size)
+        width, height = image.size
+        pixels = image.tobytes()
+        with self.lock:
+            if self.map is None:
+                return
+            slot = self.index.get(key)
+            if slot is None:
+                # Старая миниатюра того же файла, иначе пустая ячейка, иначе самая давняя
+                slot = next((i for i, k in enumerate(self.keys) if k is not None and k[0] == path_hash), None)
+                if slot is None:
+                    slot = min(range(self.slots), key=lambda i: (self.keys[i] is not None, self.used[i]))
+            if self.keys[slot] is not None:
+                del self.index[self.keys[slot]]
+            offset = self._offset(slot)
+            # Сначала ячейка помечается пустой: прерванная запись не оставит чужих пикселей под ключом
+            self._slot.pack_into(self.map, offset, 0, 0, 0, 0, 0, 0)
+            self.map[offset + self.header_size:offset + self.header_size + len(pixels)] = pixels
+            self.clock += 1
+            self._slot.pack_into(self.map, offset, *key, self.clock, width, height)
+            self.index[key] = slot
+            self.keys[slot] = key
+            self.used[slot] = self.clock
+
+class ThumbnailLoader:
+    """Фоновый поток, который делает недостающие миниатюры
+    
+    Главный поток ставит файлы в очередь (request), сообщает, какие из
+    них еще нужны (want - видимые в галерее), и раз в кадр забирает
+    готовые (take): [(путь, (ширина, высота, пиксели) или None)].
+    Файлы, прокрученные за край экрана до своей очереди, пропускаются.
+    """
+    
+    _stop = object()
+    
+    def __init__(self, cache):
+        self.cache = cache
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.wanted = set()
+        self.thread = None
+    
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='thumbnails', daemon=True)
+        self.thread.start()
+    
+    def want(self, paths):
+        self.wanted = set(paths)
+    
+    def request(self, path, mtime, size):
+        self.requests.put((path, mtime, size))
+    
+    def take(self):
+        results = []
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except queue.Empty:
+                return results
+    
+    def close(self):
+        if self.thread is not None:
+            self.requests.put(self._stop)
+            self.thread.join()
+            self.thread = None
+    
+    def _run(self):
+        while True:
+            job = self.requests.get()
+            if job is self._stop:
+                return
+            path, mtime, size = job
+            if path not in self.wanted:
+                continue
+            # Файл могли запросить дважды, пока первая миниатюра готовилась
+            cached = self.cache.get(path, mtime, size)
+            if cached is not None:
+                self.results.put((path, cached))
+                continue
+            try:
+                image = make_thumbnail(path, self.cache.size)
+            except Exception:
+                # Битый или недописанный файл - показываем без миниатюры
+                image = None
+            if image is not None:
+                self.cache.put(path, mtime, size, image)
+                image = (image.size[0], image.size[1], image.tobytes())
+            self.results.put((path, image))
+
+# ========== ЗАПУСК ИЗ КОМАНДНОЙ СТРОКИ ==========
+
+def load_session(path):
+    """Загружает штрихи сеанса (журнал автосохранения или файл сеанса) в порядке наложения
+    
+    Порядок слоев в журнале не хранится - слои идут по возрастанию id.
+    Скрытые слои файла сеанса тоже рисуются.
+    """
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"нет файла {path}")
+    if path.lower().endswith(SESSION_EXTENSION):
+        session = SessionFile(path).open()
+        try:
+            return [stroke for sid, stroke in session.strokes()]
+        finally:
+            session.close()
+    strokes = load_journal(path)
+    items = sorted(strokes.items(), key=lambda kv: (kv[1].layer, kv[1].z, kv[0]))
+    return [stroke for sid, stroke in items]
+
+def write_journal_snapshot(strokes, filename, view=None):
+    """Записывает штрихи журналом автосохранения (JOURNAL_MAGIC) - одним
+    слоем, только записи JOURNAL_ADD в порядке наложения
+    
+    Такой файл читают load_journal и load_session; открываемый для
+    рисования файл сеанса (SESSION_EXTENSION) пишет write_session_file.
+    view - пересчитать точки в координаты экрана этой области просмотра.
+    Сами штрихи не меняются.
+    """
+    with open(filename, 'wb') as f:
+        f.write(JOURNAL_MAGIC)
+        for i, stroke in enumerate(strokes, 1):
+            if view is not None:
+                stroke = view.stroke_to_screen(stroke)
+            stroke = Stroke(stroke.points, stroke.color, stroke.width, stroke.tool, z=i,
+                            started=stroke.started, duration=stroke.duration, mask=stroke.mask)
+            f.write(encode_journal_add(i, stroke))
+
+def strokes_size(strokes, margin=10):
+    """Размер картинки, в которую помещаются все штрихи"""
+    width = height = 1
+    for stroke in strokes:
+        x0, y0, x1, y1 = stroke.bbox(stroke.width / 2)
+        width, height = max(width, x1), max(height, y1)
+    return int(width) + margin, int(height) + margin
+
+def render_file(path, output, fmt='png', size=None, fps=10, speedup=8.0, scale=1.0, workers=1):
+    """Рендерит один сеанс в файл output (png, pdf или svg) или таймлапс (gif, apng, frames)
+    
+    PNG с scale != 1 или workers > 1 рисуется полосами в пуле процессов
+    (write_scaled_png); size - размер до увеличения.
+    """
+    if fmt in TIMELAPSE_FORMATS:
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"нет файла {path}")
+        export_timelapse(path, output, size, fps, speedup)
+        return output
+    
+    if fmt == 'png' and (scale != 1 or workers > 1):
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"нет файла {path}")
+        # Процессы пула читают штрихи из файла сами
+        write_scaled_png(path, output, size or strokes_size(load_session(path)), scale, workers)
+        return output
+    
+    strokes = load_session(path)
+    size = size or strokes_size(strokes)
+    if fmt == 'pdf':
+        write_vector_pdf(strokes, size, output)
+    elif fmt == 'svg':
+        write_svg(strokes, size, output)
+    else:
+        write_image(render_strokes(strokes, size), output)
+    return output
+
+TIMELAPSE_FORMATS = ('gif', 'apng', 'frames')
+
+def output_name(path, fmt):
+    """Имя результата для журнала path: для frames - шаблон файлов кадров в своей папке"""
+    name = os.path.splitext(os.path.basename(path))[0]
+    if fmt == 'frames':
+        return os.path.join(name + '_frames', 'frame_%05d.png')
+    return name + '.' + fmt
+
+def parse_size(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+def main(argv=None):
+    import argparse
+    from concurrent.futures import ProcessPoolExecutor
+    
+    parser = argparse.ArgumentParser(
+        description="Рендер сохраненных сеансов рисования в PNG/PDF/SVG или таймлапс без дисплея"
+    )
+    parser.add_argument('sessions', nargs='+', help="файлы сеансов (*.journal, *.rps)")
+    parser.add_argument('-o', '--output-dir', help="папка для результатов (по умолчанию - рядом с журналом)")
+    parser.add_argument('-f', '--format', choices=('png', 'pdf', 'svg') + TIMELAPSE_FORMATS, default='png',
+                        help="gif, apng, frames - таймлапс рисования (frames - PNG на каждый кадр)")
+    parser.add_argument('--size', type=parse_size, help="размер WxH (по умолчанию - по габаритам штрихов)")
+    parser.add_argument('--fps', type=float, default=10, help="кадров в секунду таймлапса")
+    parser.add_argument('--speedup', type=float, default=8.0, help="во сколько раз таймлапс быстрее рисования")
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help="увеличение PNG для печати (2-4); одиночный сеанс рисуется полосами на -j процессах")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help="число процессов")
+    args = parser.parse_args(argv)
+    
+    if args.output_dir and not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+    
+    # Один сеанс делится на полосы между процессами, несколько - идут по процессу на сеанс
+    band_workers = args.jobs if len(args.sessions) == 1 else 1
+    jobs = []
+    for path in args.sessions:
+        output = os.path.join(args.output_dir or os.path.dirname(path), output_name(path, args.format))
+        jobs.append((path, output, args.format, args.size, args.fps, args.speedup, args.scale, band_workers))
+    
+    failed = 0
+    if args.jobs > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            futures = [(job, pool.submit(render_file, *job)) for job in jobs]
+            results = [(job, future.exception()) for job, future in futures]
+    else:
+        results = []
+        for job in jobs:
+            try:
+                render_file(*job)
+                results.append((job, None))
+            except Exception as e:
+                results.append((job, e))
+    
+    for (path, output, *options), error in results:
+        if error is None:
+            print(f"{path} -> {output}")
+        else:
+            failed += 1
+            print(f"{path}: ошибка: {error}", file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
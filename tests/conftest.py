@@ -0,0 +1,9 @@
+"""Тесты движка рисунка (rabpaint_engine.py) - без Tk и без дисплея:
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
@@ -0,0 +1,60 @@
+"""Запекание в фон: холст не растет с длиной сеанса"""
+import math
+import random
+import statistics
+import time
+
+from rabpaint_engine import Stroke, select_bake
+
+from test_engine import scribble
+
+# Как в окне: ломаная режется на элементы холста по MAX_ITEM_POINTS точек,
+# запекание - при bake_item_limit элементах, оставляются bake_keep_recent штрихов
+MAX_ITEM_POINTS = 500
+ITEM_LIMIT = 1500
+KEEP_RECENT = 300
+
+def test_million_segment_session_keeps_canvas_flat():
+    rnd = random.Random(13)
+    live = {}
+    segments = 0
+    live_segments = []
+    costs = []
+    sid = 0
+    first_bake = None
+    while segments < 1_000_000:
+        sid += 1
+        stroke = Stroke(scribble(rnd, rnd.randint(50, 350)), 'red', 3, z=sid)
+        count = stroke.segment_count()
+        stroke.items = list(range(math.ceil(count / (MAX_ITEM_POINTS - 1))))
+        segments += count
+        live[sid] = (0.0, stroke)
+
+        start = time.perf_counter()
+        chosen = select_bake(live, ITEM_LIMIT, KEEP_RECENT, deadline=-1.0)
+        costs.append(time.perf_counter() - start)
+        if chosen and first_bake is None:
+            first_bake = len(costs) - 1
+        for baked_sid, baked in chosen:
+            del live[baked_sid]
+            baked.items = []
+
+        assert sum(len(entry[1].items) for entry in live.values()) <= ITEM_LIMIT + 1
+        live_segments.append(sum(entry[1].segment_count() for entry in live.values()))
+
+    # Перерисовка Tk идет по элементам холста: их отрезков в конце сеанса
+    # не больше, чем когда лимит сработал впервые
+    assert first_bake is not None
+    assert max(live_segments[first_bake:]) <= max(live_segments[:first_bake + 1])
+    assert max(live_segments) < 2 * ITEM_LIMIT * 350
+
+    # Стоимость выбора не растет вместе с рисунком
+    early = statistics.median(costs[first_bake:first_bake + 500])
+    late = statistics.median(costs[-500:])
+    assert late < 3 * early + 0.0005
+
+def test_old_stroke_bakes_everything_below():
+    live = {sid: (float(sid), Stroke([0, 0, 1, 1], 'red', 3, items=[sid], z=sid)) for sid in range(1, 6)}
+    chosen = select_bake(live, item_limit=100, keep_recent=1, deadline=3.5)
+    assert [sid for sid, stroke in chosen] == [1, 2, 3]
+    assert select_bake(live, item_limit=100, keep_recent=1, deadline=0.5) == []
@@ -0,0 +1,169 @@
+"""Копирование в буфер обмена через поддельные xclip/wl-copy и win32clipboard"""
+import io
+import os
+import signal
+import sys
+import textwrap
+import time
+import types
+
+import pytest
+from PIL import Image, ImageDraw
+
+import rabpaint_engine
+from rabpaint_engine import (CommandClipboard, PNGTileCache, Win32Clipboard, copy_png_to_clipboard,
+                             find_clipboard_backend)
+
+from test_png_cache import SIZE, decode, same, scribbled
+
+PNG = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 64
+
+def fake_backend(tmp_path, body):
+    """Скрипт-заменитель: читает PNG из stdin и выполняет body"""
+    script = tmp_path / 'fake_clip.py'
+    script.write_text(textwrap.dedent('''
+        import subprocess, sys, time
+        out = sys.argv[1]
+        data = sys.stdin.buffer.read()
+    ''') + textwrap.dedent(body))
+    return [sys.executable, str(script), str(tmp_path / 'clipboard.png')]
+
+def test_copy_returns_while_forked_helper_holds_selection(tmp_path):
+    # Как xclip: пишет выделение и оставляет фоновый процесс с унаследованным stderr
+    command = fake_backend(tmp_path, '''
+        open(out, 'wb').write(data)
+        child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])
+        open(out + '.pid', 'w').write(str(child.pid))
+    ''')
+    backend = CommandClipboard('fake', command, 'DISPLAY', timeout=5.0)
+    start = time.perf_counter()
+    try:
+        backend.copy_png(PNG)
+        assert time.perf_counter() - start < 3.0
+        assert (tmp_path / 'clipboard.png').read_bytes() == PNG
+    finally:
+        pid_file = tmp_path / 'clipboard.png.pid'
+        if pid_file.exists():
+            os.kill(int(pid_file.read_text()), signal.SIGTERM)
+
+def test_copy_reports_helper_error(tmp_path):
+    command = fake_backend(tmp_path, '''
+        sys.stderr.write('нет соединения с дисплеем\\n')
+        sys.exit(1)
+    ''')
+    backend = CommandClipboard('fake', command, 'DISPLAY')
+    with pytest.raises(RuntimeError, match='нет соединения с дисплеем'):
+        backend.copy_png(PNG)
+
+def test_copy_times_out_on_hung_helper(tmp_path):
+    command = fake_backend(tmp_path, '''
+        time.sleep(60)
+    ''')
+    backend = CommandClipboard('fake', command, 'DISPLAY', timeout=0.5)
+    start = time.perf_counter()
+    with pytest.raises(RuntimeError, match='не ответил'):
+        backend.copy_png(PNG)
+    assert time.perf_counter() - start < 5.0
+
+def test_find_backend_needs_display_and_program(monkeypatch, tmp_path):
+    command = fake_backend(tmp_path, '')
+    missing = CommandClipboard('missing', ['rabpaint-no-such-program'], 'RABPAINT_TEST_DISPLAY')
+    fake = CommandClipboard('fake', command, 'RABPAINT_TEST_DISPLAY')
+    monkeypatch.delenv('RABPAINT_TEST_DISPLAY', raising=False)
+    assert find_clipboard_backend([missing, fake]) is None
+    monkeypatch.setenv('RABPAINT_TEST_DISPLAY', ':0')
+    assert find_clipboard_backend([missing, fake]) is fake
+
+def counting_encodes(monkeypatch):
+    """Считает полосы, которые кэш PNG пережимает"""
+    encode = rabpaint_engine.encode_png_band
+    bands = []
+
+    def counting(band, level=6):
+        bands.append(band)
+        return encode(band, level)
+
+    monkeypatch.setattr(rabpaint_engine, 'encode_png_band', counting)
+    return bands
+
+def test_copy_encodes_once_until_drawing_changes(tmp_path, monkeypatch):
+    command = fake_backend(tmp_path, '''
+        open(out, 'wb').write(data)
+    ''')
+    backend = CommandClipboard('fake', command, 'DISPLAY', timeout=5.0)
+    clipboard = tmp_path / 'clipboard.png'
+    bands = counting_encodes(monkeypatch)
+    image = scribbled()
+    cache = PNGTileCache(band_height=64)
+
+    copy_png_to_clipboard(backend, cache, cache.prepare(image, SIZE))
+    assert len(bands) == 4
+    first = clipboard.read_bytes()
+    assert same(first, image)
+
+    # Рисунок не менялся: в буфер уходит тот же PNG без пережатия
+    clipboard.unlink()
+    copy_png_to_clipboard(backend, cache, cache.prepare(image, SIZE))
+    assert len(bands) == 4
+    assert clipboard.read_bytes() == first
+
+    ImageDraw.Draw(image).rectangle((20, 70, 80, 100), fill='green')
+    cache.mark_dirty((20, 70, 80, 100))
+    copy_png_to_clipboard(backend, cache, cache.prepare(image, SIZE))
+    assert len(bands) == 5
+    assert same(clipboard.read_bytes(), image)
+
+def fake_win32clipboard(monkeypatch):
+    """Модуль win32clipboard, который запоминает положенные в буфер данные"""
+    data = {}
+    module = types.SimpleNamespace(
+        CF_DIB=8,
+        RegisterClipboardFormat=lambda name: 0xC000,
+        OpenClipboard=lambda: None,
+        EmptyClipboard=data.clear,
+        SetClipboardData=data.__setitem__,
+        CloseClipboard=lambda: None,
+    )
+    monkeypatch.setitem(sys.modules, 'win32clipboard', module)
+    return data
+
+def dib_image(dib):
+    """Картинка из CF_DIB: перед ним достаточно вернуть заголовок файла BMP"""
+    header_size = int.from_bytes(dib[:4], 'little')
+    header = b'BM' + (14 + len(dib)).to_bytes(4, 'little') + bytes(4) + (14 + header_size).to_bytes(4, 'little')
+    with Image.open(io.BytesIO(header + dib)) as image:
+        return image.convert('RGB')
+
+def test_win32_dib_is_derived_once_per_png(monkeypatch):
+    clipboard = fake_win32clipboard(monkeypatch)
+    image = scribbled()
+    cache = PNGTileCache(band_height=64)
+    backend = Win32Clipboard()
+    image_open = Image.open
+    decoded = []
+
+    def counting_open(fp, *args, **kwargs):
+        decoded.append(fp)
+        return image_open(fp, *args, **kwargs)
+
+    monkeypatch.setattr(Image, 'open', counting_open)
+    png = cache.encode(cache.prepare(image, SIZE))
+    backend.copy_png(png)
+    first = clipboard[8]
+    assert clipboard[0xC000] is png
+    assert len(decoded) == 1
+
+    # Тот же PNG из кэша - DIB не пересчитывается
+    backend.copy_png(cache.encode(cache.prepare(image, SIZE)))
+    assert len(decoded) == 1
+    assert clipboard[8] is first
+
+    changed = image.copy()
+    ImageDraw.Draw(changed).rectangle((0, 0, 50, 50), fill='red')
+    cache.mark_dirty((0, 0, 50, 50))
+    backend.copy_png(cache.encode(cache.prepare(changed, SIZE)))
+    assert len(decoded) == 2
+    monkeypatch.setattr(Image, 'open', image_open)
+    assert dib_image(first).tobytes() == image.tobytes()
+    assert dib_image(clipboard[8]).tobytes() == changed.tobytes()
+    assert decode(clipboard[0xC000]).tobytes() == changed.tobytes()
@@ -0,0 +1,51 @@
+"""Модель рисунка: память на точку и пространственный индекс"""
+import gc
+import random
+import sys
+import tracemalloc
+from array import array
+
+from rabpaint_engine import Document, Stroke
+
+def scribble(rnd, points, width=1920, height=1080):
+    x, y = rnd.uniform(0, width), rnd.uniform(0, height)
+    xy = array('f')
+    for _ in range(points):
+        x = min(width, max(0, x + rnd.uniform(-5, 5)))
+        y = min(height, max(0, y + rnd.uniform(-5, 5)))
+        xy.extend((x, y))
+    return xy
+
+def index_nbytes(grid):
+    """Память сетки SpatialGrid: словари клеток, массивы номеров отрезков, ключи"""
+    size = sys.getsizeof(grid.cells) + sys.getsizeof(grid.stroke_cells)
+    for key, cell in grid.cells.items():
+        size += sys.getsizeof(key) + sys.getsizeof(cell)
+        size += sum(sys.getsizeof(segments) for segments in cell.values())
+    size += sum(sys.getsizeof(keys) for keys in grid.stroke_cells.values())
+    return size
+
+def test_million_point_session_memory():
+    # 1000 штрихов по 1000 точек. Координаты готовим заранее списками: Stroke
+    # сам упакует их в array('f'), и трассировка увидит только память модели
+    rnd = random.Random(5)
+    points = [scribble(rnd, 1000).tolist() for _ in range(1000)]
+    gc.collect()
+    tracemalloc.start()
+    try:
+        strokes = [Stroke(xy, 'red', 3) for xy in points]
+        stroke_bytes = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del points
+    
+    document = Document()
+    for stroke in strokes:
+        document.add(stroke)
+    
+    assert document.point_count() == 1_000_000
+    # Точки - два float32 (8 байт) плюс накладные расходы штриха (см. docstring Stroke)
+    assert document.nbytes() == 8 * 1_000_000
+    assert stroke_bytes / 1_000_000 < 8.6
+    # Индекс ластика - около 7 байт на отрезок
+    assert index_nbytes(document.index) / 999_000 < 8.0
@@ -0,0 +1,97 @@
+"""Экспорт: PNG в высоком разрешении полосами, векторные форматы и таймлапс"""
+import random
+import zlib
+
+from PIL import Image, ImageChops
+
+import rabpaint_engine
+from rabpaint_engine import (SessionFile, Stroke, Viewport, export_timelapse, render_strokes,
+                             write_journal_snapshot, write_scaled_png, write_svg, write_vector_pdf)
+
+from test_engine import scribble
+
+SIZE = (640, 360)
+
+def make_session(path, count, seed=22):
+    """Каракули по всему экрану и пара заливок-прямоугольников"""
+    rnd = random.Random(seed)
+    strokes = []
+    for i in range(count):
+        strokes.append(Stroke(scribble(rnd, 30, *SIZE), rnd.choice(('red', 'blue', 'black')),
+                              rnd.choice((1, 3, 6))))
+        if i % 50 == 0:
+            x, y = rnd.uniform(0, SIZE[0] - 100), rnd.uniform(0, SIZE[1] - 80)
+            strokes.append(Stroke([x, y, x + 100.3, y + 75.7], 'yellow', 0, 'rect'))
+    write_journal_snapshot(strokes, path)
+    return strokes
+
+def test_band_loads_only_its_strokes(tmp_path, monkeypatch):
+    path = str(tmp_path / 'session.journal')
+    strokes = make_session(path, 400)
+    loaded = []
+    stroke = SessionFile.stroke
+
+    def counting_stroke(self, i):
+        loaded.append(i)
+        return stroke(self, i)
+
+    monkeypatch.setattr(SessionFile, 'stroke', counting_stroke)
+    width, height = write_scaled_png(path, str(tmp_path / 'out.png'), SIZE, scale=2, band_height=64)
+    bands = -(-height // 64)
+    # Каждая полоса достает из файла только штрихи рядом с собой
+    assert len(loaded) < len(strokes) * bands / 3
+    assert rabpaint_engine._band_state is None
+
+def test_bands_match_render_strokes(tmp_path):
+    # Увеличение 3: точки x3 в float32 и float64 округляются по-разному
+    # на границах пикселей, так что полосы должны пересчитывать точки так же
+    path = str(tmp_path / 'session.journal')
+    strokes = make_session(path, 300)
+    for scale, band_height in ((3, 256), (3, 50), (2.5, 64)):
+        output = str(tmp_path / 'out.png')
+        size = write_scaled_png(path, output, SIZE, scale=scale, band_height=band_height)
+        view = Viewport(0.0, 0.0, scale)
+        expected = render_strokes([view.stroke_to_screen(stroke) for stroke in strokes], size)
+        with Image.open(output) as image:
+            diff = ImageChops.difference(image.convert('RGB'), expected)
+        assert diff.getbbox() is None, (scale, band_height, diff.getbbox())
+
+def panned_session():
+    """Штрих далеко от начала координат мира и вид, прокрученный к нему с увеличением 2"""
+    near = Stroke([5000, 3000, 5050, 3020, 5100, 3000], 'red', 3)
+    away = Stroke([10, 10, 60, 60], 'blue', 3)
+    fill = Stroke([5020, 3040, 5060, 3070], 'green', 0, 'rect')
+    return [away, near, fill], Viewport(4900.0, 2950.0, 2.0)
+
+def test_svg_and_pdf_show_the_panned_view(tmp_path):
+    strokes, view = panned_session()
+    svg = str(tmp_path / 'out.svg')
+    write_svg(strokes, (400, 300), svg, view)
+    text = open(svg, encoding='utf-8').read()
+    # Точки - в координатах страницы, толщина - с увеличением
+    assert 'points="200 100 300 140 400 100"' in text
+    assert 'stroke-width="6"' in text
+    assert '<rect fill="green" x="240.0" y="180.0" width="80.0" height="60.0"/>' in text
+    # Штрих вне вида на страницу не попадает
+    assert 'blue' not in text
+
+    pdf = str(tmp_path / 'out.pdf')
+    write_vector_pdf(strokes, (400, 300), pdf, view)
+    data = open(pdf, 'rb').read()
+    start = data.index(b'stream\n') + len(b'stream\n')
+    content = zlib.decompress(data[start:data.index(b'\nendstream')]).decode('ascii')
+    assert '200 100 m\n300 140 l\n400 100 l\nS' in content
+    assert '240.00 180.00 80.00 60.00 re f' in content
+    assert content.count(' RG ') == 1
+
+def test_timelapse_shows_the_panned_view(tmp_path):
+    strokes, view = panned_session()
+    journal = str(tmp_path / 'session.journal')
+    write_journal_snapshot(strokes, journal)
+    pattern = str(tmp_path / 'frame_%05d.png')
+    frames = export_timelapse(journal, pattern, (400, 300), fps=10, speedup=8.0, view=view)
+    with Image.open(pattern % (frames - 1)) as image:
+        last = image.convert('RGB')
+    expected = render_strokes([view.stroke_to_screen(stroke) for stroke in strokes], (400, 300))
+    assert ImageChops.difference(last, expected).getbbox() is None
+    assert last.getpixel((250, 120)) == (255, 0, 0)
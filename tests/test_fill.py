@@ -0,0 +1,57 @@
+"""Заливка: маска NumPy совпадает с ImageDraw.floodfill пиксель в пиксель"""
+import random
+import sys
+
+import pytest
+from PIL import Image, ImageDraw
+
+from rabpaint_engine import flood_fill_mask
+
+from test_engine import scribble
+
+SIZE = (1024, 256)
+
+def comb_page(seed=21):
+    """Гребенка серых зубцов через два пикселя, рамка с закрытой областью и каракули
+
+    Отрезков строк больше 65 тысяч, так что seed_runs идет и волнами поиска,
+    и через слияние деревьев. Белые щели между зубцами сходятся сверху и
+    снизу - U-образные области, в которых отрезок строки под двумя отрезками
+    строки выше. Серый отличается от белого на 55, так что допуск 60
+    сливает зубцы с фоном.
+    """
+    rnd = random.Random(seed)
+    image = Image.new('RGB', SIZE, 'white')
+    draw = ImageDraw.Draw(image)
+    for x in range(0, SIZE[0], 3):
+        top = 8 if x % 240 else 0
+        draw.line((x, top, x, SIZE[1] - 9), fill=(200, 200, 200))
+    draw.rectangle((400, 100, 460, 105), fill='white', outline='black')
+    for _ in range(12):
+        draw.line(list(scribble(rnd, 60, *SIZE)), fill=rnd.choice(('red', 'blue', 'black')), width=2)
+    return image
+
+def fallback_fill(monkeypatch, image, x, y, tolerance):
+    with monkeypatch.context() as patch:
+        # import numpy внутри flood_fill_mask падает с ImportError
+        patch.setitem(sys.modules, 'numpy', None)
+        return flood_fill_mask(image, x, y, tolerance)
+
+@pytest.mark.parametrize('x, y', [
+    (430, 103),     # закрытая рамка: поиск кончается волнами
+    (1, 2),         # фон вокруг гребенки со щелями
+    (0, 100),       # серый зубец
+    (1000, 250),    # нижний край
+])
+@pytest.mark.parametrize('tolerance', [0, 60])
+def test_mask_matches_imagedraw_floodfill(monkeypatch, x, y, tolerance):
+    image = comb_page()
+    expected = fallback_fill(monkeypatch, image, x, y, tolerance)
+    assert flood_fill_mask(image, x, y, tolerance) == expected
+
+def test_grayscale_and_outside_points(monkeypatch):
+    image = comb_page(seed=5).convert('L')
+    for x, y in ((430, 103), (2, 2), (150, 50)):
+        assert flood_fill_mask(image, x, y, 10) == fallback_fill(monkeypatch, image, x, y, 10)
+    assert flood_fill_mask(image, -1, 0) is None
+    assert flood_fill_mask(image, SIZE[0], 0) is None
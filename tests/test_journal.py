@@ -0,0 +1,143 @@
+"""Журнал автосохранения: оборванный хвост и ошибки записи"""
+import errno
+import os
+import threading
+
+import pytest
+
+import rabpaint_engine
+from rabpaint_engine import (AutosaveJournal, JOURNAL_MAGIC, Stroke, encode_journal_add,
+                             load_journal, load_session)
+
+def make_strokes(count):
+    return {sid: Stroke([sid, 0, sid + 10, 5, sid + 20, 0], 'blue', 2, z=sid)
+            for sid in range(1, count + 1)}
+
+def write_journal(path, strokes):
+    """Пишет журнал и возвращает смещения концов записей"""
+    ends = []
+    with open(path, 'wb') as f:
+        f.write(JOURNAL_MAGIC)
+        for sid, stroke in strokes.items():
+            f.write(encode_journal_add(sid, stroke))
+            ends.append(f.tell())
+    return ends
+
+def points(strokes):
+    return [list(stroke.points) for stroke in strokes]
+
+@pytest.mark.parametrize('cut', [
+    'header',       # посреди заголовка записи
+    'payload',      # посреди данных
+    'crc',          # посреди контрольной суммы
+])
+def test_truncated_tail_is_dropped(tmp_path, cut):
+    path = str(tmp_path / 'session.journal')
+    strokes = make_strokes(5)
+    ends = write_journal(path, strokes)
+    last_start, last_end = ends[-2], ends[-1]
+    size = {'header': last_start + 3, 'payload': last_start + 20, 'crc': last_end - 2}[cut]
+    with open(path, 'r+b') as f:
+        f.truncate(size)
+
+    assert sorted(load_journal(path)) == [1, 2, 3, 4]
+    assert points(load_session(path)) == points(list(strokes.values())[:4])
+
+def test_corrupt_record_stops_reading(tmp_path):
+    path = str(tmp_path / 'session.journal')
+    ends = write_journal(path, make_strokes(5))
+    with open(path, 'r+b') as f:
+        f.seek(ends[2] + 12)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes((byte[0] ^ 0xFF,)))
+
+    assert sorted(load_journal(path)) == [1, 2, 3]
+
+def test_restart_after_truncation_appends(tmp_path):
+    path = str(tmp_path / 'session.journal')
+    ends = write_journal(path, make_strokes(3))
+    with open(path, 'r+b') as f:
+        f.truncate(ends[-1] - 1)
+
+    journal = AutosaveJournal(path)
+    strokes = load_journal(path)
+    journal.start(strokes)
+    journal.add(7, Stroke([0, 0, 1, 1], 'red', 3))
+    journal.close()
+    assert journal.error is None
+    assert sorted(load_journal(path)) == [1, 2, 7]
+
+def test_write_error_stops_journal(tmp_path, monkeypatch):
+    path = str(tmp_path / 'session.journal')
+    calls = []
+    real_fsync = os.fsync
+
+    def failing_fsync(fd):
+        # Сжатие при старте проходит, первая запись событий - нет
+        calls.append(fd)
+        if len(calls) > 1:
+            raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+        real_fsync(fd)
+
+    monkeypatch.setattr(rabpaint_engine.os, 'fsync', failing_fsync)
+    journal = AutosaveJournal(path, sync_interval=0)
+    journal.start({})
+    journal.add(1, Stroke([0, 0, 1, 1], 'red', 3))
+    journal.thread.join(5)
+    assert not journal.thread.is_alive()
+    assert journal.error.errno == errno.ENOSPC
+
+    # Дальше события не копятся, закрытие не виснет
+    for sid in range(2, 1000):
+        journal.add(sid, Stroke([0, 0, 1, 1], 'red', 3))
+    journal.remove(1)
+    journal.clear()
+    assert journal.queue.qsize() == 0
+    journal.close()
+
+def test_unwritable_path_reports_error(tmp_path):
+    journal = AutosaveJournal(str(tmp_path / 'missing' / 'session.journal'))
+    journal.start(make_strokes(2))
+    journal.thread.join(5)
+    assert isinstance(journal.error, OSError)
+    journal.add(3, Stroke([0, 0, 1, 1], 'red', 3))
+    assert journal.queue.qsize() == 0
+    journal.close()
+
+def test_flush_waits_for_queued_events(tmp_path):
+    path = str(tmp_path / 'session.journal')
+    journal = AutosaveJournal(path, sync_interval=60)
+    journal.start({})
+    strokes = make_strokes(200)
+    for sid, stroke in strokes.items():
+        journal.add(sid, stroke)
+    journal.remove(3)
+    assert journal.flush(timeout=5)
+    # Файл читается, пока журнал еще открыт - как при сохранении таймлапса
+    assert sorted(load_journal(path)) == sorted(set(strokes) - {3})
+    journal.close()
+    assert not journal.flush()
+
+def test_flush_after_error_returns_false(tmp_path):
+    journal = AutosaveJournal(str(tmp_path / 'missing' / 'session.journal'))
+    journal.start({})
+    assert not journal.flush(timeout=5)
+    journal.close()
+
+def test_mark_waits_in_another_thread(tmp_path):
+    path = str(tmp_path / 'session.journal')
+    journal = AutosaveJournal(path, sync_interval=60)
+    journal.start({})
+    strokes = make_strokes(200)
+    for sid, stroke in strokes.items():
+        journal.add(sid, stroke)
+    # Отметку ставит главный поток, ждет ее фоновая задача - как таймлапс
+    wait = journal.mark()
+    results = []
+    waiter = threading.Thread(target=lambda: results.append((wait(timeout=5), sorted(load_journal(path)))))
+    waiter.start()
+    waiter.join(10)
+    assert results == [(True, sorted(strokes))]
+    journal.close()
+    assert not journal.mark()()
@@ -0,0 +1,133 @@
+"""PNG из независимо сжатых полос: склейка, частичное пережатие, ошибки"""
+import io
+import random
+import zlib
+
+import pytest
+from PIL import Image, ImageChops, ImageDraw
+
+import rabpaint_engine
+from rabpaint_engine import PNGTileCache, adler32_combine
+
+SIZE = (300, 200)
+
+def decode(png):
+    with Image.open(io.BytesIO(png)) as image:
+        return image.convert('RGB')
+
+def same(png, image):
+    return ImageChops.difference(decode(png), image).getbbox() is None
+
+def scribbled(seed=1):
+    rnd = random.Random(seed)
+    image = Image.new('RGB', SIZE, 'white')
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        draw.line([(rnd.uniform(0, SIZE[0]), rnd.uniform(0, SIZE[1])) for _ in range(5)],
+                  fill=rnd.choice(('red', 'blue', 'black')), width=3)
+    return image
+
+def test_adler32_combine_matches_zlib():
+    rnd = random.Random(15)
+    for length in (0, 1, 100, 65521, 200000):
+        first = bytes(rnd.getrandbits(8) for _ in range(rnd.randint(0, 5000)))
+        second = bytes(rnd.getrandbits(8) for _ in range(length))
+        combined = adler32_combine(zlib.adler32(first), zlib.adler32(second), len(second))
+        assert combined == zlib.adler32(first + second)
+
+def test_bands_splice_into_valid_png():
+    image = scribbled()
+    # Высота не кратна полосе: последняя полоса короче
+    cache = PNGTileCache(band_height=64)
+    png = cache.encode(cache.prepare(image, SIZE))
+    assert same(png, image)
+    # Поток zlib склеенных полос целиком проверяется распаковкой
+    start = png.index(b'IDAT') + 4
+    length = int.from_bytes(png[start - 8:start - 4], 'big')
+    raw = zlib.decompress(png[start:start + length])
+    assert len(raw) == SIZE[1] * (1 + 3 * SIZE[0])
+
+def test_partial_reencode_only_dirty_bands():
+    image = scribbled()
+    cache = PNGTileCache(band_height=64)
+    cache.encode(cache.prepare(image, SIZE))
+
+    ImageDraw.Draw(image).rectangle((20, 70, 80, 100), fill='green')
+    cache.mark_dirty((20, 70, 80, 100))
+    job = cache.prepare(image, SIZE)
+    assert sorted(job[2]) == [1]
+    png = cache.encode(job)
+    assert same(png, image)
+    # Те же байты, что у PNG, сжатого с нуля
+    fresh = PNGTileCache(band_height=64)
+    assert png == fresh.encode(fresh.prepare(image, SIZE))
+
+def test_nothing_changed_reuses_png():
+    image = scribbled()
+    cache = PNGTileCache(band_height=64)
+    png = cache.encode(cache.prepare(image, SIZE))
+    assert cache.prepare(image, SIZE) is None
+    assert cache.encode(None) is png
+
+def failing_once(monkeypatch):
+    encode = rabpaint_engine.encode_png_band
+    calls = []
+
+    def flaky(band, level=6):
+        calls.append(band)
+        if len(calls) == 2:
+            raise MemoryError("нет памяти")
+        return encode(band, level)
+
+    monkeypatch.setattr(rabpaint_engine, 'encode_png_band', flaky)
+
+def test_failed_partial_job_is_reencoded(monkeypatch):
+    image = scribbled()
+    cache = PNGTileCache(band_height=64)
+    cache.encode(cache.prepare(image, SIZE))
+
+    ImageDraw.Draw(image).rectangle((0, 10, 299, 150), fill='green')
+    cache.mark_dirty((0, 10, 299, 150))
+    failing_once(monkeypatch)
+    with pytest.raises(MemoryError):
+        cache.encode(cache.prepare(image, SIZE))
+    with pytest.raises(RuntimeError):
+        cache.encode(None)
+
+    # Рисунок не менялся, но полосы неудачной задачи пережимаются заново
+    job = cache.prepare(image, SIZE)
+    assert job is not None and sorted(job[2]) == [0, 1, 2]
+    assert same(cache.encode(job), image)
+
+def test_failed_first_job_is_reencoded(monkeypatch):
+    image = scribbled()
+    cache = PNGTileCache(band_height=64)
+    failing_once(monkeypatch)
+    with pytest.raises(MemoryError):
+        cache.encode(cache.prepare(image, SIZE))
+
+    ImageDraw.Draw(image).rectangle((10, 10, 20, 20), fill='green')
+    cache.mark_dirty((10, 10, 20, 20))
+    job = cache.prepare(image, SIZE)
+    assert sorted(job[2]) == [0, 1, 2, 3]
+    assert same(cache.encode(job), image)
+
+def test_job_prepared_before_failure_does_not_return_stale_png(monkeypatch):
+    image = scribbled()
+    cache = PNGTileCache(band_height=64)
+    cache.encode(cache.prepare(image, SIZE))
+
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, 299, 130), fill='green')
+    cache.mark_dirty((0, 0, 299, 130))
+    failed = cache.prepare(image, SIZE)
+    draw.rectangle((0, 190, 10, 199), fill='red')
+    cache.mark_dirty((0, 190, 10, 199))
+    later = cache.prepare(image, SIZE)
+
+    failing_once(monkeypatch)
+    with pytest.raises(MemoryError):
+        cache.encode(failed)
+    with pytest.raises(RuntimeError):
+        cache.encode(later)
+    assert same(cache.encode(cache.prepare(image, SIZE)), image)
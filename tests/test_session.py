@@ -0,0 +1,84 @@
+"""Файл сеанса: запись и чтение через mmap, индекс query, оборванный файл"""
+import math
+import random
+
+import pytest
+
+from rabpaint_engine import Layer, SessionFile, Stroke, Viewport, write_session_file
+
+from test_engine import scribble
+
+def make_strokes():
+    """Штрихи двух слоев, фигура и заливка с маской; цвета повторяются"""
+    mask = (13, 3, bytes(range(6)))
+    return {
+        4: Stroke([10, 10, 20, 25, 30, 10], 'red', 3, z=2, started=1.7e9, duration=0.5),
+        2: Stroke([0, 0, 5, 5], '#336699', 6, z=1, layer=7),
+        9: Stroke([40, 50, 90, 80], 'red', 0, 'rect', z=3),
+        6: Stroke([100, 120], 'green', 0, 'fill', z=4, mask=mask),
+    }
+
+def fields(sid, stroke):
+    return (sid, list(stroke.points), stroke.color, stroke.width, stroke.tool, stroke.z, stroke.layer,
+            stroke.started, stroke.duration, stroke.mask)
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'drawing.rps')
+    strokes = make_strokes()
+    layers = [Layer(0, 'Рисунок'), Layer(7, 'Заметки', visible=False)]
+    write_session_file(path, strokes, layers, Viewport(-50.0, 20.0, 2.5))
+
+    session = SessionFile(path).open()
+    try:
+        assert [(layer.lid, layer.name, layer.visible) for layer in session.layers] == \
+            [(0, 'Рисунок', True), (7, 'Заметки', False)]
+        assert (session.view.x, session.view.y, session.view.zoom) == (-50.0, 20.0, 2.5)
+        assert len(session) == 4 and session.next_id == 10
+        # Каждый цвет записан один раз, в порядке наложения
+        assert session.colors == ['red', 'green', '#336699']
+        # Порядок наложения: слои снизу вверх, внутри слоя - по z
+        loaded = list(session.strokes())
+        assert [sid for sid, stroke in loaded] == [4, 9, 6, 2]
+        assert [fields(*item) for item in loaded] == [fields(sid, strokes[sid]) for sid in (4, 9, 6, 2)]
+    finally:
+        session.close()
+
+def test_truncated_records(tmp_path):
+    path = str(tmp_path / 'drawing.rps')
+    write_session_file(path, make_strokes(), [Layer(0, 'Рисунок')])
+    session = SessionFile(path).open()
+    offset = session.records_offset
+    session.close()
+    with open(path, 'r+b') as f:
+        f.truncate(offset + 50)
+    with pytest.raises(ValueError, match="файл сеанса оборван"):
+        SessionFile(path).open()
+
+def test_query_index_matches_scan(tmp_path):
+    rnd = random.Random(25)
+    strokes = {sid: Stroke(scribble(rnd, 40, 4000, 3000), 'blue', rnd.choice((1, 3, 9)), z=sid)
+               for sid in range(1, 3001)}
+    # Высокие штрихи портят нижний край своего блока - он не должен их терять
+    strokes[3001] = Stroke([100, 0, 120, 3000], 'red', 3, z=3001)
+    strokes[3002] = Stroke([3900, 10, 3950, 2990], 'red', 3, z=3002)
+    path = str(tmp_path / 'drawing.rps')
+    write_session_file(path, strokes, [Layer(0, 'Рисунок')])
+
+    session = SessionFile(path).open()
+    try:
+        def scan(bbox):
+            pad = session.pad
+            return [i for i, (x0, y0, x1, y1) in enumerate(zip(*session.boxes))
+                    if x0 <= bbox[2] + pad and x1 >= bbox[0] - pad and y0 <= bbox[3] + pad and y1 >= bbox[1] - pad]
+
+        boxes = [(-math.inf, top, math.inf, top + 64) for top in range(-100, 3100, 64)]
+        for _ in range(200):
+            x, y = rnd.uniform(-500, 4500), rnd.uniform(-500, 3500)
+            boxes.append((x, y, x + rnd.choice((1, 50, 800)), y + rnd.choice((1, 50, 600))))
+        boxes.append((-1e9, -1e9, 1e9, 1e9))
+        session.query(boxes[0])
+        for bbox in boxes:
+            assert session.query(bbox) == scan(bbox), bbox
+        assert session.order is not None
+    finally:
+        session.close()
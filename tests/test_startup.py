@@ -0,0 +1,85 @@
+"""Бюджет запуска: окно до первого кадра и импорт движка
+
+Первый кадр меряет benchmarks/bench_startup.py - для этого нужен дисплей
+(на сервере - xvfb-run python -m pytest). Импорт движка меряется всегда:
+окно ждет его до первого кадра, и именно он растет, когда тяжелый
+импорт возвращается на уровень модуля. Так же всегда проверяется, что
+журнал прошлого сеанса окно читает только после первого кадра.
+"""
+import ast
+import os
+import statistics
+import subprocess
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_DIR, "rabpaint 2.py")
+sys.path.insert(0, os.path.join(REPO_DIR, 'benchmarks'))
+
+import bench_startup  # noqa: E402
+
+# Медиана импорта rabpaint_engine с прогретым кэшем байткода, мс
+# (до ленивого импорта было 104-139 мс, после - около 10)
+IMPORT_BUDGET_MS = 50.0
+
+# Модули, которые движок импортирует только внутри функций
+LAZY_MODULES = ('PIL', 'json', 'subprocess', 'shutil', 'argparse', 'concurrent.futures', 'tkinter')
+
+PROBE = '''
+import sys, time
+start = time.perf_counter()
+import rabpaint_engine
+elapsed = (time.perf_counter() - start) * 1000
+print({'ms': elapsed, 'modules': [m for m in %r if m in sys.modules]})
+''' % (LAZY_MODULES,)
+
+def time_engine_import():
+    env = dict(os.environ)
+    # Первый запуск пишет кэш байткода, дальше меряется прогретый импорт
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    output = subprocess.check_output([sys.executable, '-c', PROBE], cwd=REPO_DIR, env=env, text=True)
+    return ast.literal_eval(output)
+
+def test_engine_import_is_lazy():
+    assert time_engine_import()['modules'] == []
+
+def test_engine_import_budget():
+    time_engine_import()
+    times = [time_engine_import()['ms'] for _ in range(5)]
+    median = statistics.median(times)
+    assert median <= IMPORT_BUDGET_MS, f"импорт движка {median:.1f} мс, бюджет {IMPORT_BUDGET_MS:g} мс"
+
+# Вызовы, которые читают журнал или восстанавливают по нему рисунок
+RESTORE_CALLS = {'restore', 'finish_restore', 'start_autosave', 'load_journal', 'read_journal_records'}
+
+def called_names(node):
+    for call in ast.walk(node):
+        if isinstance(call, ast.Call):
+            func = call.func
+            yield func.attr if isinstance(func, ast.Attribute) else getattr(func, 'id', None)
+
+def test_journal_is_restored_after_first_frame():
+    with open(APP_PATH, encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    functions = {node.name: node for node in tree.body if isinstance(node, ast.FunctionDef)}
+    # На уровне модуля - то есть до mainloop и первого кадра - журнал не читается
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            assert not RESTORE_CALLS & set(called_names(node)), ast.unparse(node)[:200]
+    assert 'restore' in called_names(functions['finish_startup'])
+
+@pytest.mark.skipif(sys.platform != 'win32' and not os.environ.get('DISPLAY'),
+                    reason="нужен дисплей (xvfb-run)")
+@pytest.mark.parametrize('journal_strokes', [0, 20000])
+def test_first_frame_budget(tmp_path, journal_strokes):
+    journal = None
+    if journal_strokes:
+        journal = str(tmp_path / 'session.journal')
+        bench_startup.make_journal(journal, journal_strokes)
+    bench_startup.time_startup(journal=journal)
+    times = [bench_startup.time_startup(journal=journal) for _ in range(5)]
+    median = statistics.median(times)
+    budget = bench_startup.BUDGET_MS
+    assert median <= budget, f"первый кадр {median:.1f} мс, бюджет {budget:g} мс"